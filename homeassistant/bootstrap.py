@@ -20,9 +20,10 @@ import homeassistant.util.dt as date_util
 import homeassistant.util.location as loc_util
 import homeassistant.util.package as pkg_util
 from homeassistant.const import (
-    CONF_CUSTOMIZE, CONF_LATITUDE, CONF_LONGITUDE, CONF_NAME,
-    CONF_TEMPERATURE_UNIT, CONF_TIME_ZONE, EVENT_COMPONENT_LOADED,
-    TEMP_CELSIUS, TEMP_FAHRENHEIT, PLATFORM_FORMAT, __version__)
+    CONF_CUSTOMIZE, CONF_JOB_QUEUE_LIMITS, CONF_LATITUDE, CONF_LONGITUDE,
+    CONF_MAX_WORKER_THREADS, CONF_NAME, CONF_TEMPERATURE_UNIT, CONF_TIME_ZONE,
+    EVENT_COMPONENT_LOADED, TEMP_CELSIUS, TEMP_FAHRENHEIT, PLATFORM_FORMAT,
+    __version__)
 from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers import (
     event_decorators, service, config_per_platform, extract_domain_configs)
@@ -419,6 +420,20 @@ def process_ha_core_config(hass, config):
     if CONF_TEMPERATURE_UNIT in config:
         hac.temperature_unit = config[CONF_TEMPERATURE_UNIT]
 
+    if CONF_MAX_WORKER_THREADS in config:
+        hass.pool.max_worker_count = config[CONF_MAX_WORKER_THREADS]
+
+    for name, limit in config.get(CONF_JOB_QUEUE_LIMITS, {}).items():
+        try:
+            priority = core.JobPriority[name.upper()]
+        except KeyError:
+            _LOGGER.error('Unknown job priority %s in %s', name,
+                          CONF_JOB_QUEUE_LIMITS)
+            continue
+
+        hass.pool.set_limit(priority, limit[config_util.CONF_MAX],
+                            limit[config_util.CONF_OVERFLOW])
+
     # If we miss some of the needed values, auto detect them
     if None not in (
             hac.latitude, hac.longitude, hac.temperature_unit, hac.time_zone):
@@ -8,18 +8,21 @@ import json
 import logging
 import re
 import threading
+from collections import deque
 
 import homeassistant.core as ha
 import homeassistant.remote as rem
 from homeassistant.bootstrap import ERROR_LOG_FILENAME
+from homeassistant.components.http import WS_CLOSE_GOING_AWAY
 from homeassistant.const import (
-    CONTENT_TYPE_TEXT_PLAIN, EVENT_HOMEASSISTANT_STOP, EVENT_TIME_CHANGED,
+    ATTR_ENTITY_ID, CONTENT_TYPE_TEXT_PLAIN, EVENT_HOMEASSISTANT_STOP,
+    EVENT_STATE_CHANGED, EVENT_TIME_CHANGED,
     HTTP_BAD_REQUEST, HTTP_CREATED, HTTP_HEADER_CONTENT_TYPE, HTTP_NOT_FOUND,
     HTTP_OK, HTTP_UNPROCESSABLE_ENTITY, MATCH_ALL, URL_API, URL_API_COMPONENTS,
     URL_API_CONFIG, URL_API_DISCOVERY_INFO, URL_API_ERROR_LOG,
-    URL_API_EVENT_FORWARD, URL_API_EVENTS, URL_API_LOG_OUT, URL_API_SERVICES,
-    URL_API_STATES, URL_API_STATES_ENTITY, URL_API_STREAM, URL_API_TEMPLATE,
-    __version__)
+    URL_API_EVENT_FORWARD, URL_API_EVENTS, URL_API_LOG_OUT, URL_API_POOL,
+    URL_API_SERVICES, URL_API_STATES, URL_API_STATES_ENTITY, URL_API_STREAM,
+    URL_API_TEMPLATE, URL_API_WEBSOCKET, __version__)
 from homeassistant.exceptions import TemplateError
 from homeassistant.helpers.state import TrackStates
 from homeassistant.helpers import template
@@ -30,6 +33,13 @@ DEPENDENCIES = ['http']
 STREAM_PING_PAYLOAD = "ping"
 STREAM_PING_INTERVAL = 50  # seconds
 
+# Error codes of the WebSocket API
+ERR_INVALID_FORMAT = 'invalid_format'
+ERR_UNKNOWN_COMMAND = 'unknown_command'
+ERR_NOT_FOUND = 'not_found'
+ERR_ID_REUSE = 'id_reuse'
+ERR_UNKNOWN_ERROR = 'unknown_error'
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -47,7 +57,12 @@ def setup(hass, config):
                             require_auth=False)
 
     # /api/stream
-    hass.http.register_path('GET', URL_API_STREAM, _handle_get_api_stream)
+    hass.http.register_path('GET', URL_API_STREAM,
+                            StreamHub(hass).handle_get_api_stream)
+
+    # /api/websocket
+    hass.http.register_path('GET', URL_API_WEBSOCKET,
+                            _handle_get_api_websocket)
 
     # /api/states
     hass.http.register_path('GET', URL_API_STATES, _handle_get_api_states)
@@ -99,6 +114,9 @@ def setup(hass, config):
     hass.http.register_path('POST', URL_API_TEMPLATE,
                             _handle_post_api_template)
 
+    # /api/pool
+    hass.http.register_path('GET', URL_API_POOL, _handle_get_api_pool)
+
     return True
 
 
@@ -107,74 +125,383 @@ def _handle_get_api(handler, path_match, data):
     handler.write_json_message("API running.")
 
 
-def _handle_get_api_stream(handler, path_match, data):
-    """Provide a streaming interface for the event bus."""
-    gracefully_closed = False
-    hass = handler.server.hass
-    wfile = handler.wfile
-    write_lock = threading.Lock()
-    block = threading.Event()
-    session_id = None
-
-    restrict = data.get('restrict')
-    if restrict:
-        restrict = restrict.split(',')
-
-    def write_message(payload):
-        """Write a message to the output."""
-        with write_lock:
-            msg = "data: {}\n\n".format(payload)
-
-            try:
-                wfile.write(msg.encode("UTF-8"))
-                wfile.flush()
-            except (IOError, ValueError):
-                # IOError: socket errors
-                # ValueError: raised when 'I/O operation on closed file'
-                block.set()
-
-    def forward_events(event):
-        """Forward events to the open request."""
-        nonlocal gracefully_closed
-
-        if block.is_set() or event.event_type == EVENT_TIME_CHANGED:
+class StreamHub(object):
+    """Forward the events of the bus to the clients of the event stream.
+
+    The hub listens to the bus once for all clients. Clients are grouped by
+    their restrict filter and an event is encoded once for all groups that
+    want it. The data is queued in the bounded buffer of each client, so a
+    slow client is disconnected instead of holding up the bus.
+    """
+
+    def __init__(self, hass):
+        """Initialize the hub and start listening to the bus."""
+        self.hass = hass
+        self._lock = threading.Lock()
+        # Restrict filter (None for all events) -> {stream: session ID}
+        self._groups = {}
+
+        hass.bus.listen(MATCH_ALL, self._forward_event)
+
+    @property
+    def client_count(self):
+        """Return the number of connected clients."""
+        with self._lock:
+            return sum(len(group) for group in self._groups.values())
+
+    def handle_get_api_stream(self, handler, path_match, data):
+        """Provide a streaming interface for the event bus."""
+        restrict = data.get('restrict')
+        restrict = frozenset(restrict.split(',')) if restrict else None
+
+        handler.send_response(HTTP_OK)
+        handler.send_header('Content-type', 'text/event-stream')
+        session_id = handler.set_session_cookie_header()
+        stream = handler.start_stream(
+            keepalive=_stream_message(STREAM_PING_PAYLOAD),
+            keepalive_interval=STREAM_PING_INTERVAL)
+
+        stream.write(_stream_message(STREAM_PING_PAYLOAD))
+
+        with self._lock:
+            self._groups.setdefault(restrict, {})[stream] = session_id
+
+        stream.add_close_listener(
+            lambda: self._remove_client(stream, restrict,
+                                        handler.client_address[0]))
+
+    def _remove_client(self, stream, restrict, address):
+        """Stop forwarding events to a closed stream."""
+        if stream.aborted:
+            _LOGGER.info("Found broken event stream to %s, cleaning up",
+                         address)
+
+        with self._lock:
+            group = self._groups.get(restrict, {})
+            group.pop(stream, None)
+
+            if not group:
+                self._groups.pop(restrict, None)
+
+    @ha.callback
+    def _forward_event(self, event):
+        """Queue an event for the clients that want it."""
+        if event.event_type == EVENT_TIME_CHANGED:
             return
-        elif event.event_type == EVENT_HOMEASSISTANT_STOP:
-            gracefully_closed = True
-            block.set()
+
+        with self._lock:
+            if event.event_type == EVENT_HOMEASSISTANT_STOP:
+                targets = [client for group in self._groups.values()
+                           for client in group.items()]
+            else:
+                targets = [client for restrict, group in self._groups.items()
+                           if restrict is None or event.event_type in restrict
+                           for client in group.items()]
+
+        if not targets:
             return
 
-        handler.server.sessions.extend_validation(session_id)
-        write_message(json.dumps(event, cls=rem.JSONEncoder))
+        if event.event_type == EVENT_HOMEASSISTANT_STOP:
+            for stream, _ in targets:
+                stream.close()
+            return
 
-    handler.send_response(HTTP_OK)
-    handler.send_header('Content-type', 'text/event-stream')
-    session_id = handler.set_session_cookie_header()
-    handler.end_headers()
+        data = _stream_message(event.as_json())
 
-    if restrict:
-        for event in restrict:
-            hass.bus.listen(event, forward_events)
-    else:
-        hass.bus.listen(MATCH_ALL, forward_events)
+        for session_id in set(session_id for _, session_id in targets):
+            self.hass.http.sessions.extend_validation(session_id)
 
-    while True:
-        write_message(STREAM_PING_PAYLOAD)
+        for stream, _ in targets:
+            stream.write(data)
 
-        block.wait(STREAM_PING_INTERVAL)
 
-        if block.is_set():
-            break
+def _handle_get_api_websocket(handler, path_match, data):
+    """Provide the WebSocket API."""
+    websocket = handler.start_websocket(
+        keepalive_interval=STREAM_PING_INTERVAL)
 
-    if not gracefully_closed:
-        _LOGGER.info("Found broken event stream to %s, cleaning up",
-                     handler.client_address[0])
+    if websocket is not None:
+        WebSocketConnection(handler.server.hass, websocket,
+                            handler.get_cookie_session_id())
 
-    if restrict:
-        for event in restrict:
-            hass.bus.remove_listener(event, forward_events)
-    else:
-        hass.bus.remove_listener(MATCH_ALL, forward_events)
+
+class WebSocketConnection(object):
+    """Handle the commands of a client of the WebSocket API.
+
+    Commands are JSON objects with an id and a type. Every command is
+    answered with a result message with the same id. Subscriptions send
+    their messages with the id of the command that created them.
+
+    Commands are handled one at a time, in the order they were received,
+    by a job on the worker pool.
+    """
+
+    def __init__(self, hass, websocket, session_id):
+        """Initialize the connection and start handling commands."""
+        self.hass = hass
+        self.websocket = websocket
+        self.session_id = session_id
+        self._lock = threading.RLock()
+        # Command ID -> (event type, listener)
+        self._subscriptions = {}
+        self._closed_down = False
+        # Received messages that wait for the command job
+        self._pending = deque()
+        self._pending_lock = threading.Lock()
+        self._handling = False
+        self._commands = {
+            'get_states': self._get_states,
+            'call_service': self._call_service,
+            'subscribe_events': self._subscribe_events,
+            'subscribe_states': self._subscribe_states,
+            'unsubscribe': self._unsubscribe,
+        }
+
+        self._stop_listener = hass.bus.listen_once(
+            EVENT_HOMEASSISTANT_STOP,
+            lambda event: websocket.close(WS_CLOSE_GOING_AWAY))
+
+        websocket.on_message = self.handle_message
+        websocket.add_close_listener(self._closed)
+
+    def handle_message(self, message):
+        """Queue a command sent by the client.
+
+        In event loop mode this is called from the loop, so the command is
+        handled by the worker pool instead.
+        """
+        with self._pending_lock:
+            self._pending.append(message)
+
+            if self._handling:
+                return
+
+            self._handling = True
+
+        # The job has to run to handle the messages queued after this one
+        self.hass.pool.add_job(ha.JobPriority.EVENT_DEFAULT,
+                               (self._handle_pending, None), limited=False)
+
+    def _handle_pending(self, _):
+        """Handle the queued commands till there are none left."""
+        while True:
+            with self._pending_lock:
+                if not self._pending:
+                    self._handling = False
+                    return
+
+                message = self._pending.popleft()
+
+            self._handle_command(message)
+
+    def _handle_command(self, message):
+        """Handle a command, answering with an error if it fails."""
+        try:
+            msg = json.loads(message)
+        except ValueError:
+            msg = None
+
+        if not isinstance(msg, dict) or 'id' not in msg or \
+           'type' not in msg or not _is_valid_id(msg['id']):
+            self._send_error(msg.get('id') if isinstance(msg, dict) else None,
+                             ERR_INVALID_FORMAT,
+                             "Expected a JSON object with an id and a type")
+            return
+
+        command = self._commands.get(msg['type']) \
+            if isinstance(msg['type'], str) else None
+
+        if command is None:
+            self._send_error(msg['id'], ERR_UNKNOWN_COMMAND,
+                             "Unknown command {}".format(msg['type']))
+            return
+
+        self.hass.http.sessions.extend_validation(self.session_id)
+
+        try:
+            command(msg)
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Error handling WebSocket command %s", msg)
+            self._send_error(msg['id'], ERR_UNKNOWN_ERROR,
+                             "Error handling the command")
+
+    def _get_states(self, msg):
+        """Send the current states."""
+        self._send_result(msg['id'], _states_json(self.hass.states.all()))
+
+    def _call_service(self, msg):
+        """Call a service without waiting for it to be executed."""
+        domain = msg.get('domain')
+        service = msg.get('service')
+
+        if not self.hass.services.has_service(domain, service):
+            self._send_error(msg['id'], ERR_NOT_FOUND,
+                             "Service {}/{} not found".format(domain, service))
+            return
+
+        self.hass.services.call(domain, service, msg.get('service_data'))
+        self._send_result(msg['id'])
+
+    def _subscribe_events(self, msg):
+        """Send the events of a type, or all events, to the client."""
+        msg_id = msg['id']
+        event_type = msg.get('event_type', MATCH_ALL)
+
+        @ha.callback
+        def forward_event(event):
+            """Send an event to the client."""
+            if event_type == MATCH_ALL and \
+                    event.event_type == EVENT_TIME_CHANGED:
+                return
+
+            self._send_message(msg_id, 'event', event=event.as_json())
+
+        with self._lock:
+            if self._add_subscription(msg_id, event_type, forward_event):
+                self._send_result(msg_id)
+
+    def _subscribe_states(self, msg):
+        """Send the states of entities and then only their changes."""
+        msg_id = msg['id']
+        entity_ids = msg.get(ATTR_ENTITY_ID)
+
+        if not isinstance(entity_ids, list) or \
+           not all(isinstance(entity_id, str) for entity_id in entity_ids):
+            self._send_error(msg_id, ERR_INVALID_FORMAT,
+                             "Expected a list of entity IDs")
+            return
+
+        entity_ids = set(entity_id.lower() for entity_id in entity_ids)
+
+        @ha.callback
+        def forward_state_change(event):
+            """Send the changes of a state to the client."""
+            diff = _state_diff(event.data.get('old_state'),
+                               event.data.get('new_state'))
+            self._send_message(msg_id, 'state_diff', diff=json.dumps(
+                diff, cls=rem.JSONEncoder))
+
+        # Send the states before a change of them can be sent
+        with self._lock:
+            if self._add_subscription(msg_id, EVENT_STATE_CHANGED,
+                                      forward_state_change, entity_ids):
+                self._send_result(msg_id, _states_json(
+                    state for state in self.hass.states.all()
+                    if state.entity_id in entity_ids))
+
+    def _unsubscribe(self, msg):
+        """Cancel a subscription."""
+        subscription_id = msg.get('subscription')
+
+        with self._lock:
+            subscription = self._subscriptions.pop(subscription_id, None) \
+                if _is_valid_id(subscription_id) else None
+
+        if subscription is None:
+            self._send_error(msg['id'], ERR_NOT_FOUND,
+                             "Subscription not found")
+            return
+
+        self.hass.bus.remove_listener(*subscription)
+        self._send_result(msg['id'])
+
+    def _add_subscription(self, msg_id, event_type, listener,
+                          entity_ids=None):
+        """Listen to the bus for a subscription. Return if it was added."""
+        with self._lock:
+            # A command can still be handled after the client went away
+            if self._closed_down:
+                return False
+
+            if msg_id in self._subscriptions:
+                self._send_error(msg_id, ERR_ID_REUSE,
+                                 "A subscription with this ID exists")
+                return False
+
+            self._subscriptions[msg_id] = (event_type, listener)
+
+        self.hass.bus.listen(event_type, listener, entity_ids)
+        return True
+
+    def _send_result(self, msg_id, result='null'):
+        """Send the successful result of a command."""
+        self._send_message(msg_id, 'result', success='true', result=result)
+
+    def _send_error(self, msg_id, code, message):
+        """Send the error of a failed command."""
+        self._send_message(msg_id, 'result', success='false', error=json.dumps(
+            {'code': code, 'message': message}))
+
+    def _send_message(self, msg_id, msg_type, **values):
+        """Send a message with values that are already JSON encoded."""
+        values['id'] = json.dumps(msg_id)
+        values['type'] = json.dumps(msg_type)
+
+        with self._lock:
+            self.websocket.send('{{{}}}'.format(', '.join(
+                '"{}": {}'.format(key, value)
+                for key, value in sorted(values.items()))))
+
+    def _closed(self):
+        """Cancel all subscriptions once the WebSocket is closed."""
+        self.hass.bus.remove_listener(EVENT_HOMEASSISTANT_STOP,
+                                      self._stop_listener)
+
+        with self._lock:
+            self._closed_down = True
+            subscriptions = list(self._subscriptions.values())
+            self._subscriptions.clear()
+
+        for subscription in subscriptions:
+            self.hass.bus.remove_listener(*subscription)
+
+
+def _is_valid_id(value):
+    """Return if a JSON value can be used as command or subscription ID."""
+    return not isinstance(value, (dict, list))
+
+
+def _states_json(states):
+    """Return the JSON of a list of states."""
+    return '[{}]'.format(', '.join(state.as_json() for state in states))
+
+
+def _state_diff(old_state, new_state):
+    """Return the changes between two states of an entity."""
+    if new_state is None:
+        return {ATTR_ENTITY_ID: old_state.entity_id, 'removed': True}
+
+    new = new_state.as_dict()
+
+    if old_state is None:
+        return new
+
+    old = old_state.as_dict()
+    diff = {ATTR_ENTITY_ID: new_state.entity_id}
+
+    for key in ('state', 'last_changed', 'last_updated'):
+        if new[key] != old[key]:
+            diff[key] = new[key]
+
+    attributes = {key: value for key, value in new['attributes'].items()
+                  if key not in old['attributes'] or
+                  old['attributes'][key] != value}
+
+    if attributes:
+        diff['attributes'] = attributes
+
+    removed = [key for key in old['attributes']
+               if key not in new['attributes']]
+
+    if removed:
+        diff['attributes_removed'] = removed
+
+    return diff
+
+
+def _stream_message(payload):
+    """Return the encoded event stream message for payload."""
+    return "data: {}\n\n".format(payload).encode('UTF-8')
 
 
 def _handle_get_api_config(handler, path_match, data):
@@ -403,6 +730,11 @@ def _handle_post_api_template(handler, path_match, data):
         return
 
 
+def _handle_get_api_pool(handler, path_match, data):
+    """Return the statistics of the worker pool."""
+    handler.write_json(handler.server.hass.pool.stats)
+
+
 def services_json(hass):
     """Generate services data to JSONify."""
     return [{"domain": key, "services": value}
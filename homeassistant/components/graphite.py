@@ -12,6 +12,7 @@ import time
 
 from homeassistant.const import (
     EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP, EVENT_STATE_CHANGED)
+from homeassistant.core import callback
 from homeassistant.helpers import state
 
 DOMAIN = "graphite"
@@ -67,6 +68,7 @@ class GraphiteFeeder(threading.Thread):
         _LOGGER.debug('Event processing signaled exit')
         self._queue.put(self._quit_object)
 
+    @callback
     def event_listener(self, event):
         """Queue an event for processing."""
         if self.is_alive() or not self._we_started:
@@ -5,31 +5,63 @@ For more details about this component, please refer to the documentation at
 https://home-assistant.io/components/history/
 """
 import re
-from collections import defaultdict
+import threading
+from collections import defaultdict, deque
 from datetime import timedelta
-from itertools import groupby
+from itertools import chain, groupby
 
+import voluptuous as vol
+
+import homeassistant.helpers.config_validation as cv
 from homeassistant.components import recorder, script
 import homeassistant.util.dt as dt_util
-from homeassistant.const import HTTP_BAD_REQUEST
+from homeassistant.const import (
+    EVENT_HOMEASSISTANT_STOP, EVENT_STATE_CHANGED, HTTP_BAD_REQUEST)
+from homeassistant.core import State, callback
 
 DOMAIN = 'history'
 DEPENDENCIES = ['recorder', 'http']
 
 SIGNIFICANT_DOMAINS = ('thermostat',)
 IGNORE_DOMAINS = ('zone', 'scene',)
+STATISTICS_PERIODS = [name for name, _, _ in recorder.STATISTICS_PERIODS]
+
+# Fewest points a downsampled graph has: the first and the last state
+MIN_POINTS = 2
 
 URL_HISTORY_PERIOD = re.compile(
     r'/api/history/period(?:/(?P<date>\d{4}-\d{1,2}-\d{1,2})|)')
 
+CONF_RECENT_WINDOW = 'recent_window'
+CONF_RECENT_MAX_STATES = 'recent_max_states'
+
+DEFAULT_RECENT_WINDOW = timedelta(days=1)
+DEFAULT_RECENT_MAX_STATES = 100000
+
+CONFIG_SCHEMA = vol.Schema({
+    DOMAIN: vol.Any(None, vol.Schema({
+        vol.Optional(CONF_RECENT_WINDOW, default=DEFAULT_RECENT_WINDOW):
+            vol.All(cv.time_period, cv.positive_timedelta),
+        vol.Optional(CONF_RECENT_MAX_STATES,
+                     default=DEFAULT_RECENT_MAX_STATES): cv.positive_int,
+    })),
+}, extra=vol.ALLOW_EXTRA)
+
+_RECENT = None
+
 
 def last_5_states(entity_id):
     """Return the last 5 states for entity_id."""
     entity_id = entity_id.lower()
 
-    query = """
-        SELECT * FROM states WHERE entity_id=? AND
-        last_changed=last_updated
+    if _RECENT is not None:
+        states = _RECENT.last_5_states(entity_id)
+
+        if states is not None:
+            return states
+
+    query = recorder.QUERY_STATES + """
+        WHERE entity_id=? AND last_changed=last_updated
         ORDER BY state_id DESC LIMIT 0, 5
     """
 
@@ -44,6 +76,39 @@ def get_significant_states(start_time, end_time=None, entity_id=None):
     as well as all states from certain domains (for instance
     thermostat so that we get current temperature in our graphs).
     """
+    if _RECENT is not None and _RECENT.covers(start_time):
+        return _RECENT.significant_states(start_time, end_time, entity_id)
+
+    query, data = _significant_states_query(start_time, end_time, entity_id)
+
+    states = (state for state in recorder.query_states(query, data)
+              if _is_significant(state))
+
+    return states_to_json(states, start_time, entity_id)
+
+
+def stream_significant_states(start_time, end_time=None, entity_id=None):
+    """Return an iterator over the significant states of each entity.
+
+    Gives the same states as get_significant_states, but the states are
+    read from the database while they are consumed. The states of an
+    entity are an iterator that has to be consumed before the next
+    entity is taken.
+    """
+    if _RECENT is not None and _RECENT.covers(start_time):
+        return iter(_RECENT.significant_states(
+            start_time, end_time, entity_id).values())
+
+    query, data = _significant_states_query(start_time, end_time, entity_id)
+
+    states = (state for state in recorder.iter_states(query, data)
+              if _is_significant(state))
+
+    return _stream_states(states, start_time, entity_id)
+
+
+def _significant_states_query(start_time, end_time, entity_id):
+    """Return the query and arguments for significant states."""
     where = """
         (domain IN ({}) OR last_changed=last_updated)
         AND domain NOT IN ({}) AND last_updated > ?
@@ -60,13 +125,10 @@ def get_significant_states(start_time, end_time=None, entity_id=None):
         where += "AND entity_id = ? "
         data.append(entity_id.lower())
 
-    query = ("SELECT * FROM states WHERE {} "
+    query = (recorder.QUERY_STATES + "WHERE {} "
              "ORDER BY entity_id, last_updated ASC").format(where)
 
-    states = (state for state in recorder.query_states(query, data)
-              if _is_significant(state))
-
-    return states_to_json(states, start_time, entity_id)
+    return query, data
 
 
 def state_changes_during_period(start_time, end_time=None, entity_id=None):
@@ -82,7 +144,7 @@ def state_changes_during_period(start_time, end_time=None, entity_id=None):
         where += "AND entity_id = ? "
         data.append(entity_id.lower())
 
-    query = ("SELECT * FROM states WHERE {} "
+    query = (recorder.QUERY_STATES + "WHERE {} "
              "ORDER BY entity_id, last_changed ASC").format(where)
 
     states = recorder.query_states(query, data)
@@ -99,24 +161,63 @@ def get_states(utc_point_in_time, entity_ids=None, run=None):
         if run is None:
             return []
 
-    where = run.where_after_start_run + "AND created < ? "
-    where_data = [utc_point_in_time]
+    where_entity = ""
+    entity_data = []
 
     if entity_ids is not None:
-        where += "AND entity_id IN ({}) ".format(
+        where_entity = "AND entity_id IN ({}) ".format(
             ",".join(['?'] * len(entity_ids)))
-        where_data.extend(entity_ids)
-
-    query = """
-        SELECT * FROM states
-        INNER JOIN (
-            SELECT max(state_id) AS max_state_id
-            FROM states WHERE {}
+        entity_data = list(entity_ids)
+
+    checkpoint = recorder.query(
+        "SELECT checkpoint_id, max_state_id FROM checkpoints WHERE {}"
+        "AND created < ? ORDER BY created DESC LIMIT 1".format(
+            run.where_after_start_run), (utc_point_in_time,))
+
+    if not checkpoint:
+        where = run.where_after_start_run + "AND created < ? " + where_entity
+
+        query = recorder.QUERY_STATES + """
+            INNER JOIN (
+                SELECT max(state_id) AS max_state_id
+                FROM states WHERE {}
+                GROUP BY entity_id)
+            WHERE state_id = max_state_id
+        """.format(where)
+
+        return recorder.query_states(
+            query, [utc_point_in_time] + entity_data)
+
+    checkpoint_id, max_state_id = checkpoint[0]
+
+    # Start from the states in the checkpoint and only look at the states
+    # written after it. The next checkpoint bounds how far we have to look.
+    where_tail = "state_id > ? AND created < ? "
+    tail_data = [max_state_id, utc_point_in_time]
+
+    next_checkpoint = recorder.query(
+        "SELECT max_state_id FROM checkpoints WHERE created >= ? "
+        "ORDER BY created LIMIT 1", (utc_point_in_time,))
+
+    if next_checkpoint:
+        where_tail += "AND state_id <= ? "
+        tail_data.append(next_checkpoint[0][0])
+
+    query = recorder.QUERY_STATES + """
+        WHERE states.state_id IN (
+            SELECT max(state_id) FROM (
+                SELECT states.entity_id, states.state_id
+                FROM checkpoint_states INNER JOIN states
+                ON checkpoint_states.state_id = states.state_id
+                WHERE checkpoint_id = ? {where_entity}
+                UNION ALL
+                SELECT entity_id, state_id FROM states
+                WHERE {where_tail} {where_entity})
             GROUP BY entity_id)
-        WHERE state_id = max_state_id
-    """.format(where)
+    """.format(where_entity=where_entity, where_tail=where_tail)
 
-    return recorder.query_states(query, where_data)
+    return recorder.query_states(
+        query, [checkpoint_id] + entity_data + tail_data + entity_data)
 
 
 def states_to_json(states, start_time, entity_id):
@@ -145,6 +246,159 @@ def states_to_json(states, start_time, entity_id):
     return result
 
 
+def _stream_states(states, start_time, entity_id):
+    """Group states ordered by entity into an iterator per entity.
+
+    Like states_to_json every entity starts with its state at the start
+    time.
+    """
+    entity_ids = [entity_id] if entity_id is not None else None
+
+    # Sorted in reverse so the next entity can be popped from the end
+    initial_states = sorted(get_states(start_time, entity_ids),
+                            key=lambda state: state.entity_id, reverse=True)
+
+    for state in initial_states:
+        state.last_changed = start_time
+        state.last_updated = start_time
+
+    for entity_id, group in groupby(states, lambda state: state.entity_id):
+        # Entities without changes during the period
+        while initial_states and initial_states[-1].entity_id < entity_id:
+            yield [initial_states.pop()]
+
+        if initial_states and initial_states[-1].entity_id == entity_id:
+            group = chain([initial_states.pop()], group)
+
+        yield group
+
+    while initial_states:
+        yield [initial_states.pop()]
+
+
+def downsample(states, max_points):
+    """Reduce the states of an entity to about max_points for a graph.
+
+    Measurements are reduced with largest-triangle-three-buckets, which
+    keeps the points that shape the graph. Of other states only the
+    first of every run of equal states is kept. Domains that are
+    significant because of their attributes are not reduced.
+    """
+    states = list(states)
+
+    if len(states) <= max_points or states[0].domain in SIGNIFICANT_DOMAINS:
+        return states
+
+    values = [recorder.numeric_value(state) for state in states]
+    measurements = len(values) - values.count(None)
+    result = []
+    run = []
+
+    def add_run():
+        """Add the reduced run of measurements to the result."""
+        budget = max(MIN_POINTS,
+                     round(max_points * len(run) / measurements))
+        result.extend(_largest_triangle_three_buckets(run, budget))
+        run.clear()
+
+    for index, (state, value) in enumerate(zip(states, values)):
+        if value is not None:
+            run.append((state.last_updated.timestamp(), value, state))
+            continue
+
+        if run:
+            add_run()
+        elif index and values[index - 1] is None and \
+                states[index - 1].state == state.state:
+            continue
+
+        result.append(state)
+
+    if run:
+        add_run()
+
+    return result
+
+
+def _largest_triangle_three_buckets(points, threshold):
+    """Select threshold items out of (x, y, item) points ordered by x.
+
+    The first and last point are always selected. The other points are
+    divided in buckets and of every bucket the point is selected that
+    forms the largest triangle with the previously selected point and
+    the average of the next bucket.
+    """
+    count = len(points)
+
+    if threshold >= count:
+        return [item for _, _, item in points]
+    elif threshold <= MIN_POINTS:
+        return [points[0][2], points[-1][2]]
+
+    selected = [points[0][2]]
+    bucket_size = (count - 2) / (threshold - 2)
+    previous = 0
+
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, count)
+
+        next_points = points[end:next_end]
+        avg_x = sum(x for x, _, _ in next_points) / len(next_points)
+        avg_y = sum(y for _, y, _ in next_points) / len(next_points)
+        prev_x, prev_y, _ = points[previous]
+
+        previous = max(range(start, end), key=lambda idx: abs(
+            (prev_x - avg_x) * (points[idx][1] - prev_y) -
+            (prev_x - points[idx][0]) * (avg_y - prev_y)))
+        selected.append(points[previous][2])
+
+    selected.append(points[-1][2])
+
+    return selected
+
+
+def get_statistics(start_time, end_time=None, entity_id=None,
+                   period='hour'):
+    """Return the rollups of numeric states during a UTC period.
+
+    Returns per entity the rollups of the buckets that overlap with the
+    period, oldest first.
+    """
+    table, seconds = next((table, seconds) for name, table, seconds
+                          in recorder.STATISTICS_PERIODS if name == period)
+
+    where = "start > ? "
+    data = [start_time.timestamp() - seconds]
+
+    if end_time is not None:
+        where += "AND start < ? "
+        data.append(end_time.timestamp())
+
+    if entity_id is not None:
+        where += "AND entity_id = ? "
+        data.append(entity_id.lower())
+
+    query = ("SELECT entity_id, start, min, max, mean, last, count FROM {} "
+             "WHERE {} ORDER BY entity_id, start ASC").format(table, where)
+
+    result = defaultdict(list)
+
+    for row in recorder.query(query, data):
+        result[row[0]].append({
+            'entity_id': row[0],
+            'start': dt_util.utc_from_timestamp(row[1]),
+            'min': row[2],
+            'max': row[3],
+            'mean': row[4],
+            'last': row[5],
+            'count': row[6],
+        })
+
+    return result
+
+
 def get_state(utc_point_in_time, entity_id, run=None):
     """Return a state at a specific point in time."""
     states = get_states(utc_point_in_time, (entity_id,), run)
@@ -152,9 +406,146 @@ def get_state(utc_point_in_time, entity_id, run=None):
     return states[0] if states else None
 
 
-# pylint: disable=unused-argument
+class RecentStates(object):
+    """Keep the states of the last window in memory.
+
+    At most max_states states are kept. The states that are pushed out
+    are remembered as the state of their entity before the window, so
+    any period that starts after the last state pushed out can be
+    answered without querying the database.
+    """
+
+    def __init__(self, window, max_states, states):
+        """Initialize the recent states with the current states."""
+        self.window = window
+        self.max_states = max_states
+        self.since = dt_util.utcnow()
+        self._lock = threading.Lock()
+        # Per entity the last state before its recent states
+        self._before = {state.entity_id: state for state in states
+                        if recorder.records_state_changes(state.entity_id)}
+        # Per entity a queue of (last_updated, state), None when removed
+        self._states = {}
+        # Entity ids in the order their states were added
+        self._order = deque()
+
+    def covers(self, start_time):
+        """Return if a period starting at start_time can be answered."""
+        return start_time >= self.since
+
+    @callback
+    def state_changed(self, event):
+        """Add the new state of an entity."""
+        entity_id = event.data['entity_id']
+
+        if not recorder.records_state_changes(entity_id):
+            return
+
+        new_state = event.data.get('new_state')
+        updated = (event.time_fired if new_state is None
+                   else new_state.last_updated)
+
+        with self._lock:
+            self._states.setdefault(entity_id, deque()).append(
+                (updated, new_state))
+            self._order.append(entity_id)
+            self._expire(updated - self.window)
+
+    def _expire(self, horizon):
+        """Push out states before horizon or over the budget."""
+        while self._order:
+            entity_id = self._order[0]
+            entity_states = self._states[entity_id]
+            updated = entity_states[0][0]
+
+            if len(self._order) <= self.max_states and updated >= horizon:
+                return
+
+            self._order.popleft()
+            _, state = entity_states.popleft()
+
+            if not entity_states:
+                del self._states[entity_id]
+
+            if state is None:
+                self._before.pop(entity_id, None)
+            else:
+                self._before[entity_id] = state
+
+            self.since = max(self.since, updated)
+
+    def _state_at(self, entity_id, point_in_time):
+        """Return the state of entity_id at point_in_time."""
+        for updated, state in reversed(self._states.get(entity_id, ())):
+            if updated <= point_in_time:
+                return state
+
+        return self._before.get(entity_id)
+
+    def significant_states(self, start_time, end_time=None, entity_id=None):
+        """Return significant states like get_significant_states."""
+        result = defaultdict(list)
+
+        with self._lock:
+            if entity_id is not None:
+                entity_ids = [entity_id.lower()]
+            else:
+                entity_ids = sorted(set(self._before) | set(self._states))
+
+            for entity in entity_ids:
+                state = self._state_at(entity, start_time)
+
+                if state is not None:
+                    result[entity].append(State(
+                        state.entity_id, state.state, state.attributes,
+                        start_time, start_time))
+
+                for updated, state in self._states.get(entity, ()):
+                    if (state is not None and updated > start_time and
+                            (end_time is None or updated < end_time) and
+                            _is_significant_change(state)):
+                        result[entity].append(state)
+
+        return result
+
+    def last_5_states(self, entity_id):
+        """Return the last 5 states of entity_id, None if not all known."""
+        states = []
+
+        with self._lock:
+            for _, state in reversed(self._states.get(entity_id, ())):
+                if (state is not None and
+                        state.last_changed == state.last_updated):
+                    states.append(state)
+
+                    if len(states) == 5:
+                        return states
+
+        return None
+
+
 def setup(hass, config):
     """Setup the history hooks."""
+    # pylint: disable=global-statement
+    global _RECENT
+
+    conf = config.get(DOMAIN) or CONFIG_SCHEMA({DOMAIN: {}})[DOMAIN]
+    _RECENT = None
+
+    if conf[CONF_RECENT_MAX_STATES]:
+        recent = RecentStates(conf[CONF_RECENT_WINDOW],
+                              conf[CONF_RECENT_MAX_STATES], hass.states.all())
+        hass.bus.listen(EVENT_STATE_CHANGED, recent.state_changed)
+
+        def stop_recent(event):
+            """Stop answering from memory when Home Assistant stops."""
+            global _RECENT
+            if _RECENT is recent:
+                _RECENT = None
+
+        hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, stop_recent)
+        _RECENT = recent
+
     hass.http.register_path(
         'GET',
         re.compile(
@@ -177,9 +568,46 @@ def _api_last_5_states(handler, path_match, data):
 
 
 def _api_history_period(handler, path_match, data):
-    """Return history over a period of time."""
+    """Return history over a period of time.
+
+    The period lasts one day or the number of days in data. With the
+    statistics option the rollups of numeric states for that period
+    are returned instead of the states. The states of every entity are
+    downsampled to max_points or to one point per resolution seconds.
+    """
     date_str = path_match.group('date')
-    one_day = timedelta(seconds=86400)
+    period = data.get('statistics')
+
+    try:
+        days = int(data.get('days', 1))
+    except ValueError:
+        days = 0
+
+    if days < 1:
+        handler.write_json_message("Invalid number of days", HTTP_BAD_REQUEST)
+        return
+
+    try:
+        max_points = int(data['max_points']) if 'max_points' in data \
+            else None
+        resolution = int(data['resolution']) if 'resolution' in data \
+            else None
+    except ValueError:
+        max_points = resolution = 0
+
+    if max_points is not None and max_points < MIN_POINTS or \
+       resolution is not None and resolution < 1:
+        handler.write_json_message(
+            "Invalid max_points or resolution", HTTP_BAD_REQUEST)
+        return
+
+    if period is not None and period not in STATISTICS_PERIODS:
+        handler.write_json_message(
+            "Statistics period should be one of {}".format(
+                ", ".join(STATISTICS_PERIODS)), HTTP_BAD_REQUEST)
+        return
+
+    one_day = timedelta(days=1)
 
     if date_str:
         start_date = dt_util.parse_date(date_str)
@@ -190,14 +618,36 @@ def _api_history_period(handler, path_match, data):
 
         start_time = dt_util.as_utc(dt_util.start_of_local_day(start_date))
     else:
-        start_time = dt_util.utcnow() - one_day
+        start_time = dt_util.utcnow() - days * one_day
 
-    end_time = start_time + one_day
+    end_time = start_time + days * one_day
 
     entity_id = data.get('filter_entity_id')
 
-    handler.write_json(
-        get_significant_states(start_time, end_time, entity_id).values())
+    if period is not None:
+        handler.write_json(list(
+            get_statistics(start_time, end_time, entity_id, period).values()))
+        return
+
+    states = stream_significant_states(start_time, end_time, entity_id)
+
+    if resolution is not None:
+        points = max(MIN_POINTS, int(
+            (end_time - start_time).total_seconds() // resolution) + 1)
+        max_points = min(max_points or points, points)
+
+    if max_points is not None:
+        states = (downsample(entity_states, max_points)
+                  for entity_states in states)
+
+    handler.write_json_stream(states)
+
+
+def _is_significant_change(state):
+    """Test if state would be returned by get_significant_states."""
+    return ((state.domain in SIGNIFICANT_DOMAINS or
+             state.last_changed == state.last_updated) and
+            state.domain not in IGNORE_DOMAINS and _is_significant(state))
 
 
 def _is_significant(state):
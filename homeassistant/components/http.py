@@ -4,14 +4,24 @@ This module provides an API and a HTTP interface for debug purposes.
 For more details about the RESTful API, please refer to the documentation at
 https://home-assistant.io/developers/api/
 """
+import base64
 import gzip
+import hashlib
 import hmac
 import json
 import logging
+import queue
+import selectors
+import socket
 import ssl
+import struct
 import threading
 import time
+import zlib
+from collections import deque
+from collections.abc import Iterator
 from datetime import timedelta
+from functools import partial
 from http import cookies
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 from socketserver import ThreadingMixIn
@@ -28,10 +38,13 @@ from homeassistant.const import (
     CONTENT_TYPE_JSON, CONTENT_TYPE_TEXT_PLAIN, HTTP_HEADER_ACCEPT_ENCODING,
     HTTP_HEADER_CACHE_CONTROL, HTTP_HEADER_CONTENT_ENCODING,
     HTTP_HEADER_CONTENT_LENGTH, HTTP_HEADER_CONTENT_TYPE, HTTP_HEADER_EXPIRES,
-    HTTP_HEADER_HA_AUTH, HTTP_HEADER_VARY,
+    HTTP_HEADER_HA_AUTH, HTTP_HEADER_ORIGIN, HTTP_HEADER_TRANSFER_ENCODING,
+    HTTP_HEADER_VARY,
     HTTP_HEADER_ACCESS_CONTROL_ALLOW_ORIGIN,
     HTTP_HEADER_ACCESS_CONTROL_ALLOW_HEADERS, HTTP_METHOD_NOT_ALLOWED,
-    HTTP_NOT_FOUND, HTTP_OK, HTTP_UNAUTHORIZED, HTTP_UNPROCESSABLE_ENTITY,
+    HTTP_BAD_REQUEST, HTTP_FORBIDDEN, HTTP_INTERNAL_SERVER_ERROR,
+    HTTP_NOT_FOUND, HTTP_OK,
+    HTTP_SWITCHING_PROTOCOLS, HTTP_UNAUTHORIZED, HTTP_UNPROCESSABLE_ENTITY,
     ALLOWED_CORS_HEADERS,
     SERVER_PORT, URL_ROOT, URL_API_EVENT_FORWARD)
 
@@ -44,6 +57,10 @@ CONF_DEVELOPMENT = "development"
 CONF_SSL_CERTIFICATE = 'ssl_certificate'
 CONF_SSL_KEY = 'ssl_key'
 CONF_CORS_ORIGINS = 'cors_allowed_origins'
+CONF_SERVER_MODE = 'server_mode'
+
+SERVER_MODE_THREADED = 'threaded'
+SERVER_MODE_EVENT_LOOP = 'event_loop'
 
 DATA_API_PASSWORD = 'api_password'
 
@@ -52,6 +69,40 @@ SESSION_CLEAR_INTERVAL = timedelta(seconds=20)
 SESSION_TIMEOUT_SECONDS = 1800
 SESSION_KEY = 'sessionId'
 
+# Bytes to collect before a chunk of a streamed response is written
+STREAM_CHUNK_SIZE = 16384
+
+# Bytes a stream may buffer for a client before the client is considered
+# too slow and is disconnected
+STREAM_MAX_BUFFER = 1048576
+
+# Seconds a client may take to send a request or keep an idle connection
+REQUEST_TIMEOUT = 60
+KEEP_ALIVE_TIMEOUT = 60
+
+# Seconds a request worker of the event loop server waits for a new request
+WORKER_IDLE_TIMEOUT = 30
+
+# Bytes read from a stream client at a time
+STREAM_READ_SIZE = 65536
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# Largest message in bytes a WebSocket client may send
+WEBSOCKET_MAX_MESSAGE = 1048576
+
+WS_OPCODE_CONTINUATION = 0x0
+WS_OPCODE_TEXT = 0x1
+WS_OPCODE_BINARY = 0x2
+WS_OPCODE_CLOSE = 0x8
+WS_OPCODE_PING = 0x9
+WS_OPCODE_PONG = 0xA
+
+WS_CLOSE_NORMAL = 1000
+WS_CLOSE_GOING_AWAY = 1001
+WS_CLOSE_PROTOCOL_ERROR = 1002
+WS_CLOSE_INVALID_DATA = 1007
+WS_CLOSE_TOO_BIG = 1009
+
 _LOGGER = logging.getLogger(__name__)
 
 CONFIG_SCHEMA = vol.Schema({
@@ -63,7 +114,9 @@ CONFIG_SCHEMA = vol.Schema({
         vol.Optional(CONF_DEVELOPMENT): cv.string,
         vol.Optional(CONF_SSL_CERTIFICATE): cv.isfile,
         vol.Optional(CONF_SSL_KEY): cv.isfile,
-        vol.Optional(CONF_CORS_ORIGINS): cv.ensure_list
+        vol.Optional(CONF_CORS_ORIGINS): cv.ensure_list,
+        vol.Optional(CONF_SERVER_MODE, default=SERVER_MODE_THREADED):
+            vol.In([SERVER_MODE_THREADED, SERVER_MODE_EVENT_LOOP]),
     }),
 }, extra=vol.ALLOW_EXTRA)
 
@@ -82,8 +135,13 @@ def setup(hass, config):
     ssl_key = conf.get(CONF_SSL_KEY)
     cors_origins = conf.get(CONF_CORS_ORIGINS, [])
 
+    if conf.get(CONF_SERVER_MODE) == SERVER_MODE_EVENT_LOOP:
+        server_class = EventLoopHTTPServer
+    else:
+        server_class = HomeAssistantHTTPServer
+
     try:
-        server = HomeAssistantHTTPServer(
+        server = server_class(
             (server_host, server_port), RequestHandler, hass, api_password,
             development, ssl_certificate, ssl_key, cors_origins)
     except OSError:
@@ -113,6 +171,7 @@ class HomeAssistantHTTPServer(ThreadingMixIn, HTTPServer):
     # pylint: disable=too-few-public-methods
     allow_reuse_address = True
     daemon_threads = True
+    handshake_on_accept = True
 
     # pylint: disable=too-many-arguments
     def __init__(self, server_address, request_handler_class,
@@ -140,7 +199,9 @@ class HomeAssistantHTTPServer(ThreadingMixIn, HTTPServer):
             context = ssl.create_default_context(
                 purpose=ssl.Purpose.CLIENT_AUTH)
             context.load_cert_chain(ssl_certificate, keyfile=ssl_key)
-            self.socket = context.wrap_socket(self.socket, server_side=True)
+            self.socket = context.wrap_socket(
+                self.socket, server_side=True,
+                do_handshake_on_connect=self.handshake_on_accept)
 
     def start(self):
         """Start the HTTP server."""
@@ -167,12 +228,617 @@ class HomeAssistantHTTPServer(ThreadingMixIn, HTTPServer):
         """Register a path with the server."""
         self.paths.append((method, url, callback, require_auth))
 
+    def serve_stream(self, handler):
+        """Send the stream started by a request handler to the client."""
+        # pylint: disable=no-self-use
+        if handler.stream.receiver is not None:
+            threading.Thread(target=_receive_stream, args=(handler,),
+                             daemon=True, name='HTTP-stream-reader').start()
+
+        handler.stream.run(handler.wfile)
+
     def log_message(self, fmt, *args):
         """Redirect built-in log to HA logging."""
         # pylint: disable=no-self-use
         _LOGGER.info(fmt, *args)
 
 
+class _Connection(object):
+    """A client connection of the event loop server."""
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, sock, address):
+        """Initialize the connection."""
+        self.sock = sock
+        self.address = address
+        self.handler = None
+        self.idle_since = None
+
+
+class _RequestWorkers(object):
+    """Threads that handle the requests of the event loop server.
+
+    A thread is started for every request that finds all threads busy, so a
+    slow request never delays the others. Threads exit after being idle.
+    """
+
+    def __init__(self, idle_timeout=WORKER_IDLE_TIMEOUT):
+        """Initialize the workers."""
+        self.idle_timeout = idle_timeout
+        self.count = 0
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._idle = 0
+        self._stopped = False
+
+    def submit(self, job, *args):
+        """Run job with args in a worker thread."""
+        with self._lock:
+            if self._stopped:
+                return
+
+            self._jobs.put((job, args))
+
+            if self._idle:
+                # An idle worker will pick up the job
+                self._idle -= 1
+                return
+
+            self.count += 1
+
+        threading.Thread(target=self._work, daemon=True,
+                         name='HTTP-worker').start()
+
+    def stop(self):
+        """Let the workers exit once they are done with their request."""
+        with self._lock:
+            self._stopped = True
+
+            for _ in range(self._idle):
+                self._jobs.put(None)
+
+    def _work(self):
+        """Handle jobs until idle for too long."""
+        while True:
+            try:
+                item = self._jobs.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    # Exit unless a job was just handed to this worker
+                    if self._idle:
+                        self._idle -= 1
+                        self.count -= 1
+                        return
+                continue
+
+            if item is None:
+                break
+
+            job, args = item
+
+            try:
+                job(*args)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Error handling request")
+
+            with self._lock:
+                if self._stopped:
+                    break
+                self._idle += 1
+
+        with self._lock:
+            self.count -= 1
+
+
+# pylint: disable=too-many-instance-attributes
+class EventLoopHTTPServer(HomeAssistantHTTPServer):
+    """Serve HTTP requests with keep-alive from a selector event loop.
+
+    Idle keep-alive connections and open streams are watched by a single
+    thread. Only connections with a pending request are handed to a worker
+    thread, so the number of threads depends on the number of requests
+    being handled and not on the number of connected clients.
+    """
+
+    handshake_on_accept = False
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, *args, **kwargs):
+        """Initialize the server."""
+        super().__init__(*args, **kwargs)
+
+        self.workers = _RequestWorkers()
+        self.connections = set()
+        self._selector = selectors.DefaultSelector()
+        self._calls = deque()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._shutdown_request = False
+        self._stopped = threading.Event()
+        self._last_sweep = 0
+
+    def serve_forever(self, poll_interval=1):
+        """Run the event loop until shutdown is called."""
+        self.socket.setblocking(False)
+        self._selector.register(self.socket, selectors.EVENT_READ,
+                                self._accept)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ,
+                                self._drain_wakeup)
+
+        try:
+            while not self._shutdown_request:
+                for key, mask in self._selector.select(poll_interval):
+                    key.data(mask)
+
+                while self._calls:
+                    call, args = self._calls.popleft()
+                    call(*args)
+
+                self._sweep()
+        finally:
+            self._cleanup()
+            self._stopped.set()
+
+    def shutdown(self):
+        """Stop the event loop and wait till it is stopped."""
+        self._shutdown_request = True
+        self._wakeup()
+        self._stopped.wait()
+
+    def serve_stream(self, handler):
+        """Serve the stream from the event loop once the request is done."""
+        pass
+
+    def _wakeup(self):
+        """Wake up the event loop."""
+        try:
+            self._wakeup_send.send(b'\0')
+        except OSError:
+            # Buffer is full, so a wake up is pending anyway
+            pass
+
+    def _drain_wakeup(self, mask):
+        """Empty the wake up socket."""
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def _call_soon(self, call, *args):
+        """Schedule a call to be run by the event loop thread."""
+        self._calls.append((call, args))
+        self._wakeup()
+
+    def _accept(self, mask):
+        """Accept new connections and wait for their first request."""
+        while True:
+            try:
+                sock, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                _LOGGER.exception("Error accepting connection")
+                return
+
+            conn = _Connection(sock, address)
+            self.connections.add(conn)
+            self._watch(conn)
+
+    def _watch(self, conn):
+        """Wait in the event loop for the next request of a connection."""
+        if self._shutdown_request:
+            self._close(conn)
+            return
+
+        conn.sock.setblocking(False)
+        conn.idle_since = time.monotonic()
+        self._selector.register(conn.sock, selectors.EVENT_READ,
+                                partial(self._readable, conn))
+
+    def _readable(self, conn, mask):
+        """Hand a connection with a pending request to a worker."""
+        self._selector.unregister(conn.sock)
+        conn.idle_since = None
+        self.workers.submit(self._process, conn)
+
+    def _process(self, conn):
+        """Handle the requests of a connection in a worker thread."""
+        try:
+            conn.sock.settimeout(REQUEST_TIMEOUT)
+
+            if conn.handler is None:
+                if self.use_ssl:
+                    conn.sock.do_handshake()
+                conn.handler = self._make_handler(conn)
+
+            handler = conn.handler
+
+            while True:
+                handler.close_connection = True
+                handler.response_started = False
+                handler.handle_one_request()
+
+                if handler.stream is not None:
+                    self._call_soon(self._watch_stream, conn)
+                    return
+
+                if handler.close_connection:
+                    break
+
+                if not self._has_buffered_request(handler):
+                    self._call_soon(self._watch, conn)
+                    return
+        except OSError:
+            # Client went away, timed out or failed the SSL handshake
+            pass
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Error handling request")
+            self._send_server_error(conn.handler)
+
+        self._call_soon(self._close, conn)
+
+    @staticmethod
+    def _send_server_error(handler):
+        """Tell the client its request failed if no response was started."""
+        if handler is None or handler.response_started:
+            return
+
+        try:
+            handler.send_error(HTTP_INTERNAL_SERVER_ERROR)
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    def _make_handler(self, conn):
+        """Create a request handler that handles one request at a time."""
+        # The handler is not created by calling the class, because that
+        # would handle all requests of the connection in the calling thread
+        handler_class = self.RequestHandlerClass
+        handler = handler_class.__new__(handler_class)
+        handler.request = conn.sock
+        handler.client_address = conn.address
+        handler.server = self
+        handler.authenticated = False
+        handler.protocol_version = 'HTTP/1.1'
+        # Headers and body are separate writes, which would otherwise be
+        # delayed on a kept alive connection
+        handler.disable_nagle_algorithm = True
+        handler.setup()
+        return handler
+
+    @staticmethod
+    def _has_buffered_request(handler):
+        """Return if a pipelined request has already been received."""
+        handler.request.setblocking(False)
+
+        try:
+            return bool(handler.rfile.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            handler.request.settimeout(REQUEST_TIMEOUT)
+
+    def _watch_stream(self, conn):
+        """Send a stream to the client from the event loop."""
+        if self._shutdown_request:
+            self._close(conn)
+            return
+
+        stream = conn.handler.stream
+        conn.sock.setblocking(False)
+        self._selector.register(conn.sock, selectors.EVENT_READ,
+                                partial(self._stream_event, conn))
+        stream.wakeup = partial(self._call_soon, self._send_stream, conn)
+
+        # Data that arrived with the request is already read from the socket
+        buffered = self._read_buffered(conn.handler)
+
+        if buffered:
+            stream.receive(buffered)
+
+        self._send_stream(conn)
+
+    @staticmethod
+    def _read_buffered(handler):
+        """Return the data received after the request without blocking."""
+        try:
+            data = handler.rfile.peek(1)
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return b''
+
+        return handler.rfile.read(len(data))
+
+    def _stream_event(self, conn, mask):
+        """Handle a stream connection that is readable or writable."""
+        if mask & selectors.EVENT_READ:
+            self._receive(conn)
+
+        self._send_stream(conn)
+
+    @staticmethod
+    def _receive(conn):
+        """Pass the data sent by a stream client to the stream."""
+        stream = conn.handler.stream
+
+        try:
+            data = conn.sock.recv(STREAM_READ_SIZE)
+
+            # SSL sockets can hold decrypted data the selector does not see
+            while (data and isinstance(conn.sock, ssl.SSLSocket) and
+                   conn.sock.pending()):
+                data += conn.sock.recv(STREAM_READ_SIZE)
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return
+        except OSError:
+            data = b''
+
+        if data:
+            stream.receive(data)
+        else:
+            # Client closed the connection
+            stream.abort()
+
+    def _send_stream(self, conn):
+        """Send pending stream data and watch for the socket to drain."""
+        if conn not in self.connections:
+            return
+
+        stream = conn.handler.stream
+
+        if stream.send(conn.sock):
+            self._close(conn)
+            return
+
+        events = selectors.EVENT_READ
+
+        if stream.pending:
+            events |= selectors.EVENT_WRITE
+
+        self._selector.modify(conn.sock, events,
+                              partial(self._stream_event, conn))
+
+    def _sweep(self):
+        """Ping idle streams and close idle keep-alive connections."""
+        now = time.monotonic()
+
+        if now - self._last_sweep < 1:
+            return
+
+        self._last_sweep = now
+
+        for conn in list(self.connections):
+            if conn.handler is not None and conn.handler.stream is not None:
+                conn.handler.stream.ping()
+            elif (conn.idle_since is not None and
+                  now - conn.idle_since > KEEP_ALIVE_TIMEOUT):
+                self._close(conn)
+
+    def _close(self, conn):
+        """Close a connection."""
+        if conn not in self.connections:
+            return
+
+        self.connections.remove(conn)
+
+        try:
+            self._selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            # Not being watched
+            pass
+
+        if conn.handler is not None:
+            if conn.handler.stream is not None:
+                conn.handler.stream.abort()
+
+            try:
+                conn.handler.finish()
+            except OSError:
+                pass
+
+        self.shutdown_request(conn.sock)
+
+    def _cleanup(self):
+        """Close all connections after the event loop stopped."""
+        for conn in list(self.connections):
+            self._close(conn)
+
+        self.workers.stop()
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+        self.server_close()
+
+
+class HTTPStream(object):
+    """A response body that is sent to the client in the background.
+
+    Writing to a stream never blocks. Data is buffered until the server sends
+    it. A client that does not keep up overflows the buffer and is
+    disconnected, instead of holding up the writer.
+    """
+
+    def __init__(self, max_buffer=STREAM_MAX_BUFFER, keepalive=None,
+                 keepalive_interval=None):
+        """Initialize the stream."""
+        self.max_buffer = max_buffer
+        self.keepalive = keepalive
+        self.keepalive_interval = keepalive_interval
+        self.closed = False
+        self.aborted = False
+        self.wakeup = None
+        self.receiver = None
+        self._buffer = bytearray()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._close_listeners = []
+        self._last_write = time.monotonic()
+
+    @property
+    def pending(self):
+        """Return if data is waiting to be sent."""
+        return bool(self._buffer)
+
+    def write(self, data):
+        """Queue data for the client. Return False if the stream is closed."""
+        if isinstance(data, str):
+            data = data.encode('UTF-8')
+
+        with self._cond:
+            if self.closed or self._closing:
+                return False
+
+            # A single write larger than the buffer is allowed
+            overflow = (bool(self._buffer) and
+                        len(self._buffer) + len(data) > self.max_buffer)
+
+            if not overflow:
+                notify = not self._buffer
+                self._buffer += data
+                self._last_write = time.monotonic()
+
+                if notify:
+                    self._cond.notify()
+
+        if overflow:
+            _LOGGER.warning("Stream client is too slow, disconnecting")
+            self.abort()
+            return False
+
+        if notify and self.wakeup is not None:
+            self.wakeup()
+
+        return True
+
+    def receive(self, data):
+        """Pass data sent by the client to the receiver of the stream."""
+        if self.closed or self.receiver is None:
+            return
+
+        try:
+            self.receiver(data)
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Error handling data from stream client")
+            self.abort()
+
+    def ping(self):
+        """Write the keep-alive data if nothing was written for a while."""
+        if (self.keepalive is not None and
+                time.monotonic() - self._last_write >=
+                self.keepalive_interval):
+            self.write(self.keepalive)
+
+    def close(self):
+        """Close the stream after the buffered data has been sent."""
+        with self._cond:
+            if self.closed or self._closing:
+                return
+
+            self._closing = True
+            self._cond.notify()
+
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def abort(self):
+        """Close the stream right away, dropping any buffered data."""
+        with self._cond:
+            if self.closed:
+                return
+
+            self.aborted = True
+            self._buffer.clear()
+            self._cond.notify()
+
+        self._finish()
+
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def add_close_listener(self, listener):
+        """Call listener when the stream is closed."""
+        with self._cond:
+            if not self.closed:
+                self._close_listeners.append(listener)
+                return
+
+        listener()
+
+    def run(self, wfile):
+        """Send the stream to a blocking file until it is closed."""
+        try:
+            while True:
+                self.ping()
+
+                with self._cond:
+                    if not (self._buffer or self._closing or self.closed):
+                        self._cond.wait(self._keepalive_timeout())
+
+                    if self.closed:
+                        break
+
+                    data = bytes(self._buffer)
+                    self._buffer.clear()
+
+                    if self._closing and not data:
+                        break
+
+                if data:
+                    wfile.write(data)
+                    wfile.flush()
+        except (IOError, ValueError):
+            # IOError: socket errors
+            # ValueError: raised when 'I/O operation on closed file'
+            self.aborted = True
+
+        self._finish()
+
+    def send(self, sock):
+        """Send buffered data to a non-blocking socket.
+
+        Return True when the stream is done and the connection can be closed.
+        """
+        with self._cond:
+            if self._buffer and not self.closed:
+                try:
+                    del self._buffer[:sock.send(self._buffer)]
+                except (BlockingIOError, ssl.SSLWantReadError,
+                        ssl.SSLWantWriteError):
+                    pass
+                except OSError:
+                    self.aborted = True
+                    self._buffer.clear()
+                    self._closing = True
+
+            done = self.closed or (self._closing and not self._buffer)
+
+        if done:
+            self._finish()
+
+        return done
+
+    def _keepalive_timeout(self):
+        """Return the seconds till the next keep-alive is due."""
+        if self.keepalive is None:
+            return None
+
+        return max(0, self._last_write + self.keepalive_interval -
+                   time.monotonic())
+
+    def _finish(self):
+        """Mark the stream closed and call the close listeners."""
+        with self._cond:
+            if self.closed:
+                return
+
+            self.closed = True
+            listeners = self._close_listeners
+            self._close_listeners = []
+
+        for listener in listeners:
+            listener()
+
+
 # pylint: disable=too-many-public-methods,too-many-locals
 class RequestHandler(SimpleHTTPRequestHandler):
     """Handle incoming HTTP requests.
@@ -183,6 +849,16 @@ class RequestHandler(SimpleHTTPRequestHandler):
 
     server_version = "HomeAssistant/1.0"
 
+    # Stream started by the request handler to send the response body
+    stream = None
+
+    # If the length of the response body is known to the client. Responses
+    # without it need the connection to be closed to mark their end.
+    _body_delimited = True
+
+    # If the status line of the response to the current request was sent
+    response_started = False
+
     def __init__(self, req, client_addr, server):
         """Constructor, call the base constructor and set up session."""
         # Track if this was an authenticated request
@@ -286,6 +962,9 @@ class RequestHandler(SimpleHTTPRequestHandler):
 
             handle_request_method(self, path_match, data)
 
+            if self.stream is not None:
+                self.server.serve_stream(self)
+
         elif path_matched_but_not_method:
             self.send_response(HTTP_METHOD_NOT_ALLOWED)
             self.end_headers()
@@ -314,6 +993,91 @@ class RequestHandler(SimpleHTTPRequestHandler):
         """DELETE request handler."""
         self._handle_request('DELETE')
 
+    def send_response(self, code, message=None):
+        """Send the response code and start tracking the headers."""
+        self.response_started = True
+        self._body_delimited = False
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        """Send a header and track if it delimits the response body."""
+        if keyword.lower() in (HTTP_HEADER_CONTENT_LENGTH.lower(),
+                               HTTP_HEADER_TRANSFER_ENCODING.lower()):
+            self._body_delimited = True
+
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        """Send the end of the headers, closing undelimited responses."""
+        if not self._body_delimited:
+            self.close_connection = True
+
+        super().end_headers()
+
+    def start_stream(self, keepalive=None, keepalive_interval=None,
+                     max_buffer=STREAM_MAX_BUFFER):
+        """End the headers and return a stream for the response body.
+
+        The stream is sent after the request handler has returned, so the
+        handler can keep writing to it from event listeners. The connection
+        is closed when the stream is closed.
+        """
+        self.end_headers()
+        self.stream = HTTPStream(max_buffer, keepalive, keepalive_interval)
+        return self.stream
+
+    def start_websocket(self, keepalive_interval=None,
+                        max_buffer=STREAM_MAX_BUFFER):
+        """Upgrade the connection to a WebSocket and return it.
+
+        Returns None after sending an error if the request is not a valid
+        WebSocket handshake.
+        """
+        key = self.headers.get('Sec-WebSocket-Key')
+
+        if ('websocket' not in self.headers.get('Upgrade', '').lower() or
+                self.headers.get('Sec-WebSocket-Version') != '13' or
+                not key):
+            self.write_json_message(
+                "Expected a WebSocket handshake", HTTP_BAD_REQUEST)
+            return None
+
+        if not self._websocket_origin_allowed():
+            _LOGGER.warning("Refused WebSocket from origin %s",
+                            self.headers.get(HTTP_HEADER_ORIGIN))
+            self.write_json_message("Origin not allowed", HTTP_FORBIDDEN)
+            return None
+
+        accept = base64.b64encode(hashlib.sha1(
+            (key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+
+        # Clients only accept the upgrade as an HTTP/1.1 response
+        self.protocol_version = 'HTTP/1.1'
+        self.send_response(HTTP_SWITCHING_PROTOCOLS)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.set_session_cookie_header()
+
+        return WebSocket(self.start_stream(
+            keepalive=websocket_frame(WS_OPCODE_PING, b''),
+            keepalive_interval=keepalive_interval, max_buffer=max_buffer))
+
+    def _websocket_origin_allowed(self):
+        """Return if the page that opens a WebSocket may use it.
+
+        Browsers send the session cookie with the handshake of any page,
+        so only pages served by us or from the CORS origins are allowed.
+        Clients that are not browsers do not send an origin.
+        """
+        origin = self.headers.get(HTTP_HEADER_ORIGIN)
+
+        if origin is None or origin in self.server.cors_origins:
+            return True
+
+        return urlparse(origin).netloc.lower() == \
+            self.headers.get('Host', '').lower()
+
     def write_json_message(self, message, status_code=HTTP_OK):
         """Helper method to return a message to the caller."""
         self.write_json({'message': message}, status_code=status_code)
@@ -331,6 +1095,17 @@ class RequestHandler(SimpleHTTPRequestHandler):
 
         self.write_content(json_data, CONTENT_TYPE_JSON)
 
+    def write_json_stream(self, items, status_code=HTTP_OK):
+        """Helper method to stream a JSON array to the caller.
+
+        Items are encoded one at a time while they are produced. Items
+        that are iterators are streamed as nested arrays.
+        """
+        self.send_response(status_code)
+        self.set_session_cookie_header()
+
+        self.write_stream(_json_stream(items), CONTENT_TYPE_JSON)
+
     def write_text(self, message, status_code=HTTP_OK):
         """Helper method to return a text message to the caller."""
         msg_data = message.encode('UTF-8')
@@ -374,6 +1149,83 @@ class RequestHandler(SimpleHTTPRequestHandler):
 
         self.send_header(HTTP_HEADER_CONTENT_LENGTH, str(len(content)))
 
+        self.set_cors_headers()
+        self.end_headers()
+
+        if self.command == 'HEAD':
+            return
+
+        self.wfile.write(content)
+
+    def write_stream(self, chunks, content_type=None):
+        """Helper method to write an iterable of content to output stream.
+
+        The length is not known up front, so on HTTP/1.1 connections the
+        content is sent with chunked transfer encoding. Otherwise the
+        content is sent until the connection is closed.
+        """
+        if content_type is not None:
+            self.send_header(HTTP_HEADER_CONTENT_TYPE, content_type)
+
+        compressor = None
+
+        if 'gzip' in self.headers.get(HTTP_HEADER_ACCEPT_ENCODING, ''):
+            # A window size of 16 + 15 writes the gzip format
+            compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+            self.send_header(HTTP_HEADER_CONTENT_ENCODING, "gzip")
+            self.send_header(HTTP_HEADER_VARY, HTTP_HEADER_ACCEPT_ENCODING)
+
+        chunked = (self.request_version == 'HTTP/1.1' and
+                   self.protocol_version == 'HTTP/1.1')
+
+        if chunked:
+            self.send_header(HTTP_HEADER_TRANSFER_ENCODING, "chunked")
+        else:
+            self.close_connection = True
+
+        self.set_cors_headers()
+        self.end_headers()
+
+        if self.command == 'HEAD':
+            return
+
+        def write_chunk(data):
+            """Write data as one chunk."""
+            if chunked:
+                self.wfile.write(
+                    "{:x}\r\n".format(len(data)).encode('ascii') +
+                    data + b"\r\n")
+            else:
+                self.wfile.write(data)
+
+        buffer = bytearray()
+
+        for content in chunks:
+            if isinstance(content, str):
+                content = content.encode('UTF-8')
+
+            if compressor is not None:
+                content = compressor.compress(content)
+
+            buffer += content
+
+            if len(buffer) >= STREAM_CHUNK_SIZE:
+                write_chunk(bytes(buffer))
+                buffer.clear()
+
+        if compressor is not None:
+            buffer += compressor.flush()
+
+        if buffer:
+            write_chunk(bytes(buffer))
+
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def set_cors_headers(self):
+        """Add the CORS headers if the origin is allowed."""
         cors_check = (self.headers.get("Origin") in self.server.cors_origins)
 
         cors_headers = ", ".join(ALLOWED_CORS_HEADERS)
@@ -383,12 +1235,6 @@ class RequestHandler(SimpleHTTPRequestHandler):
                              self.headers.get("Origin"))
             self.send_header(HTTP_HEADER_ACCESS_CONTROL_ALLOW_HEADERS,
                              cors_headers)
-        self.end_headers()
-
-        if self.command == 'HEAD':
-            return
-
-        self.wfile.write(content)
 
     def set_cache_header(self):
         """Add cache headers if not in development."""
@@ -516,3 +1362,188 @@ class SessionStore(object):
             self._sessions[session_id] = session_valid_time()
 
             return session_id
+
+
+class WebSocket(object):
+    """A WebSocket connection on top of an HTTP stream (RFC 6455).
+
+    Messages are sent through the buffer of the stream, so sending never
+    blocks. Received messages are passed to on_message as text.
+    """
+
+    def __init__(self, stream):
+        """Initialize the WebSocket."""
+        self.stream = stream
+        self.on_message = None
+        self._buffer = bytearray()
+        self._fragments = []
+        stream.receiver = self._data_received
+
+    @property
+    def closed(self):
+        """Return if the WebSocket is closed."""
+        return self.stream.closed
+
+    def send(self, message):
+        """Send a text message. Return False if the WebSocket is closed."""
+        return self.stream.write(
+            websocket_frame(WS_OPCODE_TEXT, message.encode('UTF-8')))
+
+    def close(self, code=WS_CLOSE_NORMAL):
+        """Send a close frame and close the connection once it is sent."""
+        self.stream.write(websocket_frame(WS_OPCODE_CLOSE,
+                                          struct.pack('!H', code)))
+        self.stream.close()
+
+    def add_close_listener(self, listener):
+        """Call listener when the WebSocket is closed."""
+        self.stream.add_close_listener(listener)
+
+    def _data_received(self, data):
+        """Handle the frames in the data received from the client."""
+        self._buffer += data
+
+        while not self.stream.closed:
+            frame = self._read_frame()
+
+            if frame is None:
+                return
+
+            self._handle_frame(*frame)
+
+    def _read_frame(self):
+        """Remove the next complete frame from the buffer and return it."""
+        buf = self._buffer
+
+        if len(buf) < 2:
+            return None
+
+        fin = bool(buf[0] & 0x80)
+        opcode = buf[0] & 0x0F
+        length = buf[1] & 0x7F
+        pos = 2
+
+        if length == 126:
+            if len(buf) < 4:
+                return None
+            length = struct.unpack_from('!H', buf, 2)[0]
+            pos = 4
+        elif length == 127:
+            if len(buf) < 10:
+                return None
+            length = struct.unpack_from('!Q', buf, 2)[0]
+            pos = 10
+
+        if not buf[1] & 0x80:
+            # Clients have to mask their frames
+            self.close(WS_CLOSE_PROTOCOL_ERROR)
+            return None
+
+        if length > WEBSOCKET_MAX_MESSAGE:
+            self.close(WS_CLOSE_TOO_BIG)
+            return None
+
+        if len(buf) < pos + 4 + length:
+            return None
+
+        mask = bytes(buf[pos:pos + 4])
+        payload = _unmask(bytes(buf[pos + 4:pos + 4 + length]), mask)
+        del buf[:pos + 4 + length]
+
+        return fin, opcode, payload
+
+    def _handle_frame(self, fin, opcode, payload):
+        """Handle a frame sent by the client."""
+        if opcode == WS_OPCODE_CLOSE:
+            self.close()
+        elif opcode == WS_OPCODE_PING:
+            self.stream.write(websocket_frame(WS_OPCODE_PONG, payload))
+        elif opcode == WS_OPCODE_PONG:
+            pass
+        elif opcode in (WS_OPCODE_TEXT, WS_OPCODE_BINARY,
+                        WS_OPCODE_CONTINUATION):
+            self._fragments.append(payload)
+
+            if sum(len(fragment) for fragment in self._fragments) > \
+                    WEBSOCKET_MAX_MESSAGE:
+                self.close(WS_CLOSE_TOO_BIG)
+                return
+
+            if not fin:
+                return
+
+            message = b''.join(self._fragments)
+            self._fragments = []
+
+            try:
+                message = message.decode('UTF-8')
+            except UnicodeDecodeError:
+                self.close(WS_CLOSE_INVALID_DATA)
+                return
+
+            if self.on_message is not None:
+                self.on_message(message)
+        else:
+            self.close(WS_CLOSE_PROTOCOL_ERROR)
+
+
+def websocket_frame(opcode, payload):
+    """Return an unmasked WebSocket frame as sent by a server."""
+    length = len(payload)
+
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+
+    return header + payload
+
+
+def _unmask(payload, mask):
+    """Unmask the payload of a frame sent by a WebSocket client."""
+    length = len(payload)
+    key = (mask * (length // 4 + 1))[:length]
+
+    return (int.from_bytes(payload, 'big') ^
+            int.from_bytes(key, 'big')).to_bytes(length, 'big')
+
+
+def _receive_stream(handler):
+    """Pass the data sent by a stream client to the stream."""
+    stream = handler.stream
+
+    try:
+        while not stream.closed:
+            data = handler.rfile.read1(STREAM_READ_SIZE)
+
+            if not data:
+                break
+
+            stream.receive(data)
+    except (IOError, ValueError):
+        # IOError: socket errors
+        # ValueError: raised when 'I/O operation on closed file'
+        pass
+
+    stream.abort()
+
+
+def _json_stream(items, encoder=None):
+    """Yield the JSON of an array of items piece by piece."""
+    if encoder is None:
+        encoder = rem.JSONEncoder(sort_keys=True)
+
+    yield '['
+
+    for index, item in enumerate(items):
+        if index:
+            yield ', '
+
+        if isinstance(item, Iterator):
+            yield from _json_stream(item, encoder)
+        else:
+            yield encoder.encode(item)
+
+    yield ']'
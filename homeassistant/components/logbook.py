@@ -7,7 +7,6 @@ https://home-assistant.io/components/logbook/
 import logging
 import re
 from datetime import timedelta
-from itertools import groupby
 
 import voluptuous as vol
 
@@ -27,8 +26,19 @@ DEPENDENCIES = ['recorder', 'http']
 
 URL_LOGBOOK = re.compile(r'/api/logbook(?:/(?P<date>\d{4}-\d{1,2}-\d{1,2})|)')
 
-QUERY_EVENTS_BETWEEN = """
-    SELECT * FROM events WHERE time_fired > ? AND time_fired < ?
+# The events that can become an entry, to fill the entries table from.
+# State changes are only reported when the state itself changed.
+QUERY_LOGBOOK_EVENTS = """
+    SELECT events.* FROM events
+    LEFT JOIN states ON states.event_id = events.event_id
+    WHERE events.event_type IN ('{}', '{}', '{}', '{}')
+    AND (events.event_type != '{}' OR
+         states.last_changed = states.last_updated)
+    ORDER BY time_fired, events.event_id
+"""
+
+QUERY_ENTRIES = """
+    SELECT * FROM logbook_entries WHERE time_fired > ? AND time_fired < ?
 """
 
 _LOGGER = logging.getLogger(__name__)
@@ -76,14 +86,42 @@ def setup(hass, config):
         message = template.render(hass, message)
         log_entry(hass, name, message, domain, entity_id)
 
+    recorder.register_writer(LogbookWriter())
+
     hass.http.register_path('GET', URL_LOGBOOK, _handle_get_logbook)
     hass.services.register(DOMAIN, 'log', log_message,
                            schema=LOG_MESSAGE_SCHEMA)
     return True
 
 
+def get_entries(start_time, end_time, entity_id=None, domain=None):
+    """Return the logbook entries of a period, optionally filtered."""
+    query = QUERY_ENTRIES
+    data = [start_time, end_time]
+
+    if entity_id is not None:
+        query += "AND entity_id = ? "
+        data.append(entity_id.lower())
+
+    if domain is not None:
+        query += "AND domain = ? "
+        data.append(domain)
+
+    query += "ORDER BY time_fired, entry_id"
+
+    return (Entry(dt_util.utc_from_timestamp(row['time_fired']),
+                  row['name'], row['message'], row['domain'],
+                  row['entity_id'])
+            for row in recorder.query_iter(query, data))
+
+
 def _handle_get_logbook(handler, path_match, data):
-    """Return logbook entries."""
+    """Return logbook entries.
+
+    The entries of a day are returned, or of the period between the
+    start_time and end_time in data. Older entries can be paged in by
+    using the start time of a period as end time of the next.
+    """
     date_str = path_match.group('date')
 
     if date_str:
@@ -97,13 +135,30 @@ def _handle_get_logbook(handler, path_match, data):
     else:
         start_day = dt_util.start_of_local_day()
 
-    end_day = start_day + timedelta(days=1)
+    try:
+        start_time = _parse_time(data.get('start_time'), start_day)
+        end_time = _parse_time(data.get('end_time'),
+                               start_day + timedelta(days=1))
+    except ValueError:
+        handler.write_json_message(
+            "Invalid start_time or end_time", HTTP_BAD_REQUEST)
+        return
+
+    handler.write_json_stream(get_entries(
+        start_time, end_time, data.get('entity_id'), data.get('domain')))
+
 
-    events = recorder.query_events(
-        QUERY_EVENTS_BETWEEN,
-        (dt_util.as_utc(start_day), dt_util.as_utc(end_day)))
+def _parse_time(time_str, default):
+    """Return a UTC datetime from an ISO 8601 string or the default."""
+    if time_str is None:
+        return dt_util.as_utc(default)
 
-    handler.write_json(humanify(events))
+    time = dt_util.parse_datetime(time_str)
+
+    if time is None:
+        raise ValueError("Invalid datetime: {}".format(time_str))
+
+    return dt_util.as_utc(time)
 
 
 class Entry(object):
@@ -130,114 +185,175 @@ class Entry(object):
         }
 
 
-def humanify(events):
-    """Generator that converts a list of events into Entry objects.
+class LogbookWriter(object):
+    """Keep the logbook_entries table up to date with recorded events.
 
-    Will try to group events if possible:
-     - if 2+ sensor updates in GROUP_BY_MINUTES, show last
-     - if home assistant stop and start happen in same minute call it restarted
+    Sensor states are grouped per GROUP_BY_MINUTES, of a group only the
+    last state is kept. A stop and start in the same minute become one
+    restarted entry. Runs on the recorder thread, so entries are written
+    in the same transaction as their events.
     """
-    # pylint: disable=too-many-branches
-    # Group events in batches of GROUP_BY_MINUTES
-    for _, g_events in groupby(
-            events,
-            lambda event: event.time_fired.minute // GROUP_BY_MINUTES):
 
-        events_batch = list(g_events)
+    def __init__(self):
+        """Initialize the writer."""
+        self.entries_written = 0
 
-        # Keep track of last sensor states
-        last_sensor_event = {}
+    def setup(self, cur):
+        """Create the entries table and fill it from recorded events."""
+        cur.execute("SELECT name FROM sqlite_master "
+                    "WHERE type='table' AND name='logbook_entries'")
 
-        # Group HA start/stop events
-        # Maps minute of event to 1: stop, 2: stop + start
-        start_stop_events = {}
-
-        # Process events
-        for event in events_batch:
-            if event.event_type == EVENT_STATE_CHANGED:
-                entity_id = event.data.get('entity_id')
+        if cur.fetchone() is not None:
+            return
 
-                if entity_id is None:
+        # Of a group of entries only the last one is kept
+        cur.execute("""
+            CREATE TABLE logbook_entries (
+                entry_id integer primary key,
+                time_fired integer,
+                name text,
+                message text,
+                domain text,
+                entity_id text,
+                group_key text UNIQUE)
+        """)
+        cur.execute("""
+            CREATE INDEX logbook_entries__time_fired ON
+            logbook_entries (time_fired)""")
+        cur.execute("""
+            CREATE INDEX logbook_entries__entity_id ON
+            logbook_entries (entity_id, time_fired)""")
+
+        # One time backfill of existing databases
+        rows = cur.connection.execute(QUERY_LOGBOOK_EVENTS.format(
+            EVENT_STATE_CHANGED, EVENT_LOGBOOK_ENTRY,
+            EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP,
+            EVENT_STATE_CHANGED))
+
+        self.write(cur, (event for event in map(recorder.row_to_event, rows)
+                         if event is not None))
+
+        _LOGGER.info("Created %d logbook entries from recorded events",
+                     self.entries_written)
+
+    def write(self, cur, events):
+        """Write the entries of events."""
+        for event in events:
+            if event.event_type == EVENT_HOMEASSISTANT_START:
+                # A start in the same minute as a stop is a restart
+                cur.execute(
+                    "UPDATE logbook_entries SET message='restarted' "
+                    "WHERE group_key=? AND message='stopped'",
+                    (_restart_group_key(event),))
+
+                if cur.rowcount:
                     continue
 
-                if entity_id.startswith('sensor.'):
-                    last_sensor_event[entity_id] = event
+                entry = Entry(event.time_fired, "Home Assistant", "started",
+                              domain=HA_DOMAIN)
+                group_key = None
 
             elif event.event_type == EVENT_HOMEASSISTANT_STOP:
-                if event.time_fired.minute in start_stop_events:
-                    continue
+                entry = Entry(event.time_fired, "Home Assistant", "stopped",
+                              domain=HA_DOMAIN)
+                group_key = _restart_group_key(event)
 
-                start_stop_events[event.time_fired.minute] = 1
+            elif event.event_type == EVENT_STATE_CHANGED:
+                entry = _state_changed_entry(event)
 
-            elif event.event_type == EVENT_HOMEASSISTANT_START:
-                if event.time_fired.minute not in start_stop_events:
+                if entry is None:
                     continue
 
-                start_stop_events[event.time_fired.minute] = 2
+                group_key = None
 
-        # Yield entries
-        for event in events_batch:
-            if event.event_type == EVENT_STATE_CHANGED:
+                # Only the last sensor state of every group is reported
+                if entry.domain == 'sensor':
+                    group_start = event.time_fired.replace(
+                        minute=event.time_fired.minute -
+                        event.time_fired.minute % GROUP_BY_MINUTES,
+                        second=0, microsecond=0)
+                    group_key = '{}@{}'.format(
+                        entry.entity_id, group_start.timestamp())
 
-                # Do not report on new entities
-                if 'old_state' not in event.data:
-                    continue
+            elif event.event_type.lower() == EVENT_LOGBOOK_ENTRY:
+                entry = _logbook_entry(event)
+                group_key = None
 
-                to_state = State.from_dict(event.data.get('new_state'))
+            else:
+                continue
 
-                # If last_changed != last_updated only attributes have changed
-                # we do not report on that yet. Also filter auto groups.
-                if not to_state or \
-                   to_state.last_changed != to_state.last_updated or \
-                   to_state.domain == 'group' and \
-                   to_state.attributes.get('auto', False):
-                    continue
+            cur.execute(
+                "INSERT OR REPLACE INTO logbook_entries (time_fired, name, "
+                "message, domain, entity_id, group_key) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (entry.when, entry.name, entry.message, entry.domain,
+                 entry.entity_id, group_key))
+            self.entries_written += 1
 
-                domain = to_state.domain
+    # pylint: disable=no-self-use
+    def purge(self, cur, purge_before):
+        """Delete the entries from before purge_before."""
+        cur.execute("DELETE FROM logbook_entries WHERE time_fired < ?",
+                    (purge_before,))
 
-                # Skip all but the last sensor state
-                if domain == 'sensor' and \
-                   event != last_sensor_event[to_state.entity_id]:
-                    continue
 
-                yield Entry(
-                    event.time_fired,
-                    name=to_state.name,
-                    message=_entry_message_from_state(domain, to_state),
-                    domain=domain,
-                    entity_id=to_state.entity_id)
+def _restart_group_key(event):
+    """Return the key that groups a stop and start into a restart."""
+    return '{}@{}'.format(HA_DOMAIN, event.time_fired.replace(
+        second=0, microsecond=0).timestamp())
 
-            elif event.event_type == EVENT_HOMEASSISTANT_START:
-                if start_stop_events.get(event.time_fired.minute) == 2:
-                    continue
 
-                yield Entry(
-                    event.time_fired, "Home Assistant", "started",
-                    domain=HA_DOMAIN)
+def _state_changed_entry(event):
+    """Return the entry of a state changed event, None if not reported."""
+    # Do not report on new entities
+    if 'old_state' not in event.data:
+        return None
 
-            elif event.event_type == EVENT_HOMEASSISTANT_STOP:
-                if start_stop_events.get(event.time_fired.minute) == 2:
-                    action = "restarted"
-                else:
-                    action = "stopped"
+    to_state = event.data.get('new_state')
 
-                yield Entry(
-                    event.time_fired, "Home Assistant", action,
-                    domain=HA_DOMAIN)
+    # Recorded events carry the state as a dict
+    if not isinstance(to_state, State):
+        to_state = State.from_dict(to_state)
 
-            elif event.event_type.lower() == EVENT_LOGBOOK_ENTRY:
-                domain = event.data.get(ATTR_DOMAIN)
-                entity_id = event.data.get(ATTR_ENTITY_ID)
-                if domain is None and entity_id is not None:
-                    try:
-                        domain = split_entity_id(str(entity_id))[0]
-                    except IndexError:
-                        pass
-
-                yield Entry(
-                    event.time_fired, event.data.get(ATTR_NAME),
-                    event.data.get(ATTR_MESSAGE), domain,
-                    entity_id)
+    # If last_changed != last_updated only attributes have changed
+    # we do not report on that yet. Also filter auto groups.
+    if not to_state or \
+       to_state.last_changed != to_state.last_updated or \
+       to_state.domain == 'group' and \
+       to_state.attributes.get('auto', False):
+        return None
+
+    domain = to_state.domain
+
+    return Entry(
+        event.time_fired,
+        name=to_state.name,
+        message=_entry_message_from_state(domain, to_state),
+        domain=domain,
+        entity_id=to_state.entity_id)
+
+
+def _logbook_entry(event):
+    """Return the entry of a logbook entry event.
+
+    The event can be fired by anyone, so the values are made strings.
+    """
+    name, message, domain, entity_id = (
+        _optional_str(event.data.get(attr)) for attr in
+        (ATTR_NAME, ATTR_MESSAGE, ATTR_DOMAIN, ATTR_ENTITY_ID))
+
+    if domain is None and entity_id is not None:
+        try:
+            domain = split_entity_id(entity_id)[0]
+        except IndexError:
+            pass
+
+    return Entry(event.time_fired, name, message, domain, entity_id)
+
+
+def _optional_str(value):
+    """Return value as a string, None stays None."""
+    return None if value is None else str(value)
 
 
 def _entry_message_from_state(domain, state):
@@ -15,7 +15,6 @@ from homeassistant.const import (
     ATTR_SERVICE_DATA, EVENT_CALL_SERVICE, EVENT_SERVICE_EXECUTED,
     EVENT_STATE_CHANGED, EVENT_TIME_CHANGED, MATCH_ALL)
 from homeassistant.core import EventOrigin, State
-from homeassistant.remote import JSONEncoder
 
 DOMAIN = "mqtt_eventstream"
 DEPENDENCIES = ['mqtt']
@@ -65,8 +64,9 @@ def setup(hass, config):
         if event.event_type == EVENT_SERVICE_EXECUTED:
             return
 
-        event_info = {'event_type': event.event_type, 'event_data': event.data}
-        msg = json.dumps(event_info, cls=JSONEncoder)
+        # Reuse the JSON of the event data, other sinks might need it too
+        msg = '{{"event_type": {}, "event_data": {}}}'.format(
+            json.dumps(event.event_type), event.data_as_json())
         mqtt.publish(hass, pub_topic, msg)
 
     # Only listen for local events if you are going to publish them.
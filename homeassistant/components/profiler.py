@@ -0,0 +1,84 @@
+"""
+Account the time spent in event listeners and services.
+
+Enables the job profiler of the worker pool, exposes the results on
+/api/profile and periodically logs the slowest callables.
+"""
+import logging
+from datetime import timedelta
+
+import voluptuous as vol
+
+import homeassistant.helpers.config_validation as cv
+import homeassistant.util.dt as dt_util
+from homeassistant.helpers.event import track_point_in_utc_time
+
+DOMAIN = 'profiler'
+DEPENDENCIES = ['http']
+
+URL_API_PROFILE = '/api/profile'
+
+CONF_LOG_INTERVAL = 'log_interval'
+CONF_TOP = 'top'
+
+DEFAULT_LOG_INTERVAL = timedelta(minutes=5)
+DEFAULT_TOP = 10
+
+_LOGGER = logging.getLogger(__name__)
+
+CONFIG_SCHEMA = vol.Schema({
+    DOMAIN: vol.Any(None, vol.Schema({
+        vol.Optional(CONF_LOG_INTERVAL, default=DEFAULT_LOG_INTERVAL):
+            vol.All(cv.time_period, cv.positive_timedelta),
+        vol.Optional(CONF_TOP, default=DEFAULT_TOP):
+            vol.All(vol.Coerce(int), vol.Range(min=1)),
+    })),
+}, extra=vol.ALLOW_EXTRA)
+
+
+def setup(hass, config):
+    """Enable the job profiler."""
+    conf = config.get(DOMAIN) or CONFIG_SCHEMA({DOMAIN: {}})[DOMAIN]
+    log_interval = conf[CONF_LOG_INTERVAL]
+    top = conf[CONF_TOP]
+
+    hass.profiler.enabled = True
+
+    def log_slowest(now):
+        """Log the callables that took the most time."""
+        slowest = hass.profiler.top(top)
+
+        if slowest:
+            _LOGGER.info("Slowest jobs: %s", ", ".join(
+                "{name} ({total:.3f}s in {count} runs, max {max:.3f}s)".format(
+                    **item) for item in slowest))
+
+        track_point_in_utc_time(hass, log_slowest, now + log_interval)
+
+    def handle_get_profile(handler, path_match, data):
+        """Return the profile of the jobs and the worker pool."""
+        count = data.get('top')
+
+        try:
+            count = int(count) if count is not None else None
+        except ValueError:
+            count = None
+
+        profile = hass.profiler.as_dict(count)
+        profile['pool'] = hass.pool.stats
+
+        handler.write_json(profile)
+
+    def handle_delete_profile(handler, path_match, data):
+        """Reset the profile."""
+        hass.profiler.reset()
+
+        handler.write_json_message("Profile reset.")
+
+    hass.http.register_path('GET', URL_API_PROFILE, handle_get_profile)
+    hass.http.register_path('DELETE', URL_API_PROFILE, handle_delete_profile)
+
+    track_point_in_utc_time(
+        hass, log_slowest, dt_util.utcnow() + log_interval)
+
+    return True
@@ -8,19 +8,28 @@ For more details about this component, please refer to the documentation at
 https://home-assistant.io/components/recorder/
 """
 import atexit
+import hashlib
 import json
 import logging
+import math
 import queue
 import sqlite3
 import threading
-from datetime import date, datetime
+import time
+from datetime import date, datetime, timedelta
+from urllib.request import pathname2url
 
+import voluptuous as vol
+
+import homeassistant.helpers.config_validation as cv
+import homeassistant.util as util
 import homeassistant.util.dt as dt_util
 from homeassistant.const import (
-    EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP, EVENT_STATE_CHANGED,
+    ATTR_UNIT_OF_MEASUREMENT, EVENT_HOMEASSISTANT_START,
+    EVENT_HOMEASSISTANT_STOP, EVENT_STATE_CHANGED, EVENT_STATE_CHANGED_BATCH,
     EVENT_TIME_CHANGED, MATCH_ALL)
-from homeassistant.core import Event, EventOrigin, State
-from homeassistant.remote import JSONEncoder
+from homeassistant.core import Event, EventOrigin, State, callback
+from homeassistant.helpers.entity import split_entity_id
 
 DOMAIN = "recorder"
 
@@ -30,6 +39,85 @@ RETURN_ROWCOUNT = "rowcount"
 RETURN_LASTROWID = "lastrowid"
 RETURN_ONE_ROW = "one_row"
 
+# Select states with their attributes. Attributes are shared between the
+# states that have the same ones, older states still carry their own.
+QUERY_STATES = """
+    SELECT states.*, state_attributes.shared_attrs FROM states
+    LEFT JOIN state_attributes ON states.attributes_hash=state_attributes.hash
+"""
+
+CONF_COMMIT_INTERVAL = 'commit_interval'
+CONF_MAX_BATCH_SIZE = 'max_batch_size'
+CONF_READ_CONNECTIONS = 'read_connections'
+CONF_PURGE_DAYS = 'purge_days'
+CONF_PURGE_INTERVAL = 'purge_interval'
+CONF_PURGE_DOMAINS = 'purge_domains'
+CONF_PURGE_EVENT_TYPES = 'purge_event_types'
+CONF_CHECKPOINT_INTERVAL = 'checkpoint_interval'
+CONF_INCLUDE = 'include'
+CONF_EXCLUDE = 'exclude'
+CONF_DOMAINS = 'domains'
+CONF_ENTITIES = 'entities'
+CONF_EVENT_TYPES = 'event_types'
+
+DEFAULT_COMMIT_INTERVAL = timedelta(seconds=1)
+DEFAULT_MAX_BATCH_SIZE = 500
+DEFAULT_READ_CONNECTIONS = 2
+DEFAULT_PURGE_INTERVAL = timedelta(days=1)
+DEFAULT_CHECKPOINT_INTERVAL = timedelta(hours=1)
+
+PURGE_CHUNK_SIZE = 1000
+QUERY_FETCH_SIZE = 500
+# Seconds to wait for an idle read connection before opening an extra one
+READ_CONNECTION_TIMEOUT = 5
+VACUUM_CHUNK_PAGES = 1000
+
+# Values of PRAGMA auto_vacuum
+AUTO_VACUUM_INCREMENTAL = 2
+
+_RETENTION_DAYS = vol.All(vol.Coerce(int), vol.Range(min=1))
+
+# Rollups of numeric states: name of the period, table and seconds
+STATISTICS_PERIODS = (
+    ('5minute', 'statistics_5minute', 300),
+    ('hour', 'statistics_hour', 3600),
+)
+
+# Events that are never recorded. Batches only repeat the state changed
+# events that are recorded.
+IGNORE_EVENT_TYPES = (EVENT_TIME_CHANGED, EVENT_STATE_CHANGED_BATCH)
+
+FILTER_SCHEMA = vol.Schema({
+    vol.Optional(CONF_DOMAINS, default=[]):
+        vol.All(cv.ensure_list, [cv.string]),
+    vol.Optional(CONF_ENTITIES, default=[]): cv.entity_ids,
+    vol.Optional(CONF_EVENT_TYPES, default=[]):
+        vol.All(cv.ensure_list, [cv.string]),
+})
+
+CONFIG_SCHEMA = vol.Schema({
+    DOMAIN: vol.Any(None, vol.Schema({
+        vol.Optional(CONF_COMMIT_INTERVAL, default=DEFAULT_COMMIT_INTERVAL):
+            vol.All(cv.time_period, vol.Range(min=timedelta(0))),
+        vol.Optional(CONF_MAX_BATCH_SIZE, default=DEFAULT_MAX_BATCH_SIZE):
+            vol.All(vol.Coerce(int), vol.Range(min=1)),
+        vol.Optional(CONF_READ_CONNECTIONS, default=DEFAULT_READ_CONNECTIONS):
+            vol.All(vol.Coerce(int), vol.Range(min=0)),
+        vol.Optional(CONF_PURGE_DAYS): _RETENTION_DAYS,
+        vol.Optional(CONF_PURGE_INTERVAL, default=DEFAULT_PURGE_INTERVAL):
+            vol.All(cv.time_period, cv.positive_timedelta),
+        vol.Optional(CONF_PURGE_DOMAINS, default={}):
+            vol.Schema({cv.string: _RETENTION_DAYS}),
+        vol.Optional(CONF_PURGE_EVENT_TYPES, default={}):
+            vol.Schema({cv.string: _RETENTION_DAYS}),
+        vol.Optional(CONF_CHECKPOINT_INTERVAL,
+                     default=DEFAULT_CHECKPOINT_INTERVAL):
+            vol.All(cv.time_period, cv.positive_timedelta),
+        vol.Optional(CONF_INCLUDE, default=FILTER_SCHEMA({})): FILTER_SCHEMA,
+        vol.Optional(CONF_EXCLUDE, default=FILTER_SCHEMA({})): FILTER_SCHEMA,
+    })),
+}, extra=vol.ALLOW_EXTRA)
+
 _INSTANCE = None
 _LOGGER = logging.getLogger(__name__)
 
@@ -38,7 +126,14 @@ def query(sql_query, arguments=None):
     """Query the database."""
     _verify_instance()
 
-    return _INSTANCE.query(sql_query, arguments)
+    return _INSTANCE.read_query(sql_query, arguments)
+
+
+def query_iter(sql_query, arguments=None):
+    """Query the database and yield the rows while they are fetched."""
+    _verify_instance()
+
+    return _INSTANCE.read_query_iter(sql_query, arguments)
 
 
 def query_states(state_query, arguments=None):
@@ -57,19 +152,49 @@ def query_events(event_query, arguments=None):
         if row is not None]
 
 
+def iter_states(state_query, arguments=None):
+    """Query the database and yield states while they are fetched."""
+    return (
+        row for row in
+        (row_to_state(row) for row in query_iter(state_query, arguments))
+        if row is not None)
+
+
+def iter_events(event_query, arguments=None):
+    """Query the database and yield events while they are fetched."""
+    return (
+        row for row in
+        (row_to_event(row) for row in query_iter(event_query, arguments))
+        if row is not None)
+
+
 def row_to_state(row):
     """Convert a database row to a state."""
     try:
         return State(
-            row[1], row[2], json.loads(row[3]),
+            row[1], row[2], json.loads(_row_attributes(row)),
             dt_util.utc_from_timestamp(row[4]),
             dt_util.utc_from_timestamp(row[5]))
-    except ValueError:
+    except (TypeError, ValueError):
         # When json.loads fails
         _LOGGER.exception("Error converting row to state: %s", row)
         return None
 
 
+def _row_attributes(row):
+    """Return the attributes JSON of a states row."""
+    if row[3] is not None:
+        return row[3]
+
+    if 'shared_attrs' in row.keys():
+        # Attributes that went missing are treated as empty, like
+        # shared_attributes does
+        return row['shared_attrs'] or '{}'
+
+    # The query did not join the state_attributes table
+    return _INSTANCE.shared_attributes(row['attributes_hash'])
+
+
 def row_to_event(row):
     """Convert a databse row to an event."""
     try:
@@ -91,11 +216,38 @@ def run_information(point_in_time=None):
     if point_in_time is None or point_in_time > _INSTANCE.recording_start:
         return RecorderRun()
 
-    run = _INSTANCE.query(
+    runs = _INSTANCE.read_query(
         "SELECT * FROM recorder_runs WHERE start<? AND END>?",
-        (point_in_time, point_in_time), return_value=RETURN_ONE_ROW)
+        (point_in_time, point_in_time))
+
+    return RecorderRun(runs[0]) if runs else None
+
+
+def stats():
+    """Return statistics about the writes of the recorder."""
+    _verify_instance()
+
+    return _INSTANCE.stats
 
-    return RecorderRun(run) if run else None
+
+def records_state_changes(entity_id):
+    """Return if the state changes of entity_id are recorded."""
+    _verify_instance()
+
+    return _INSTANCE.records_state_changes(entity_id)
+
+
+def register_writer(writer):
+    """Register a writer that maintains a table from recorded events.
+
+    The writer is called on the recorder thread. writer.setup(cursor)
+    runs once before the first batch it sees, writer.write(cursor,
+    events) in the transaction of every batch and writer.purge(cursor,
+    purge_before) when states and events are purged.
+    """
+    _verify_instance()
+
+    _INSTANCE.register_writer(writer)
 
 
 def setup(hass, config):
@@ -103,7 +255,17 @@ def setup(hass, config):
     # pylint: disable=global-statement
     global _INSTANCE
 
-    _INSTANCE = Recorder(hass)
+    conf = config.get(DOMAIN) or CONFIG_SCHEMA({DOMAIN: {}})[DOMAIN]
+
+    _INSTANCE = Recorder(
+        hass, conf[CONF_COMMIT_INTERVAL].total_seconds(),
+        conf[CONF_MAX_BATCH_SIZE], conf[CONF_READ_CONNECTIONS],
+        purge_days=conf.get(CONF_PURGE_DAYS),
+        purge_interval=conf[CONF_PURGE_INTERVAL].total_seconds(),
+        purge_domains=conf[CONF_PURGE_DOMAINS],
+        purge_event_types=conf[CONF_PURGE_EVENT_TYPES],
+        include=conf[CONF_INCLUDE], exclude=conf[CONF_EXCLUDE],
+        checkpoint_interval=conf[CONF_CHECKPOINT_INTERVAL].total_seconds())
 
     return True
 
@@ -166,10 +328,38 @@ class RecorderRun(object):
 
 
 class Recorder(threading.Thread):
-    """A threaded recorder class."""
+    """A threaded recorder class.
+
+    Events are written in batches. A batch holds the events that arrive
+    within commit_interval seconds of its first event, up to
+    max_batch_size events, and is committed in one transaction.
+
+    The database runs in WAL mode so that reads do not have to wait for
+    the writer. They are served by a pool of up to read_connections
+    read-only connections.
+
+    States and events older than purge_days are deleted every
+    purge_interval seconds. purge_domains and purge_event_types override
+    the number of days to keep per domain and per event type. The purge
+    deletes a chunk at a time in between writing batches, after which
+    the freed pages are vacuumed.
+
+    The include and exclude filters hold lists of domains, entities and
+    event types. Events they filter out never enter the queue.
+
+    States with a numeric state and a unit of measurement are rolled up
+    per STATISTICS_PERIODS as they are written.
+
+    Every checkpoint_interval seconds a checkpoint records the last state
+    of every entity, so the states at a point in time can be looked up
+    without scanning the whole run.
+    """
 
-    # pylint: disable=too-many-instance-attributes
-    def __init__(self, hass):
+    # pylint: disable=too-many-instance-attributes, too-many-arguments
+    def __init__(self, hass, commit_interval=0, max_batch_size=500,
+                 read_connections=2, purge_days=None, purge_interval=86400,
+                 purge_domains=None, purge_event_types=None, include=None,
+                 exclude=None, checkpoint_interval=3600):
         """Initialize the recorder."""
         threading.Thread.__init__(self)
 
@@ -177,7 +367,52 @@ class Recorder(threading.Thread):
         self.conn = None
         self.queue = queue.Queue()
         self.quit_object = object()
+        self.flush_object = object()
         self.lock = threading.Lock()
+        self._stop_lock = threading.Lock()
+        self._stopped = False
+        self._waiting = 0
+        self.commit_interval = commit_interval
+        self.max_batch_size = max_batch_size
+        self.commit_latency = util.Histogram()
+        self.events_written = 0
+        self._next_event_id = None
+        self._next_state_id = None
+        self._queue_warning_limit = 1000
+        self.read_connections = read_connections
+        self._read_pool = queue.Queue()
+        self._read_lock = threading.Lock()
+        self._read_opened = []
+        self._wal = False
+        # Per entity the last attributes written and their hash
+        self._attributes_cache = {}
+        # The cache is not used while unused attributes are being deleted
+        self._purging_attributes = False
+        self.purge_days = purge_days
+        self.purge_interval = purge_interval
+        self.purge_domains = purge_domains or {}
+        self.purge_event_types = purge_event_types or {}
+        self._next_purge = None
+        self._purge_steps = None
+        include = include or {}
+        exclude = exclude or {}
+        self._include_domains = set(include.get(CONF_DOMAINS, ()))
+        self._include_entities = set(include.get(CONF_ENTITIES, ()))
+        self._include_event_types = set(include.get(CONF_EVENT_TYPES, ()))
+        self._exclude_domains = set(exclude.get(CONF_DOMAINS, ()))
+        self._exclude_entities = set(exclude.get(CONF_ENTITIES, ()))
+        self._exclude_event_types = set(exclude.get(CONF_EVENT_TYPES, ()))
+        self._exclude_event_types.update(IGNORE_EVENT_TYPES)
+        # Per entity if its state changes are recorded
+        self._record_entity_cache = {}
+        # Per rollup table and entity the bucket being filled
+        self._statistics = {}
+        self.checkpoint_interval = checkpoint_interval
+        self._next_checkpoint = None
+        # Per entity the id of the last state written in this run
+        self._last_state_ids = {}
+        self._writers = []
+        self._new_writers = []
         self.recording_start = dt_util.utcnow()
         self.utc_offset = dt_util.now().utcoffset().total_seconds()
         self.db_path = self.hass.config.path(DB_FILE)
@@ -194,82 +429,538 @@ class Recorder(threading.Thread):
         """Start processing events to save."""
         self._setup_connection()
         self._setup_run()
+        self._setup_writers()
+
+        if (self.purge_days is not None or self.purge_domains or
+                self.purge_event_types):
+            self._next_purge = time.monotonic()
+
+        self._next_checkpoint = time.monotonic() + self.checkpoint_interval
 
         while True:
-            event = self.queue.get()
+            batch, taken, stop = self._next_batch()
+
+            if batch:
+                self._write_batch(batch)
 
-            if event == self.quit_object:
+            if not stop:
+                self._purge_step()
+                self._checkpoint_step()
+
+            for _ in range(taken):
+                self.queue.task_done()
+
+            if stop:
                 self._close_run()
                 self._close_connection()
-                self.queue.task_done()
+                self._drain()
                 return
 
-            elif event.event_type == EVENT_TIME_CHANGED:
+    def _drain(self):
+        """Discard what is left in the queue after stopping."""
+        with self._stop_lock:
+            self._stopped = True
+
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    return
+
                 self.queue.task_done()
+
+    def _next_batch(self):
+        """Collect the events to write in the next transaction.
+
+        Returns the events, the number of items taken from the queue and
+        if the recorder should stop.
+        """
+        batch = []
+        taken = 0
+        deadline = None
+
+        while len(batch) < self.max_batch_size:
+            if deadline is None:
+                try:
+                    event = self.queue.get(timeout=self._idle_timeout())
+                except queue.Empty:
+                    break
+                deadline = time.monotonic() + self.commit_interval
+            else:
+                # Events that arrive after a flush are committed right
+                # away as long as someone waits for the queue to empty.
+                timeout = 0 if self._waiting else deadline - time.monotonic()
+
+                try:
+                    event = self.queue.get(timeout=max(0, timeout))
+                except queue.Empty:
+                    break
+
+            taken += 1
+
+            if event is self.quit_object:
+                return batch, taken, True
+
+            elif event is self.flush_object:
+                break
+
+            batch.append(event)
+
+        return batch, taken, False
+
+    def _idle_timeout(self):
+        """Return how long to wait for events before purging."""
+        if self._purge_steps is not None:
+            return 0
+
+        deadlines = [deadline for deadline
+                     in (self._next_purge, self._next_checkpoint)
+                     if deadline is not None]
+
+        if not deadlines:
+            return None
+
+        return max(0, min(deadlines) - time.monotonic())
+
+    def _checkpoint_step(self):
+        """Write a checkpoint if one is due."""
+        if (self._next_checkpoint is None or
+                time.monotonic() < self._next_checkpoint):
+            return
+
+        self._write_checkpoint()
+        self._next_checkpoint = time.monotonic() + self.checkpoint_interval
+
+    def _write_checkpoint(self):
+        """Record the last state of every entity written in this run."""
+        try:
+            with self.conn, self.lock:
+                cur = self.conn.cursor()
+                cur.execute(
+                    "INSERT INTO checkpoints (created, max_state_id) "
+                    "VALUES (?, ?)",
+                    (dt_util.utcnow(), self._next_state_id - 1))
+                checkpoint_id = cur.lastrowid
+                cur.executemany(
+                    "INSERT INTO checkpoint_states (checkpoint_id, state_id) "
+                    "VALUES (?, ?)",
+                    ((checkpoint_id, state_id)
+                     for state_id in self._last_state_ids.values()))
+
+        except (sqlite3.IntegrityError, sqlite3.OperationalError,
+                sqlite3.ProgrammingError):
+            _LOGGER.exception("Error writing checkpoint")
+
+    def _purge_step(self):
+        """Run the next step of the purge if one is due."""
+        if self._purge_steps is None:
+            if self._next_purge is None or time.monotonic() < self._next_purge:
+                return
+
+            self._purge_steps = self._purge(dt_util.utcnow())
+
+        try:
+            next(self._purge_steps)
+        except StopIteration:
+            self._purge_steps = None
+            self._next_purge = time.monotonic() + self.purge_interval
+
+    def _purge(self, now):
+        """Delete the states and events that expired.
+
+        This is a generator that yields after every chunk it deletes, so
+        that batches can be written in between.
+        """
+        states_deleted = 0
+        events_deleted = 0
+
+        for domain in [row[0] for row in self.query(
+                "SELECT DISTINCT domain FROM states")]:
+            days = self.purge_domains.get(domain, self.purge_days)
+
+            if days is None:
                 continue
 
-            event_id = self.record_event(event)
+            for deleted in self._delete_chunks(
+                    "DELETE FROM states WHERE state_id IN ("
+                    "SELECT state_id FROM states "
+                    "WHERE domain=? AND last_updated<? LIMIT ?)",
+                    domain, now - timedelta(days=days)):
+                states_deleted += deleted
+                yield
 
-            if event.event_type == EVENT_STATE_CHANGED:
-                self.record_state(
-                    event.data['entity_id'], event.data.get('new_state'),
-                    event_id)
+        for event_type in [row[0] for row in self.query(
+                "SELECT DISTINCT event_type FROM events")]:
+            days = self.purge_event_types.get(event_type, self.purge_days)
+
+            if days is None:
+                continue
+
+            for deleted in self._delete_chunks(
+                    "DELETE FROM events WHERE event_id IN ("
+                    "SELECT event_id FROM events "
+                    "WHERE event_type=? AND time_fired<? LIMIT ?)",
+                    event_type, now - timedelta(days=days)):
+                events_deleted += deleted
+                yield
+
+        if self.purge_days is not None:
+            yield from self._purge_checkpoints(
+                now - timedelta(days=self.purge_days))
+
+            for writer in self._writers:
+                try:
+                    with self.conn, self.lock:
+                        writer.purge(self.conn.cursor(),
+                                     now - timedelta(days=self.purge_days))
+                except (sqlite3.OperationalError, sqlite3.ProgrammingError):
+                    _LOGGER.exception("Error purging writer %s", writer)
+                yield
+
+        if states_deleted:
+            yield from self._purge_attributes()
+
+        if states_deleted or events_deleted:
+            _LOGGER.info("Purged %d states and %d events",
+                         states_deleted, events_deleted)
+
+            yield from self._vacuum()
+
+    def _delete_chunks(self, sql_query, key, purge_before):
+        """Run a chunked delete query till it deletes less than a chunk.
+
+        Yields the number of rows deleted by every chunk.
+        """
+        while True:
+            deleted = self.query(
+                sql_query, (key, purge_before, PURGE_CHUNK_SIZE),
+                return_value=RETURN_ROWCOUNT) or 0
+
+            yield deleted
+
+            if deleted < PURGE_CHUNK_SIZE:
+                return
+
+    def _purge_checkpoints(self, purge_before):
+        """Delete the checkpoints made before purge_before."""
+        for row in self.query(
+                "SELECT checkpoint_id FROM checkpoints WHERE created<?",
+                (purge_before,)):
+            # A checkpoint without its states would hide entities, so
+            # the checkpoint goes first.
+            self.query("DELETE FROM checkpoints WHERE checkpoint_id=?",
+                       (row[0],))
+            self.query("DELETE FROM checkpoint_states WHERE checkpoint_id=?",
+                       (row[0],))
+
+            yield
+
+    def _purge_attributes(self):
+        """Delete the attributes no state refers to anymore.
+
+        Batches are written between the chunks. Until the last chunk is
+        done they store the attributes of every state again, as cached
+        attributes might have been deleted by an earlier chunk.
+        """
+        last_hash = None
+        self._attributes_cache.clear()
+        self._purging_attributes = True
+
+        try:
+            while True:
+                if last_hash is None:
+                    rows = self.query(
+                        "SELECT hash FROM state_attributes ORDER BY hash "
+                        "LIMIT ?", (PURGE_CHUNK_SIZE,))
+                else:
+                    rows = self.query(
+                        "SELECT hash FROM state_attributes WHERE hash>? "
+                        "ORDER BY hash LIMIT ?",
+                        (last_hash, PURGE_CHUNK_SIZE))
+
+                if not rows:
+                    break
+
+                self.query(
+                    "DELETE FROM state_attributes WHERE hash>=? AND hash<=? "
+                    "AND NOT EXISTS (SELECT 1 FROM states "
+                    "WHERE states.attributes_hash=state_attributes.hash)",
+                    (rows[0][0], rows[-1][0]))
+                last_hash = rows[-1][0]
+
+                yield
+
+        finally:
+            self._purging_attributes = False
+
+    def _vacuum(self):
+        """Return the pages freed by the purge to the file system."""
+        auto_vacuum = self.query("PRAGMA auto_vacuum")[0][0]
+
+        if auto_vacuum != AUTO_VACUUM_INCREMENTAL:
+            # Databases created before the recorder purged need a full
+            # vacuum once to switch to incremental vacuuming.
+            _LOGGER.info("Vacuuming database to enable incremental vacuum")
+            self.query("PRAGMA auto_vacuum=INCREMENTAL")
+            self.query("VACUUM")
+            return
+
+        while self.query("PRAGMA freelist_count")[0][0]:
+            self.query("PRAGMA incremental_vacuum({})".format(
+                VACUUM_CHUNK_PAGES))
+
+            yield
+
+    def _record_entity(self, entity_id):
+        """Return if the state changes of entity_id are recorded."""
+        if entity_id in self._include_entities:
+            return True
+
+        if entity_id in self._exclude_entities:
+            return False
+
+        domain = split_entity_id(entity_id)[0]
+
+        if domain in self._exclude_domains:
+            return False
+
+        if self._include_domains or self._include_entities:
+            return domain in self._include_domains
+
+        return True
+
+    def _records_event_type(self, event_type):
+        """Return if events of event_type are recorded."""
+        return event_type not in self._exclude_event_types and (
+            not self._include_event_types or
+            event_type in self._include_event_types)
+
+    def register_writer(self, writer):
+        """Register a writer to call for every batch."""
+        self._new_writers.append(writer)
+
+    def _setup_writers(self):
+        """Set up the writers that were registered since the last batch."""
+        while self._new_writers:
+            writer = self._new_writers.pop(0)
+
+            try:
+                with self.conn, self.lock:
+                    writer.setup(self.conn.cursor())
+
+            except (sqlite3.IntegrityError, sqlite3.OperationalError,
+                    sqlite3.ProgrammingError):
+                _LOGGER.exception("Error setting up writer %s", writer)
+                continue
 
-            self.queue.task_done()
+            self._writers.append(writer)
 
+    def records_state_changes(self, entity_id):
+        """Return if the state changes of entity_id are recorded."""
+        record = self._record_entity_cache.get(entity_id)
+
+        if record is None:
+            record = (self._records_event_type(EVENT_STATE_CHANGED) and
+                      self._record_entity(entity_id))
+            self._record_entity_cache[entity_id] = record
+
+        return record
+
+    @callback
     def event_listener(self, event):
         """Listen for new events and put them in the process queue."""
+        event_type = event.event_type
+
+        if event_type == EVENT_STATE_CHANGED:
+            if not self.records_state_changes(event.data['entity_id']):
+                return
+
+        elif not self._records_event_type(event_type):
+            return
+
         self.queue.put(event)
 
+        depth = self.queue.qsize()
+
+        if depth > self._queue_warning_limit:
+            self._queue_warning_limit *= 2
+            _LOGGER.warning("%d events are waiting to be recorded", depth)
+
     def shutdown(self, event):
         """Tell the recorder to shut down."""
         self.queue.put(self.quit_object)
         self.block_till_done()
 
-    def record_state(self, entity_id, state, event_id):
-        """Save a state to the database."""
+    @property
+    def stats(self):
+        """Return statistics about the writes of the recorder."""
+        return {
+            'queue_depth': self.queue.qsize(),
+            'events_written': self.events_written,
+            'commit_latency': self.commit_latency.as_dict(),
+        }
+
+    def shared_attributes(self, attributes_hash):
+        """Return the attributes JSON stored under attributes_hash."""
+        rows = self.read_query(
+            "SELECT shared_attrs FROM state_attributes WHERE hash=?",
+            (attributes_hash,))
+
+        return rows[0][0] if rows else '{}'
+
+    def _write_batch(self, events):
+        """Save events and the states they carry in one transaction."""
         now = dt_util.utcnow()
+        event_rows = []
+        state_rows = []
+        attribute_rows = []
+        measurements = []
+        state_ids = {}
+
+        for event in events:
+            # We are the only writer, so we can hand out the ids ourselves
+            # and link the states without a query per event.
+            event_id = self._next_event_id
+            self._next_event_id += 1
+
+            event_rows.append((
+                event_id, event.event_type, event.data_as_json(),
+                str(event.origin), now, event.time_fired, self.utc_offset))
+
+            if event.event_type == EVENT_STATE_CHANGED:
+                entity_id = event.data['entity_id']
+                new_state = event.data.get('new_state')
+                state_ids[entity_id] = self._next_state_id
+                self._next_state_id += 1
+                state_rows.append((state_ids[entity_id],) + self._state_row(
+                    entity_id, new_state, event_id, now, attribute_rows))
+
+                value = numeric_value(new_state)
+
+                if value is not None:
+                    measurements.append((
+                        new_state.entity_id, value,
+                        new_state.last_updated.timestamp()))
+
+        statistics_rows = self._statistics_rows(measurements)
+        self._setup_writers()
+        start = time.monotonic()
+
+        try:
+            with self.conn, self.lock:
+                cur = self.conn.cursor()
+                cur.executemany(
+                    "INSERT INTO events (event_id, event_type, event_data, "
+                    "origin, created, time_fired, utc_offset) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", event_rows)
+
+                if attribute_rows:
+                    cur.executemany(
+                        "INSERT OR IGNORE INTO state_attributes "
+                        "(hash, shared_attrs) VALUES (?, ?)", attribute_rows)
+
+                if state_rows:
+                    cur.executemany(
+                        "INSERT INTO states (state_id, entity_id, domain, "
+                        "state, attributes_hash, last_changed, last_updated, "
+                        "created, utc_offset, event_id) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", state_rows)
+
+                for table, rows in statistics_rows.items():
+                    cur.executemany(
+                        "INSERT OR REPLACE INTO {} (entity_id, start, min, "
+                        "max, mean, last, count) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)".format(table),
+                        rows.values())
+
+                for writer in self._writers:
+                    # A failing writer should not cost us the batch. What
+                    # it wrote before failing is kept.
+                    try:
+                        writer.write(cur, events)
+                    except Exception:  # pylint: disable=broad-except
+                        _LOGGER.exception("Error in writer %s", writer)
+
+        except (sqlite3.IntegrityError, sqlite3.OperationalError,
+                sqlite3.ProgrammingError):
+            _LOGGER.exception("Error saving %d events", len(events))
+            # The cache might point at attributes that were not saved
+            self._attributes_cache.clear()
+            return
+
+        self._last_state_ids.update(state_ids)
+        self.commit_latency.add(time.monotonic() - start)
+        self.events_written += len(events)
+
+    def _statistics_rows(self, measurements):
+        """Add measurements to their rollups.
+
+        Returns per table the rows of the rollups that changed.
+        """
+        statistics_rows = {}
+
+        for entity_id, value, timestamp in measurements:
+            for _, table, seconds in STATISTICS_PERIODS:
+                start = timestamp - timestamp % seconds
+                bucket = self._statistics.get((table, entity_id))
+
+                if bucket is None:
+                    # We might have filled this bucket before a restart
+                    rows = self.query(
+                        "SELECT min, max, mean, last, count FROM {} "
+                        "WHERE entity_id=? AND start=?".format(table),
+                        (entity_id, start))
+                    bucket = StatisticsBucket(start, rows[0] if rows else None)
+
+                elif bucket.start < start:
+                    bucket = StatisticsBucket(start)
+
+                elif bucket.start > start:
+                    # States that arrive out of order are not rolled up
+                    continue
+
+                self._statistics[(table, entity_id)] = bucket
+                bucket.add(value)
+                table_rows = statistics_rows.setdefault(table, {})
+                table_rows[(entity_id, start)] = bucket.as_row(entity_id)
 
+        return statistics_rows
+
+    def _state_row(self, entity_id, state, event_id, now, attribute_rows):
+        """Return the row to save a state to the database.
+
+        Attributes that are not known to be stored yet are added to
+        attribute_rows.
+        """
         # State got deleted
         if state is None:
             state_state = ''
             state_domain = ''
-            state_attr = '{}'
+            attributes = {}
             last_changed = last_updated = now
         else:
             state_domain = state.domain
             state_state = state.state
-            state_attr = json.dumps(dict(state.attributes))
+            attributes = state.attributes
             last_changed = state.last_changed
             last_updated = state.last_updated
 
-        info = (
-            entity_id, state_domain, state_state, state_attr,
+        cached = self._attributes_cache.get(entity_id)
+
+        if cached is not None and not self._purging_attributes and \
+           (cached[0] is attributes or cached[0] == attributes):
+            attributes_hash = cached[1]
+        else:
+            shared_attrs = json.dumps(dict(attributes), sort_keys=True)
+            attributes_hash = _hash_attributes(shared_attrs)
+            attribute_rows.append((attributes_hash, shared_attrs))
+            self._attributes_cache[entity_id] = (attributes, attributes_hash)
+
+        return (
+            entity_id, state_domain, state_state, attributes_hash,
             last_changed, last_updated,
             now, self.utc_offset, event_id)
 
-        self.query(
-            """
-            INSERT INTO states (
-            entity_id, domain, state, attributes, last_changed, last_updated,
-            created, utc_offset, event_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            info)
-
-    def record_event(self, event):
-        """Save an event to the database."""
-        info = (
-            event.event_type, json.dumps(event.data, cls=JSONEncoder),
-            str(event.origin), dt_util.utcnow(), event.time_fired,
-            self.utc_offset
-        )
-
-        return self.query(
-            "INSERT INTO events ("
-            "event_type, event_data, origin, created, time_fired, utc_offset"
-            ") VALUES (?, ?, ?, ?, ?, ?)", info, RETURN_LASTROWID)
-
     def query(self, sql_query, data=None, return_value=None):
         """Query the database."""
         try:
@@ -298,15 +989,138 @@ class Recorder(threading.Thread):
                 "Error querying the database using: %s", sql_query)
             return []
 
+    def read_query(self, sql_query, data=None):
+        """Run a read query, without waiting for the writer if possible."""
+        if not self._wal or not self.read_connections:
+            return self.query(sql_query, data)
+
+        conn = self._read_connection()
+
+        try:
+            _LOGGER.debug("Running read query %s", sql_query)
+
+            cur = conn.cursor()
+
+            if data is not None:
+                cur.execute(sql_query, data)
+            else:
+                cur.execute(sql_query)
+
+            return cur.fetchall()
+
+        except (sqlite3.OperationalError, sqlite3.ProgrammingError):
+            _LOGGER.exception(
+                "Error querying the database using: %s", sql_query)
+            return []
+
+        finally:
+            self._release_read_connection(conn)
+
+    def read_query_iter(self, sql_query, data=None):
+        """Run a read query and yield the rows in batches.
+
+        The read connection is held until the rows are consumed or the
+        generator is closed, other readers open an extra connection if
+        they have to wait too long for it. Without a read pool all rows are
+        fetched at once from the writer connection.
+        """
+        if not self._wal or not self.read_connections:
+            yield from self.query(sql_query, data)
+            return
+
+        conn = self._read_connection()
+        cur = conn.cursor()
+
+        try:
+            _LOGGER.debug("Running read query %s", sql_query)
+
+            if data is not None:
+                cur.execute(sql_query, data)
+            else:
+                cur.execute(sql_query)
+
+            rows = cur.fetchmany(QUERY_FETCH_SIZE)
+
+            while rows:
+                yield from rows
+                rows = cur.fetchmany(QUERY_FETCH_SIZE)
+
+        except (sqlite3.OperationalError, sqlite3.ProgrammingError):
+            _LOGGER.exception(
+                "Error querying the database using: %s", sql_query)
+
+        finally:
+            # Ends the read transaction of a query that was not consumed
+            cur.close()
+            self._release_read_connection(conn)
+
+    def _release_read_connection(self, conn):
+        """Return a read connection to the pool."""
+        with self._read_lock:
+            if conn in self._read_opened:
+                self._read_pool.put(conn)
+            else:
+                # The pool got closed while we were reading
+                conn.close()
+
+    def _read_connection(self):
+        """Return an idle read connection, opening one if allowed.
+
+        If all read connections stay busy, for example with long streamed
+        queries, a connection is opened that is closed after use.
+        """
+        try:
+            return self._read_pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._read_lock:
+            if len(self._read_opened) < self.read_connections:
+                conn = self._open_read_connection()
+                self._read_opened.append(conn)
+                return conn
+
+        try:
+            return self._read_pool.get(timeout=READ_CONNECTION_TIMEOUT)
+        except queue.Empty:
+            _LOGGER.debug("No idle read connection, opening an extra one")
+            return self._open_read_connection()
+
+    def _open_read_connection(self):
+        """Open a read only connection to the database."""
+        conn = sqlite3.connect(
+            'file:{}?mode=ro'.format(pathname2url(self.db_path)),
+            uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
     def block_till_done(self):
         """Block till all events processed."""
-        self.queue.join()
+        # Do not wait for the commit interval to pass
+        with self._stop_lock:
+            if not self._stopped:
+                self.queue.put(self.flush_object)
+            self._waiting += 1
+
+        try:
+            self.queue.join()
+        finally:
+            with self._stop_lock:
+                self._waiting -= 1
 
     def _setup_connection(self):
         """Ensure database is ready to fly."""
         self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
 
+        if self.db_path != ':memory:':
+            # Readers and the writer do not block each other in WAL mode.
+            # Syncing on checkpoints only is safe with WAL.
+            journal_mode = self.conn.execute(
+                'PRAGMA journal_mode=WAL').fetchone()[0]
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self._wal = journal_mode.lower() == 'wal'
+
         # Make sure the database is closed whenever Python exits
         # without the STOP event being fired.
         atexit.register(self._close_connection)
@@ -330,7 +1144,9 @@ class Recorder(threading.Thread):
             migration_id = cur.fetchone()[0] or 0
 
         except sqlite3.OperationalError:
-            # The table does not exist.
+            # The table does not exist. Before any table is created we can
+            # still pick how freed pages are returned.
+            cur.execute('PRAGMA auto_vacuum=INCREMENTAL')
             cur.execute('CREATE TABLE schema_version ('
                         'migration_id integer primary key, performed integer)')
             migration_id = 0
@@ -450,10 +1266,105 @@ class Recorder(threading.Thread):
                 states (domain, last_updated, entity_id)""")
             save_migration(5)
 
+        if migration_id < 6:
+            # Store every distinct set of attributes only once.
+            cur.execute("""
+                CREATE TABLE state_attributes (
+                    hash integer primary key,
+                    shared_attrs text)
+            """)
+
+            cur.execute("""
+                ALTER TABLE states
+                ADD COLUMN attributes_hash integer
+            """)
+
+            self.conn.create_function(
+                "hash_attributes", 1, _hash_attributes)
+
+            cur.execute("""
+                INSERT OR IGNORE INTO state_attributes (hash, shared_attrs)
+                SELECT hash_attributes(attributes), attributes FROM states
+            """)
+            cur.execute("""
+                UPDATE states SET
+                attributes_hash=hash_attributes(attributes), attributes=NULL
+            """)
+            save_migration(6)
+
+        if migration_id < 7:
+            # Used to find the attributes that can be purged
+            cur.execute("""
+                CREATE INDEX states__attributes_hash ON
+                states (attributes_hash)""")
+
+            # Used to find the events that can be purged
+            cur.execute("""
+                CREATE INDEX events__event_type_time_fired ON
+                events (event_type, time_fired)""")
+            cur.execute('DROP INDEX events__event_type')
+            save_migration(7)
+
+        if migration_id < 8:
+            for _, table, _ in STATISTICS_PERIODS:
+                cur.execute("""
+                    CREATE TABLE {} (
+                        entity_id text,
+                        start integer,
+                        min real,
+                        max real,
+                        mean real,
+                        last real,
+                        count integer,
+                        PRIMARY KEY (entity_id, start))
+                """.format(table))
+            save_migration(8)
+
+        if migration_id < 9:
+            cur.execute("""
+                CREATE TABLE checkpoints (
+                    checkpoint_id integer primary key,
+                    created integer,
+                    max_state_id integer)
+            """)
+            cur.execute(
+                'CREATE INDEX checkpoints__created ON checkpoints(created)')
+
+            cur.execute("""
+                CREATE TABLE checkpoint_states (
+                    checkpoint_id integer,
+                    state_id integer)
+            """)
+            cur.execute("""
+                CREATE INDEX checkpoint_states__checkpoint_id ON
+                checkpoint_states (checkpoint_id)""")
+            save_migration(9)
+
+        if migration_id < 10:
+            # Used by the logbook to join state changed events to states
+            cur.execute('CREATE INDEX states__event_id ON states(event_id)')
+            save_migration(10)
+
+        cur.execute('SELECT max(event_id) FROM events')
+        self._next_event_id = (cur.fetchone()[0] or 0) + 1
+        cur.execute('SELECT max(state_id) FROM states')
+        self._next_state_id = (cur.fetchone()[0] or 0) + 1
+
     def _close_connection(self):
         """Close connection to the database."""
         _LOGGER.info("Closing database")
         atexit.unregister(self._close_connection)
+
+        with self._read_lock:
+            self._wal = False
+            self._read_opened = []
+
+            while True:
+                try:
+                    self._read_pool.get_nowait().close()
+                except queue.Empty:
+                    break
+
         self.conn.close()
 
     def _setup_run(self):
@@ -476,6 +1387,61 @@ class Recorder(threading.Thread):
             (dt_util.utcnow(), self.recording_start))
 
 
+class StatisticsBucket(object):
+    """Rollup of the numeric states of an entity during a period."""
+
+    __slots__ = ['start', 'min', 'max', 'total', 'last', 'count']
+
+    def __init__(self, start, row=None):
+        """Initialize a bucket, continuing the rollup in row if given."""
+        self.start = start
+
+        if row is None:
+            self.min = self.max = self.last = None
+            self.total = 0.0
+            self.count = 0
+        else:
+            self.min, self.max, mean, self.last, self.count = row
+            self.total = mean * self.count
+
+    def add(self, value):
+        """Add a value to the rollup."""
+        if self.count:
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+        else:
+            self.min = self.max = value
+
+        self.total += value
+        self.last = value
+        self.count += 1
+
+    def as_row(self, entity_id):
+        """Return the rollup as a row of a statistics table."""
+        return (entity_id, self.start, self.min, self.max,
+                self.total / self.count, self.last, self.count)
+
+
+def numeric_value(state):
+    """Return the value of a state that is a measurement, else None."""
+    if state is None or ATTR_UNIT_OF_MEASUREMENT not in state.attributes:
+        return None
+
+    try:
+        value = float(state.state)
+    except ValueError:
+        return None
+
+    return value if math.isfinite(value) else None
+
+
+def _hash_attributes(shared_attrs):
+    """Return the key of attributes JSON in the state_attributes table."""
+    return int.from_bytes(
+        hashlib.sha1(shared_attrs.encode('utf-8')).digest()[:8],
+        'big', signed=True)
+
+
 def _adapt_datetime(datetimestamp):
     """Turn a datetime into an integer for in the DB."""
     return dt_util.as_utc(datetimestamp).timestamp()
@@ -5,10 +5,12 @@ from types import MappingProxyType
 
 import voluptuous as vol
 
+import homeassistant.util as util
 import homeassistant.util.location as loc_util
 from homeassistant.const import (
-    CONF_LATITUDE, CONF_LONGITUDE, CONF_NAME, CONF_TEMPERATURE_UNIT,
-    CONF_TIME_ZONE, CONF_CUSTOMIZE)
+    CONF_JOB_QUEUE_LIMITS, CONF_LATITUDE, CONF_LONGITUDE,
+    CONF_MAX_WORKER_THREADS, CONF_NAME, CONF_TEMPERATURE_UNIT, CONF_TIME_ZONE,
+    CONF_CUSTOMIZE)
 from homeassistant.exceptions import HomeAssistantError
 from homeassistant.util.yaml import load_yaml
 import homeassistant.helpers.config_validation as cv
@@ -19,6 +21,9 @@ _LOGGER = logging.getLogger(__name__)
 YAML_CONFIG_FILE = 'configuration.yaml'
 CONFIG_DIR_NAME = '.homeassistant'
 
+CONF_MAX = 'max'
+CONF_OVERFLOW = 'overflow'
+
 DEFAULT_CONFIG = (
     # Tuples (attribute, default, auto detect property, description)
     (CONF_NAME, 'Home', None, 'Name of the location where Home Assistant is '
@@ -57,12 +62,21 @@ def _valid_customize(value):
 
     return value
 
+
+_valid_job_queue_limit = vol.Schema({
+    vol.Required(CONF_MAX): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Optional(CONF_OVERFLOW, default=util.OVERFLOW_DROP_OLDEST):
+        vol.In(util.OVERFLOW_POLICIES),
+})
+
 CORE_CONFIG_SCHEMA = vol.Schema({
     CONF_NAME: vol.Coerce(str),
     CONF_LATITUDE: cv.latitude,
     CONF_LONGITUDE: cv.longitude,
     CONF_TEMPERATURE_UNIT: cv.temperature_unit,
     CONF_TIME_ZONE: cv.time_zone,
+    CONF_MAX_WORKER_THREADS: cv.positive_int,
+    CONF_JOB_QUEUE_LIMITS: {cv.string: _valid_job_queue_limit},
     vol.Required(CONF_CUSTOMIZE,
                  default=MappingProxyType({})): _valid_customize,
 })
@@ -35,8 +35,10 @@ CONF_FILENAME = 'filename'
 CONF_HOST = 'host'
 CONF_HOSTS = 'hosts'
 CONF_ICON = 'icon'
+CONF_JOB_QUEUE_LIMITS = 'job_queue_limits'
 CONF_LATITUDE = 'latitude'
 CONF_LONGITUDE = 'longitude'
+CONF_MAX_WORKER_THREADS = 'max_worker_threads'
 CONF_MONITORED_CONDITIONS = 'monitored_conditions'
 CONF_NAME = 'name'
 CONF_OFFSET = 'offset'
@@ -57,6 +59,7 @@ CONF_ZONE = 'zone'
 EVENT_HOMEASSISTANT_START = "homeassistant_start"
 EVENT_HOMEASSISTANT_STOP = "homeassistant_stop"
 EVENT_STATE_CHANGED = "state_changed"
+EVENT_STATE_CHANGED_BATCH = "state_changed_batch"
 EVENT_TIME_CHANGED = "time_changed"
 EVENT_CALL_SERVICE = "call_service"
 EVENT_SERVICE_EXECUTED = "service_executed"
@@ -210,12 +213,16 @@ URL_API_COMPONENTS = "/api/components"
 URL_API_ERROR_LOG = "/api/error_log"
 URL_API_LOG_OUT = "/api/log_out"
 URL_API_TEMPLATE = "/api/template"
+URL_API_POOL = "/api/pool"
+URL_API_WEBSOCKET = "/api/websocket"
 
+HTTP_SWITCHING_PROTOCOLS = 101
 HTTP_OK = 200
 HTTP_CREATED = 201
 HTTP_MOVED_PERMANENTLY = 301
 HTTP_BAD_REQUEST = 400
 HTTP_UNAUTHORIZED = 401
+HTTP_FORBIDDEN = 403
 HTTP_NOT_FOUND = 404
 HTTP_METHOD_NOT_ALLOWED = 405
 HTTP_UNPROCESSABLE_ENTITY = 422
@@ -227,6 +234,7 @@ HTTP_HEADER_CONTENT_TYPE = "Content-type"
 HTTP_HEADER_CONTENT_ENCODING = "Content-Encoding"
 HTTP_HEADER_VARY = "Vary"
 HTTP_HEADER_CONTENT_LENGTH = "Content-Length"
+HTTP_HEADER_TRANSFER_ENCODING = "Transfer-Encoding"
 HTTP_HEADER_CACHE_CONTROL = "Cache-Control"
 HTTP_HEADER_EXPIRES = "Expires"
 HTTP_HEADER_ORIGIN = "Origin"
@@ -7,9 +7,13 @@ of entities and react to changes.
 
 import enum
 import functools as ft
+import heapq
+import itertools
+import json
 import logging
 import os
 import signal
+import sys
 import threading
 import time
 from types import MappingProxyType
@@ -22,16 +26,17 @@ import homeassistant.util.dt as dt_util
 import homeassistant.util.location as location
 from homeassistant.config import get_default_config_dir
 from homeassistant.const import (
-    ATTR_DOMAIN, ATTR_FRIENDLY_NAME, ATTR_NOW, ATTR_SERVICE,
+    ATTR_DOMAIN, ATTR_ENTITY_ID, ATTR_FRIENDLY_NAME, ATTR_NOW, ATTR_SERVICE,
     ATTR_SERVICE_CALL_ID, ATTR_SERVICE_DATA, EVENT_CALL_SERVICE,
     EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP,
     EVENT_SERVICE_EXECUTED, EVENT_SERVICE_REGISTERED, EVENT_STATE_CHANGED,
-    EVENT_TIME_CHANGED, MATCH_ALL, RESTART_EXIT_CODE,
-    SERVICE_HOMEASSISTANT_RESTART, SERVICE_HOMEASSISTANT_STOP, TEMP_CELSIUS,
-    TEMP_FAHRENHEIT, __version__)
+    EVENT_STATE_CHANGED_BATCH, EVENT_TIME_CHANGED, MATCH_ALL,
+    RESTART_EXIT_CODE, SERVICE_HOMEASSISTANT_RESTART,
+    SERVICE_HOMEASSISTANT_STOP, TEMP_CELSIUS, TEMP_FAHRENHEIT, __version__)
 from homeassistant.exceptions import (
     HomeAssistantError, InvalidEntityFormatError)
 from homeassistant.helpers.entity import split_entity_id, valid_entity_id
+from homeassistant.helpers.json import JSONEncoder
 
 DOMAIN = "homeassistant"
 
@@ -46,6 +51,11 @@ SERVICE_CALL_LIMIT = 10  # seconds
 # will be added for each component that polls devices.
 MIN_WORKER_THREAD = 2
 
+# Maximum number of worker threads the pool will grow to when jobs have to
+# wait longer than WORKER_SCALE_LATENCY seconds before they are picked up.
+MAX_WORKER_THREAD = 50
+WORKER_SCALE_LATENCY = 1  # seconds
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -54,8 +64,10 @@ class HomeAssistant(object):
 
     def __init__(self):
         """Initialize new Home Assistant object."""
-        self.pool = pool = create_worker_pool()
+        self.profiler = JobProfiler()
+        self.pool = pool = create_worker_pool(profiler=self.profiler)
         self.bus = EventBus(pool)
+        self.scheduler = Scheduler(self.bus, pool)
         self.services = ServiceRegistry(self.bus, pool)
         self.states = StateMachine(self.bus)
         self.config = Config()
@@ -109,6 +121,22 @@ class HomeAssistant(object):
         self.pool.stop()
 
 
+def callback(func):
+    """Annotate a listener as a callback that can run inside EventBus.fire.
+
+    A callback is called synchronously by the thread that fires the event,
+    which saves a hop through the worker pool. It should only do trivial
+    work, like putting the event in a queue, and may never block.
+    """
+    setattr(func, '_hass_callback', True)
+    return func
+
+
+def is_callback(func):
+    """Return if the listener is a callback."""
+    return getattr(func, '_hass_callback', False) is True
+
+
 class JobPriority(util.OrderedEnum):
     """Provides job priorities for event bus jobs."""
 
@@ -123,7 +151,7 @@ class JobPriority(util.OrderedEnum):
         """Return a priority based on event type."""
         if event_type == EVENT_TIME_CHANGED:
             return JobPriority.EVENT_TIME
-        elif event_type == EVENT_STATE_CHANGED:
+        elif event_type in (EVENT_STATE_CHANGED, EVENT_STATE_CHANGED_BATCH):
             return JobPriority.EVENT_STATE
         elif event_type == EVENT_CALL_SERVICE:
             return JobPriority.EVENT_SERVICE
@@ -146,9 +174,14 @@ class EventOrigin(enum.Enum):
 
 class Event(object):
     # pylint: disable=too-few-public-methods
-    """Represents an event within the Bus."""
+    """Represents an event within the Bus.
+
+    The JSON representation is only created once, so the data of an event
+    should not be changed after it has been fired.
+    """
 
-    __slots__ = ['event_type', 'data', 'origin', 'time_fired']
+    __slots__ = ['event_type', 'data', 'origin', 'time_fired', '_json',
+                 '_data_json']
 
     def __init__(self, event_type, data=None, origin=EventOrigin.local,
                  time_fired=None):
@@ -157,6 +190,8 @@ class Event(object):
         self.data = data or {}
         self.origin = origin
         self.time_fired = time_fired or dt_util.utcnow()
+        self._json = None
+        self._data_json = None
 
     def as_dict(self):
         """Create a dict representation of this Event."""
@@ -167,6 +202,24 @@ class Event(object):
             'time_fired': self.time_fired,
         }
 
+    def as_json(self):
+        """Return the JSON representation of this Event."""
+        if self._json is None:
+            self._json = '{{{}: {}, {}: {}, {}: {}, {}: {}}}'.format(
+                '"event_type"', json.dumps(self.event_type),
+                '"data"', self.data_as_json(),
+                '"origin"', json.dumps(str(self.origin)),
+                '"time_fired"', json.dumps(self.time_fired.isoformat()))
+
+        return self._json
+
+    def data_as_json(self):
+        """Return the JSON representation of the data of this Event."""
+        if self._data_json is None:
+            self._data_json = _encode_data(self.data)
+
+        return self._data_json
+
     def __repr__(self):
         """Return the representation."""
         # pylint: disable=maybe-no-member
@@ -193,6 +246,11 @@ class EventBus(object):
     def __init__(self, pool=None):
         """Initialize a new event bus."""
         self._listeners = {}
+        # Listeners that are only interested in events for specific entities
+        # event_type -> entity_id -> list of listeners
+        self._entity_listeners = {}
+        # event_type -> list of (listener, entity_ids) tuples
+        self._entity_filters = {}
         self._lock = threading.Lock()
         self._pool = pool or create_worker_pool()
 
@@ -200,21 +258,35 @@ class EventBus(object):
     def listeners(self):
         """Dict with events and the number of listeners."""
         with self._lock:
-            return {key: len(self._listeners[key])
-                    for key in self._listeners}
+            listeners = {key: len(self._listeners[key])
+                         for key in self._listeners}
+
+            for key, filters in self._entity_filters.items():
+                listeners[key] = listeners.get(key, 0) + len(filters)
+
+            return listeners
 
     def fire(self, event_type, event_data=None, origin=EventOrigin.local):
         """Fire an event."""
         if not self._pool.running:
             raise HomeAssistantError('Home Assistant has shut down.')
 
-        with self._lock:
+        # A full queue is waited for after the lock is released
+        with util.defer_pool_waits(), self._lock:
             # Copy the list of the current listeners because some listeners
             # remove themselves as a listener while being executed which
             # causes the iterator to be confused.
             get = self._listeners.get
             listeners = get(MATCH_ALL, []) + get(event_type, [])
 
+            by_entity = self._entity_listeners.get(event_type)
+
+            if by_entity and event_data:
+                entity_id = event_data.get(ATTR_ENTITY_ID)
+
+                if isinstance(entity_id, str) and entity_id in by_entity:
+                    listeners = listeners + by_entity[entity_id]
+
             event = Event(event_type, event_data, origin)
 
             if event_type != EVENT_TIME_CHANGED:
@@ -224,22 +296,57 @@ class EventBus(object):
                 return
 
             job_priority = JobPriority.from_event_type(event_type)
+            callbacks = []
 
             for func in listeners:
-                self._pool.add_job(job_priority, (func, event))
+                if is_callback(func):
+                    callbacks.append(func)
+                else:
+                    self._pool.add_job(job_priority, (func, event))
+
+        # Callbacks run outside the lock so they are allowed to use the bus.
+        for func in callbacks:
+            try:
+                func(event)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Bus:Exception in callback %s", func)
 
-    def listen(self, event_type, listener):
+    def listen(self, event_type, listener, entity_ids=None):
         """Listen for all events or events of a specific type.
 
         To listen to all events specify the constant ``MATCH_ALL``
         as event_type.
+
+        Listeners decorated with ``callback`` are called from within fire
+        instead of being scheduled on the worker pool.
+
+        Pass in a list of entity_ids to only be called for events that have
+        one of these entity ids as ``entity_id`` in their event data. These
+        listeners are indexed so firing an event for another entity will not
+        schedule a job for them.
         """
         with self._lock:
-            if event_type in self._listeners:
+            if entity_ids is not None:
+                self._listen_entities(event_type, listener, entity_ids)
+            elif event_type in self._listeners:
                 self._listeners[event_type].append(listener)
             else:
                 self._listeners[event_type] = [listener]
 
+    def _listen_entities(self, event_type, listener, entity_ids):
+        """Add listener to the entity index. Lock has to be held."""
+        entity_ids = tuple(set(entity_ids))
+        by_entity = self._entity_listeners.setdefault(event_type, {})
+
+        self._entity_filters.setdefault(event_type, []).append(
+            (listener, entity_ids))
+
+        for entity_id in entity_ids:
+            if entity_id in by_entity:
+                by_entity[entity_id].append(listener)
+            else:
+                by_entity[entity_id] = [listener]
+
     def listen_once(self, event_type, listener):
         """Listen once for event of a specific type.
 
@@ -271,6 +378,9 @@ class EventBus(object):
     def remove_listener(self, event_type, listener):
         """Remove a listener of a specific event_type."""
         with self._lock:
+            if self._remove_entity_listener(event_type, listener):
+                return
+
             try:
                 self._listeners[event_type].remove(listener)
 
@@ -283,6 +393,137 @@ class EventBus(object):
                 # ValueError if listener did not exist within event_type
                 pass
 
+    def _remove_entity_listener(self, event_type, listener):
+        """Remove listener from the entity index. Lock has to be held.
+
+        Returns boolean to indicate if the listener was found.
+        """
+        filters = self._entity_filters.get(event_type, [])
+        match = next((item for item in filters if item[0] == listener), None)
+
+        if match is None:
+            return False
+
+        filters.remove(match)
+        by_entity = self._entity_listeners[event_type]
+
+        for entity_id in match[1]:
+            by_entity[entity_id].remove(listener)
+
+            if not by_entity[entity_id]:
+                by_entity.pop(entity_id)
+
+        if not filters:
+            self._entity_filters.pop(event_type)
+            self._entity_listeners.pop(event_type)
+
+        return True
+
+
+class ScheduledAction(object):
+    """Represents a one-shot action that is scheduled in the Scheduler."""
+
+    # pylint: disable=too-few-public-methods
+    __slots__ = ['point_in_time', 'action', 'cancelled']
+
+    def __init__(self, point_in_time, action):
+        """Initialize a scheduled action."""
+        self.point_in_time = point_in_time
+        self.action = action
+        self.cancelled = False
+
+    def __repr__(self):
+        """Return the representation."""
+        return "<ScheduledAction {} @ {}>".format(
+            getattr(self.action, '__name__', self.action),
+            self.point_in_time.isoformat())
+
+
+class Scheduler(object):
+    """Keeps track of one-shot actions that should run at a point in time.
+
+    Pending actions are kept in a heap keyed on their UTC deadline. A single
+    EVENT_TIME_CHANGED listener pops the actions that are due and adds them
+    to the pool, so pending actions cost nothing until they are due.
+    """
+
+    def __init__(self, bus, pool=None):
+        """Initialize the scheduler."""
+        self._heap = []
+        self._counter = itertools.count()
+        self._cancelled = 0
+        self._lock = threading.Lock()
+        self._pool = pool or create_worker_pool()
+        bus.listen(EVENT_TIME_CHANGED, self._time_changed_listener)
+
+    @property
+    def pending(self):
+        """Number of actions that are waiting to be run."""
+        with self._lock:
+            return len(self._heap) - self._cancelled
+
+    def schedule(self, point_in_time, action):
+        """Call action with the current time once point_in_time passed.
+
+        Returns a ScheduledAction that can be passed to cancel.
+        """
+        point_in_time = dt_util.as_utc(point_in_time)
+        scheduled = ScheduledAction(point_in_time, action)
+
+        with self._lock:
+            heapq.heappush(
+                self._heap, (point_in_time, next(self._counter), scheduled))
+
+        return scheduled
+
+    def cancel(self, scheduled):
+        """Cancel a scheduled action.
+
+        Cancelled actions are skipped when they are due, the heap is only
+        rebuilt when the majority of its entries have been cancelled.
+        """
+        with self._lock:
+            if scheduled.cancelled:
+                return
+
+            scheduled.cancelled = True
+            self._cancelled += 1
+
+            if self._cancelled > len(self._heap) // 2:
+                self._heap = [item for item in self._heap
+                              if not item[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def _time_changed_listener(self, event):
+        """Add the actions that are due to the pool."""
+        now = event.data[ATTR_NOW]
+        due = []
+
+        with self._lock:
+            # cancel can replace the heap, so only use it under the lock
+            heap = self._heap
+
+            while heap and heap[0][0] <= now:
+                scheduled = heapq.heappop(heap)[2]
+
+                if scheduled.cancelled:
+                    self._cancelled -= 1
+                    continue
+
+                # Mark it cancelled so a late cancel call is a no-op.
+                scheduled.cancelled = True
+                due.append(scheduled.action)
+
+        for action in due:
+            # Scheduled jobs run once, they are never dropped or coalesced
+            self._pool.add_job(JobPriority.EVENT_TIME, (action, now),
+                               limited=False)
+
+
+# Shared by all states without attributes
+_EMPTY_ATTRIBUTES = MappingProxyType({})
+
 
 class State(object):
     """Object to represent a state within the state machine.
@@ -292,10 +533,13 @@ class State(object):
     attributes: extra information on entity and state
     last_changed: last time the state was changed, not the attributes.
     last_updated: last time this object was updated.
+
+    Attributes passed in as a MappingProxyType are used as is, which allows
+    consecutive states of an entity to share the same attributes.
     """
 
     __slots__ = ['entity_id', 'state', 'attributes',
-                 'last_changed', 'last_updated']
+                 'last_changed', 'last_updated', '_json']
 
     # pylint: disable=too-many-arguments
     def __init__(self, entity_id, state, attributes=None, last_changed=None,
@@ -306,12 +550,19 @@ class State(object):
                 "Invalid entity id encountered: {}. "
                 "Format should be <domain>.<object_id>").format(entity_id))
 
-        self.entity_id = entity_id.lower()
+        self.entity_id = sys.intern(entity_id.lower())
         self.state = str(state)
-        self.attributes = MappingProxyType(attributes or {})
+
+        if isinstance(attributes, MappingProxyType):
+            self.attributes = attributes
+        elif attributes:
+            self.attributes = MappingProxyType(attributes)
+        else:
+            self.attributes = _EMPTY_ATTRIBUTES
         self.last_updated = last_updated or dt_util.utcnow()
 
         self.last_changed = last_changed or self.last_updated
+        self._json = None
 
     @property
     def domain(self):
@@ -342,6 +593,13 @@ class State(object):
                 'last_changed': self.last_changed,
                 'last_updated': self.last_updated}
 
+    def as_json(self):
+        """Return the JSON representation of the State."""
+        if self._json is None:
+            self._json = json.dumps(self.as_dict(), cls=JSONEncoder)
+
+        return self._json
+
     @classmethod
     def from_dict(cls, json_dict):
         """Initialize a state from a dict.
@@ -382,30 +640,66 @@ class State(object):
             dt_util.as_local(self.last_changed).isoformat())
 
 
+def _encode_data(data):
+    """Encode event data as JSON, reusing the JSON of the states in it."""
+    parts = []
+
+    for key, value in data.items():
+        if not isinstance(key, str):
+            return json.dumps(data, cls=JSONEncoder)
+
+        if isinstance(value, State):
+            value = value.as_json()
+        else:
+            value = json.dumps(value, cls=JSONEncoder)
+
+        parts.append('{}: {}'.format(json.dumps(key), value))
+
+    return '{{{}}}'.format(', '.join(parts))
+
+
 class StateMachine(object):
-    """Helper class that tracks the state of different entities."""
+    """Helper class that tracks the state of different entities.
+
+    Writers hold the lock, readers never do. Entities are also indexed per
+    domain. The domain indexes are copied on write when an entity is added
+    or removed, so readers can safely iterate the dict they got.
+    """
 
     def __init__(self, bus):
         """Initialize state machine."""
         self._states = {}
+        self._domains = {}
+        self._version = 0
+        self._snapshot = (None, ())
         self._bus = bus
         self._lock = threading.Lock()
 
     def entity_ids(self, domain_filter=None):
         """List of entity ids that are being tracked."""
         if domain_filter is None:
-            return list(self._states.keys())
+            return list(self._states)
 
-        domain_filter = domain_filter.lower()
+        return list(self._domains.get(domain_filter.lower(), ()))
 
-        with self._lock:
-            return [state.entity_id for state in self._states.values()
-                    if state.domain == domain_filter]
-
-    def all(self):
+    def all(self, domain_filter=None):
         """Create a list of all states."""
-        with self._lock:
-            return list(self._states.values())
+        if domain_filter is not None:
+            return list(
+                self._domains.get(domain_filter.lower(), {}).values())
+
+        version, states = self._snapshot
+
+        if version != self._version:
+            # Writers bump the version after changing the states. Reading
+            # the version before the copy means a write that races with
+            # the copy leaves an outdated version, so the next call
+            # rebuilds the snapshot.
+            version = self._version
+            states = tuple(self._states.values())
+            self._snapshot = version, states
+
+        return list(states)
 
     def get(self, entity_id):
         """Retrieve state of entity_id or None if not found."""
@@ -413,17 +707,16 @@ class StateMachine(object):
 
     def is_state(self, entity_id, state):
         """Test if entity exists and is specified state."""
-        entity_id = entity_id.lower()
+        cur_state = self._states.get(entity_id.lower())
 
-        return (entity_id in self._states and
-                self._states[entity_id].state == state)
+        return cur_state is not None and cur_state.state == state
 
     def is_state_attr(self, entity_id, name, value):
         """Test if entity exists and has a state attribute set to value."""
-        entity_id = entity_id.lower()
+        cur_state = self._states.get(entity_id.lower())
 
-        return (entity_id in self._states and
-                self._states[entity_id].attributes.get(name, None) == value)
+        return (cur_state is not None and
+                cur_state.attributes.get(name, None) == value)
 
     def remove(self, entity_id):
         """Remove the state of an entity.
@@ -432,8 +725,8 @@ class StateMachine(object):
         """
         entity_id = entity_id.lower()
 
-        with self._lock:
-            old_state = self._states.pop(entity_id, None)
+        with util.defer_pool_waits(), self._lock:
+            old_state = self._remove_state(entity_id)
 
             if old_state is None:
                 return False
@@ -456,33 +749,119 @@ class StateMachine(object):
         If you just update the attributes and not the state, last changed will
         not be affected.
         """
+        with util.defer_pool_waits(), self._lock:
+            event_data = self._apply(entity_id, new_state, attributes)
+
+            if event_data is not None:
+                self._bus.fire(EVENT_STATE_CHANGED, event_data)
+
+    def set_many(self, states):
+        """Set the states of multiple entities at once.
+
+        States is an iterable of (entity_id, new_state) or
+        (entity_id, new_state, attributes) tuples. The batch is applied
+        while holding the lock once and a state changed event is fired for
+        every entity that changed.
+
+        If there are listeners for EVENT_STATE_CHANGED_BATCH, they receive
+        one event with all the state changed event data under 'changes'.
+        """
+        changes = []
+
+        with util.defer_pool_waits(), self._lock:
+            for item in states:
+                event_data = self._apply(*item)
+
+                if event_data is not None:
+                    self._bus.fire(EVENT_STATE_CHANGED, event_data)
+                    changes.append(event_data)
+
+            if changes and \
+               EVENT_STATE_CHANGED_BATCH in self._bus.listeners:
+                self._bus.fire(EVENT_STATE_CHANGED_BATCH,
+                               {'changes': changes})
+
+    def _apply(self, entity_id, new_state, attributes=None):
+        """Store a new state if it changed. Lock has to be held.
+
+        Returns the state changed event data or None if nothing changed.
+        """
         entity_id = entity_id.lower()
         new_state = str(new_state)
         attributes = attributes or {}
 
-        with self._lock:
-            old_state = self._states.get(entity_id)
+        old_state = self._states.get(entity_id)
 
-            is_existing = old_state is not None
-            same_state = is_existing and old_state.state == new_state
-            same_attr = is_existing and old_state.attributes == attributes
+        is_existing = old_state is not None
+        same_state = is_existing and old_state.state == new_state
+        same_attr = is_existing and old_state.attributes == attributes
 
-            if same_state and same_attr:
-                return
+        if same_state and same_attr:
+            return None
 
-            # If state did not exist or is different, set it
-            last_changed = old_state.last_changed if same_state else None
+        # If state did not exist or is different, set it
+        last_changed = old_state.last_changed if same_state else None
 
-            state = State(entity_id, new_state, attributes, last_changed)
-            self._states[entity_id] = state
+        # Share what did not change with the previous state
+        if same_state:
+            new_state = old_state.state
+        elif same_attr:
+            attributes = old_state.attributes
 
-            event_data = {
-                'entity_id': entity_id,
-                'old_state': old_state,
-                'new_state': state,
-            }
+        state = State(entity_id, new_state, attributes, last_changed)
+        self._set_state(state, is_existing)
 
-            self._bus.fire(EVENT_STATE_CHANGED, event_data)
+        return {
+            'entity_id': entity_id,
+            'old_state': old_state,
+            'new_state': state,
+        }
+
+    def _set_state(self, state, is_existing):
+        """Store a state and update the indexes. Lock has to be held."""
+        self._states[state.entity_id] = state
+
+        if is_existing:
+            # Replacing a value does not affect readers iterating the dict
+            self._domains[state.domain][state.entity_id] = state
+        else:
+            domain_states = dict(self._domains.get(state.domain, {}))
+            domain_states[state.entity_id] = state
+            self._domains[state.domain] = domain_states
+
+        self._version += 1
+
+    def _remove_state(self, entity_id):
+        """Remove a state and update the indexes. Lock has to be held.
+
+        Returns the removed state or None if the entity was unknown.
+        """
+        old_state = self._states.pop(entity_id, None)
+
+        if old_state is None:
+            return None
+
+        domain_states = dict(self._domains[old_state.domain])
+        del domain_states[entity_id]
+
+        if domain_states:
+            self._domains[old_state.domain] = domain_states
+        else:
+            del self._domains[old_state.domain]
+
+        self._version += 1
+
+        return old_state
+
+    def _replace_states(self, states):
+        """Replace all states and rebuild the indexes. Lock has to be held."""
+        self._states = {state.entity_id: state for state in states}
+        self._domains = {}
+
+        for state in self._states.values():
+            self._domains.setdefault(state.domain, {})[state.entity_id] = state
+
+        self._version += 1
 
 
 # pylint: disable=too-few-public-methods
@@ -664,6 +1043,97 @@ class ServiceRegistry(object):
         return "{}-{}".format(id(self), self._cur_id)
 
 
+class JobProfiler(object):
+    """Aggregate the wall time spent in the jobs run by the worker pool.
+
+    Time is accounted per callable and per service. Profiling is disabled
+    until enabled is set to True.
+    """
+
+    def __init__(self):
+        """Initialize the profiler."""
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._callables = {}
+        self._services = {}
+
+    def run(self, func, arg):
+        """Run a job and record how long it took."""
+        start = time.monotonic()
+
+        try:
+            func(arg)
+        finally:
+            self.record(func, arg, time.monotonic() - start)
+
+    def record(self, func, arg, duration):
+        """Record the duration of a job."""
+        service = None
+
+        if isinstance(arg, tuple) and len(arg) == 2 and \
+           isinstance(arg[1], ServiceCall):
+            # Service jobs are executed by the ServiceRegistry, account
+            # them to the service function instead.
+            func = arg[0].func
+            service = "{}.{}".format(arg[1].domain, arg[1].service)
+
+        name = "{}.{}".format(
+            getattr(func, '__module__', None),
+            getattr(func, '__qualname__', func.__class__.__name__))
+
+        with self._lock:
+            self._add(self._callables, name, duration)
+
+            if service is not None:
+                self._add(self._services, service, duration)
+
+    @staticmethod
+    def _add(stats, key, duration):
+        """Add a duration to the stats of key. Lock has to be held."""
+        if key in stats:
+            entry = stats[key]
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+        else:
+            stats[key] = [1, duration, duration]
+
+    def reset(self):
+        """Forget all recorded jobs."""
+        with self._lock:
+            self._callables.clear()
+            self._services.clear()
+
+    def top(self, count=None):
+        """Return the callables that took the most time in total."""
+        with self._lock:
+            return self._top(self._callables, count)
+
+    def as_dict(self, count=None):
+        """Return a dict representation of the slowest jobs."""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'callables': self._top(self._callables, count),
+                'services': self._top(self._services, count),
+            }
+
+    @staticmethod
+    def _top(stats, count):
+        """Return list of stats sorted on total time. Lock has to be held."""
+        result = [{
+            'name': key,
+            'count': entry[0],
+            'total': entry[1],
+            'mean': entry[1] / entry[0],
+            'max': entry[2],
+        } for key, entry in stats.items()]
+
+        result.sort(key=lambda item: item['total'], reverse=True)
+
+        return result[:count] if count is not None else result
+
+
 class Config(object):
     """Configuration settings for Home Assistant."""
 
@@ -789,16 +1259,28 @@ def create_timer(hass, interval=TIMER_INTERVAL):
     hass.bus.listen_once(EVENT_HOMEASSISTANT_START, start_timer)
 
 
-def create_worker_pool(worker_count=None):
-    """Create a worker pool."""
+def create_worker_pool(worker_count=None, max_worker_count=None,
+                       profiler=None):
+    """Create a worker pool.
+
+    Pass in a JobProfiler to account the time spent in jobs when it is
+    enabled.
+    """
     if worker_count is None:
         worker_count = MIN_WORKER_THREAD
 
+    if max_worker_count is None:
+        max_worker_count = MAX_WORKER_THREAD
+
     def job_handler(job):
         """Called whenever a job is available to do."""
         try:
             func, arg = job
-            func(arg)
+
+            if profiler is not None and profiler.enabled:
+                profiler.run(func, arg)
+            else:
+                func(arg)
         except Exception:  # pylint: disable=broad-except
             # Catch any exception our service/event_listener might throw
             # We do not want to crash our ThreadPool
@@ -814,4 +1296,12 @@ def create_worker_pool(worker_count=None):
             _LOGGER.warning("WorkerPool:Current job from %s: %s",
                             dt_util.as_local(start).isoformat(), job)
 
-    return util.ThreadPool(job_handler, worker_count, busy_callback)
+    def overflow_callback(priority, action, count):
+        """Callback to be called when jobs are dropped or coalesced."""
+        _LOGGER.warning(
+            "WorkerPool:Queue for %s is full, %s %d jobs so far",
+            priority.name, action, count)
+
+    return util.ThreadPool(job_handler, worker_count, busy_callback,
+                           max_worker_count, WORKER_SCALE_LATENCY,
+                           overflow_callback=overflow_callback)
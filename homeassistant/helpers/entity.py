@@ -144,6 +144,13 @@ class Entity(object):
         if force_refresh:
             self.update()
 
+        return self.hass.states.set(*self.get_ha_state())
+
+    def get_ha_state(self):
+        """Return entity id, state and attributes to store for this entity.
+
+        The result can be passed to hass.states.set or hass.states.set_many.
+        """
         state = STATE_UNKNOWN if self.state is None else str(self.state)
         attr = self.state_attributes or {}
 
@@ -181,7 +188,7 @@ class Entity(object):
                     state, attr[ATTR_UNIT_OF_MEASUREMENT])
             state = str(state)
 
-        return self.hass.states.set(self.entity_id, state, attr)
+        return self.entity_id, state, attr
 
     def _attr_setter(self, name, typ, attr, attrs):
         """Helper method to populate attributes based on properties."""
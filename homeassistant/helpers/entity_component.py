@@ -176,5 +176,15 @@ class EntityPlatform(object):
             entities = list(entity for entity in self.platform_entities
                             if entity.should_poll)
 
+        updates = []
+
         for entity in entities:
-            entity.update_ha_state(True)
+            try:
+                entity.update()
+                updates.append(entity.get_ha_state())
+            except Exception:  # pylint: disable=broad-except
+                self.component.logger.exception(
+                    'Error updating %s', entity.entity_id)
+
+        # Store all the states at once instead of one by one
+        self.component.hass.states.set_many(updates)
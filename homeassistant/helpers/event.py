@@ -31,10 +31,6 @@ def track_state_change(hass, entity_ids, action, from_state=None,
     @ft.wraps(action)
     def state_change_listener(event):
         """The listener that listens for specific state changes."""
-        if entity_ids != MATCH_ALL and \
-           event.data['entity_id'] not in entity_ids:
-            return
-
         if event.data['old_state'] is None:
             old_state = None
         else:
@@ -50,13 +46,20 @@ def track_state_change(hass, entity_ids, action, from_state=None,
                    event.data['old_state'],
                    event.data['new_state'])
 
-    hass.bus.listen(EVENT_STATE_CHANGED, state_change_listener)
+    # The bus indexes listeners on entity id, so we are only called for
+    # state changes of the entities that we track.
+    hass.bus.listen(EVENT_STATE_CHANGED, state_change_listener,
+                    None if entity_ids == MATCH_ALL else entity_ids)
 
     return state_change_listener
 
 
 def track_point_in_time(hass, action, point_in_time):
-    """Add a listener that fires once after a spefic point in time."""
+    """Add a listener that fires once after a spefic point in time.
+
+    Returns the scheduled action. Pass it into hass.scheduler.cancel to
+    cancel it.
+    """
     utc_point_in_time = dt_util.as_utc(point_in_time)
 
     @ft.wraps(action)
@@ -68,32 +71,15 @@ def track_point_in_time(hass, action, point_in_time):
 
 
 def track_point_in_utc_time(hass, action, point_in_time):
-    """Add a listener that fires once after a specific point in UTC time."""
+    """Add a listener that fires once after a specific point in UTC time.
+
+    Returns the scheduled action. Pass it into hass.scheduler.cancel to
+    cancel it.
+    """
     # Ensure point_in_time is UTC
     point_in_time = dt_util.as_utc(point_in_time)
 
-    @ft.wraps(action)
-    def point_in_time_listener(event):
-        """Listen for matching time_changed events."""
-        now = event.data[ATTR_NOW]
-
-        if now >= point_in_time and \
-           not hasattr(point_in_time_listener, 'run'):
-
-            # Set variable so that we will never run twice.
-            # Because the event bus might have to wait till a thread comes
-            # available to execute this listener it might occur that the
-            # listener gets lined up twice to be executed. This will make
-            # sure the second time it does nothing.
-            point_in_time_listener.run = True
-
-            hass.bus.remove_listener(EVENT_TIME_CHANGED,
-                                     point_in_time_listener)
-
-            action(now)
-
-    hass.bus.listen(EVENT_TIME_CHANGED, point_in_time_listener)
-    return point_in_time_listener
+    return hass.scheduler.schedule(point_in_time, action)
 
 
 def track_sunrise(hass, action, offset=None):
@@ -0,0 +1,30 @@
+"""Helpers to encode Home Assistant objects as JSON."""
+import json
+from datetime import datetime
+
+
+class JSONEncoder(json.JSONEncoder):
+    """JSONEncoder that supports Home Assistant objects."""
+
+    # pylint: disable=too-few-public-methods,method-hidden
+    def default(self, obj):
+        """Convert Home Assistant objects.
+
+        Hand other objects to the original method.
+        """
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        elif hasattr(obj, 'as_dict'):
+            return obj.as_dict()
+
+        try:
+            return json.JSONEncoder.default(self, obj)
+        except TypeError:
+            # If the JSON serializer couldn't serialize it
+            # it might be a generator, convert it to a list
+            try:
+                return [self.default(child_obj)
+                        for child_obj in obj]
+            except TypeError:
+                # Ok, we're lost, cause the original error
+                return json.JSONEncoder.default(self, obj)
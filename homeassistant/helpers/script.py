@@ -4,7 +4,7 @@ import threading
 from itertools import islice
 
 import homeassistant.util.dt as date_util
-from homeassistant.const import EVENT_TIME_CHANGED, CONF_CONDITION
+from homeassistant.const import CONF_CONDITION
 from homeassistant.helpers.event import track_point_in_utc_time
 from homeassistant.helpers import service, condition
 import homeassistant.helpers.config_validation as cv
@@ -125,8 +125,7 @@ class Script():
     def _remove_listener(self):
         """Remove point in time listener, if any."""
         if self._delay_listener:
-            self.hass.bus.remove_listener(EVENT_TIME_CHANGED,
-                                          self._delay_listener)
+            self.hass.scheduler.cancel(self._delay_listener)
             self._delay_listener = None
 
     def _log(self, msg):
@@ -98,10 +98,8 @@ class DomainStates(object):
 
     def __iter__(self):
         """Return the iteration over all the states."""
-        return iter(sorted(
-            (state for state in self._hass.states.all()
-             if state.domain == self._domain),
-            key=lambda state: state.entity_id))
+        return iter(sorted(self._hass.states.all(self._domain),
+                           key=lambda state: state.entity_id))
 
 
 class LocationMethods(object):
@@ -7,7 +7,6 @@ HomeAssistantError will be raised.
 For more details about the Python API, please refer to the documentation at
 https://home-assistant.io/developers/python_api/
 """
-from datetime import datetime
 import enum
 import json
 import logging
@@ -23,6 +22,7 @@ from homeassistant.const import (
     URL_API_EVENTS, URL_API_EVENTS_EVENT, URL_API_SERVICES,
     URL_API_SERVICES_SERVICE, URL_API_STATES, URL_API_STATES_ENTITY)
 from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.json import JSONEncoder
 
 METHOD_GET = "get"
 METHOD_POST = "post"
@@ -72,8 +72,11 @@ class API(object):
         return self.status == APIStatus.OK
 
     def __call__(self, method, path, data=None):
-        """Make a call to the Home Assistant API."""
-        if data is not None:
+        """Make a call to the Home Assistant API.
+
+        Data is encoded as JSON unless it already is a JSON string.
+        """
+        if data is not None and not isinstance(data, str):
             data = json.dumps(data, cls=JSONEncoder)
 
         url = urllib.parse.urljoin(self.base_url, path)
@@ -114,9 +117,11 @@ class HomeAssistant(ha.HomeAssistant):
 
         self.remote_api = remote_api
 
-        self.pool = pool = ha.create_worker_pool()
+        self.profiler = ha.JobProfiler()
+        self.pool = pool = ha.create_worker_pool(profiler=self.profiler)
 
         self.bus = EventBus(remote_api, pool)
+        self.scheduler = ha.Scheduler(self.bus, pool)
         self.services = ha.ServiceRegistry(self.bus, pool)
         self.states = StateMachine(self.bus, self.remote_api)
         self.config = ha.Config()
@@ -230,8 +235,14 @@ class EventForwarder(object):
                (self.restrict_origin and event.origin != self.restrict_origin):
                 return
 
+            if not self._targets:
+                return
+
+            # Encoded once, no matter how many targets there are
+            data = event.data_as_json()
+
             for api in self._targets.values():
-                fire_event(api, event.event_type, event.data)
+                fire_event(api, event.event_type, data)
 
 
 class StateMachine(ha.StateMachine):
@@ -258,42 +269,19 @@ class StateMachine(ha.StateMachine):
 
     def mirror(self):
         """Discard current data and mirrors the remote state machine."""
-        self._states = {state.entity_id: state for state
-                        in get_states(self._api)}
+        states = get_states(self._api)
+
+        with self._lock:
+            self._replace_states(states)
 
     def _state_changed_listener(self, event):
         """Listen for state changed events and applies them."""
-        if event.data['new_state'] is None:
-            self._states.pop(event.data['entity_id'], None)
-        else:
-            self._states[event.data['entity_id']] = event.data['new_state']
-
-
-class JSONEncoder(json.JSONEncoder):
-    """JSONEncoder that supports Home Assistant objects."""
-
-    # pylint: disable=too-few-public-methods,method-hidden
-    def default(self, obj):
-        """Convert Home Assistant objects.
-
-        Hand other objects to the original method.
-        """
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        elif hasattr(obj, 'as_dict'):
-            return obj.as_dict()
-
-        try:
-            return json.JSONEncoder.default(self, obj)
-        except TypeError:
-            # If the JSON serializer couldn't serialize it
-            # it might be a generator, convert it to a list
-            try:
-                return [self.default(child_obj)
-                        for child_obj in obj]
-            except TypeError:
-                # Ok, we're lost, cause the original error
-                return json.JSONEncoder.default(self, obj)
+        with self._lock:
+            if event.data['new_state'] is None:
+                self._remove_state(event.data['entity_id'])
+            else:
+                self._set_state(event.data['new_state'],
+                                event.data['entity_id'] in self._states)
 
 
 def validate_api(api):
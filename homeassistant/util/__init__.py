@@ -1,7 +1,10 @@
 """Helper methods for various modules."""
+import bisect
 import collections
-from itertools import chain
+from contextlib import contextmanager
+from itertools import chain, count
 import threading
+import time
 import queue
 from datetime import datetime
 import re
@@ -297,11 +300,88 @@ class Throttle(object):
         return wrapper
 
 
+class Histogram(object):
+    """Keep track of the distribution of durations in seconds."""
+
+    # Upper bounds of the buckets in seconds
+    BUCKETS = (0.001, 0.01, 0.1, 0.5, 1, 5, 10, 60)
+
+    def __init__(self):
+        """Initialize the histogram."""
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = [0] * (len(self.BUCKETS) + 1)
+
+    def add(self, value):
+        """Add a value to the histogram."""
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+        self.buckets[bisect.bisect_left(self.BUCKETS, value)] += 1
+
+    def as_dict(self):
+        """Return a dict representation of the histogram."""
+        labels = ['le_{}'.format(bound) for bound in self.BUCKETS]
+        labels.append('inf')
+
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'max': self.maximum,
+            'buckets': dict(zip(labels, self.buckets)),
+        }
+
+
+# Overflow policies for priorities with a limited number of pending jobs
+# Replace the pending job of the same handler, else drop the oldest job
+OVERFLOW_COALESCE = 'coalesce'
+# Drop the oldest pending job
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+# Queue the job, then wait till there is room again. Drop the oldest jobs
+# after block_timeout seconds. Workers of the pool never wait.
+OVERFLOW_BLOCK = 'block'
+
+OVERFLOW_POLICIES = (OVERFLOW_COALESCE, OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK)
+
+# Per thread: the pool the thread works for and the postponed waits
+_THREAD_STATE = threading.local()
+
+
+@contextmanager
+def defer_pool_waits():
+    """Postpone waiting for room in full pool queues till the block ends.
+
+    Code that adds jobs while holding a lock uses this so other threads
+    that need the lock are not stalled by a full queue.
+    """
+    depth = getattr(_THREAD_STATE, 'defer_depth', 0)
+
+    if depth == 0:
+        _THREAD_STATE.deferred = []
+
+    _THREAD_STATE.defer_depth = depth + 1
+
+    try:
+        yield
+    finally:
+        _THREAD_STATE.defer_depth = depth
+
+        if depth == 0:
+            deferred = _THREAD_STATE.deferred
+            _THREAD_STATE.deferred = []
+
+            for pool, priority in deferred:
+                pool.wait_for_room(priority)
+
+
 class ThreadPool(object):
     """A priority queue-based thread pool."""
 
-    # pylint: disable=too-many-instance-attributes
-    def __init__(self, job_handler, worker_count=0, busy_callback=None):
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, job_handler, worker_count=0, busy_callback=None,
+                 max_worker_count=None, scale_latency=1, idle_timeout=60,
+                 overflow_callback=None):
         """Initialize the pool.
 
         job_handler: method to be called from worker thread to handle job
@@ -309,36 +389,113 @@ class ThreadPool(object):
         busy_callback: method to be called when queue gets too big.
                        Parameters: worker_count, list of current_jobs,
                                    pending_jobs_count
+        max_worker_count: maximum number of threads the pool may grow to
+                          when jobs wait longer than scale_latency seconds
+                          in the queue. None disables autoscaling.
+        idle_timeout: seconds after which an idle thread that was added by
+                      autoscaling is stopped again
+        overflow_callback: method to be called when jobs are dropped or
+                           coalesced because a priority is at its limit.
+                           Called for the 1st, 2nd, 4th, 8th, .. time.
+                           Parameters: priority, action, count
         """
         self._job_handler = job_handler
         self._busy_callback = busy_callback
+        self._overflow_callback = overflow_callback
 
         self.worker_count = 0
         self.busy_warning_limit = 0
+        self.max_worker_count = max_worker_count
+        self.scale_latency = scale_latency
+        self.idle_timeout = idle_timeout
+        self._min_worker_count = 0
+        self._last_scaled = 0
         self._work_queue = queue.PriorityQueue()
         self.current_jobs = []
         self._lock = threading.RLock()
         self._quit_task = object()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self.block_timeout = 10
+        # priority -> (max_size, policy)
+        self._limits = {}
+        # priority -> deque of the pending items of a limited priority
+        self._pending = {}
+        # (priority, handler) -> pending item that can be coalesced
+        self._coalesce = {}
+        self._dropped = {}
+        self._coalesced = {}
+        self._room = threading.Condition(self._lock)
 
         self.running = True
 
         for _ in range(worker_count):
             self.add_worker()
 
-    def add_worker(self):
-        """Add worker to the thread pool and reset warning limit."""
+    @property
+    def stats(self):
+        """Return a dict with statistics of the pool.
+
+        Queue wait and run time histograms are kept per job priority.
+        """
+        with self._stats_lock:
+            jobs = {
+                getattr(priority, 'name', str(priority)): {
+                    'queue_wait': wait.as_dict(),
+                    'run_time': run.as_dict(),
+                } for priority, (wait, run) in self._stats.items()}
+
         with self._lock:
-            if not self.running:
-                raise RuntimeError("ThreadPool not running")
+            queues = {}
+
+            for priority in set(chain(self._limits, self._dropped,
+                                      self._coalesced)):
+                max_size, policy = self._limits.get(priority, (None, None))
+                queues[getattr(priority, 'name', str(priority))] = {
+                    'max_size': max_size,
+                    'overflow': policy,
+                    'pending': len(self._pending.get(priority, ())),
+                    'dropped': self._dropped.get(priority, 0),
+                    'coalesced': self._coalesced.get(priority, 0),
+                }
+
+        return {
+            'worker_count': self.worker_count,
+            'min_worker_count': self._min_worker_count,
+            'max_worker_count': self.max_worker_count,
+            'pending_jobs': self._work_queue.qsize(),
+            'jobs': jobs,
+            'queues': queues,
+        }
+
+    def set_limit(self, priority, max_size, policy=OVERFLOW_DROP_OLDEST):
+        """Limit the number of pending jobs of a priority.
+
+        Pass None as max_size to remove the limit. When the limit is reached
+        the policy decides what happens to new jobs, see OVERFLOW_POLICIES.
+        Jobs are coalesced if they are tuples with the same first item,
+        the function that handles them.
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy {}".format(policy))
+        elif max_size is not None and max_size < 1:
+            raise ValueError("The limit should be at least 1")
 
-            worker = threading.Thread(
-                target=self._worker,
-                name='ThreadPool Worker {}'.format(self.worker_count))
-            worker.daemon = True
-            worker.start()
+        with self._lock:
+            if max_size is None:
+                self._limits.pop(priority, None)
+                for item in self._pending.pop(priority, ()):
+                    item.limited = False
+                self._room.notify_all()
+            else:
+                self._limits[priority] = (max_size, policy)
+                self._pending.setdefault(priority, collections.deque())
 
-            self.worker_count += 1
-            self.busy_warning_limit = self.worker_count * 3
+    def add_worker(self):
+        """Add worker to the thread pool and reset warning limit."""
+        with self._lock:
+            self._start_worker()
+            self._min_worker_count += 1
 
     def remove_worker(self):
         """Remove worker from the thread pool and reset warning limit."""
@@ -349,15 +506,51 @@ class ThreadPool(object):
             self._work_queue.put(PriorityQueueItem(0, self._quit_task))
 
             self.worker_count -= 1
+            self._min_worker_count = max(0, self._min_worker_count - 1)
             self.busy_warning_limit = self.worker_count * 3
 
-    def add_job(self, priority, job):
-        """Add a job to the queue."""
+    def _start_worker(self, scaled=False):
+        """Start a worker thread. Lock has to be held."""
+        if not self.running:
+            raise RuntimeError("ThreadPool not running")
+
+        worker = threading.Thread(
+            target=self._worker, args=(scaled,),
+            name='ThreadPool Worker {}'.format(self.worker_count))
+        worker.daemon = True
+        worker.start()
+
+        self.worker_count += 1
+        self.busy_warning_limit = self.worker_count * 3
+
+    def add_job(self, priority, job, limited=True):
+        """Add a job to the queue.
+
+        Jobs added with limited set to False do not count towards the limit
+        of their priority and are never dropped or coalesced.
+        """
+        must_wait = False
+
         with self._lock:
             if not self.running:
                 raise RuntimeError("ThreadPool not running")
 
-            self._work_queue.put(PriorityQueueItem(priority, job))
+            item = PriorityQueueItem(priority, job)
+
+            if limited and priority in self._limits:
+                if not self._make_room(item):
+                    return
+
+                max_size, policy = self._limits[priority]
+                item.limited = True
+                self._pending[priority].append(item)
+
+                if policy == OVERFLOW_COALESCE:
+                    self._coalesce[(priority, _job_handler(job))] = item
+
+                must_wait = len(self._pending[priority]) > max_size
+
+            self._work_queue.put(item)
 
             # Check if our queue is getting too big.
             if self._work_queue.qsize() > self.busy_warning_limit \
@@ -370,6 +563,114 @@ class ThreadPool(object):
                     self.worker_count, self.current_jobs,
                     self._work_queue.qsize())
 
+        if not must_wait:
+            return
+
+        if getattr(_THREAD_STATE, 'defer_depth', 0):
+            _THREAD_STATE.deferred.append((self, priority))
+        else:
+            self.wait_for_room(priority)
+
+    def wait_for_room(self, priority):
+        """Wait till a priority with the block policy is within its limit.
+
+        The oldest pending jobs are dropped when this takes longer than
+        block_timeout. Workers of this pool return right away, they would
+        be waiting for themselves.
+        """
+        if getattr(_THREAD_STATE, 'pool', None) is self:
+            return
+
+        with self._lock:
+            deadline = time.monotonic() + self.block_timeout
+
+            while self._is_full(priority):
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                self._room.wait(remaining)
+
+            while self._is_full(priority):
+                self._drop_oldest(priority)
+
+    def _is_full(self, priority):
+        """Return if a running priority is over its limit. Lock is held."""
+        return self.running and priority in self._limits and \
+            len(self._pending[priority]) > self._limits[priority][0]
+
+    def _make_room(self, item):
+        """Apply the overflow policy if a priority is full. Lock is held.
+
+        Returns False if the job was merged with a pending job. Jobs with
+        the block policy are always added, add_job waits for room after.
+        """
+        priority = item.priority
+        max_size, policy = self._limits[priority]
+        pending = self._pending[priority]
+
+        if len(pending) < max_size or policy == OVERFLOW_BLOCK:
+            return True
+
+        if policy == OVERFLOW_COALESCE:
+            key = (priority, _job_handler(item.item))
+            pending_item = self._coalesce.get(key)
+
+            if pending_item is not None:
+                # The pending job has not started yet, it gets the newest
+                # job instead so it keeps its place in the queue.
+                pending_item.item = item.item
+                self._count_overflow(self._coalesced, priority, 'coalesced')
+                return False
+
+        self._drop_oldest(priority)
+        return True
+
+    def _drop_oldest(self, priority):
+        """Drop the oldest pending job of a priority. Lock has to be held."""
+        dropped = self._pending[priority].popleft()
+        dropped.cancelled = True
+        self._forget(dropped)
+        self._count_overflow(self._dropped, priority, 'dropped')
+
+    def _count_overflow(self, counters, priority, action):
+        """Count a dropped or coalesced job. Lock has to be held."""
+        counters[priority] = counters.get(priority, 0) + 1
+        total = counters[priority]
+
+        # Report when the count reaches a power of two to not flood logs
+        if self._overflow_callback is not None and total & (total - 1) == 0:
+            self._overflow_callback(priority, action, total)
+
+    def _forget(self, item):
+        """Remove item from the coalesce index. Lock has to be held."""
+        key = (item.priority, _job_handler(item.item))
+
+        if self._coalesce.get(key) is item:
+            del self._coalesce[key]
+
+    def _take(self, item):
+        """Mark a limited item as started.
+
+        Returns False if the item was dropped.
+        """
+        with self._lock:
+            if item.cancelled:
+                return False
+
+            pending = self._pending.get(item.priority)
+
+            # Items leave the queue in the order they were added
+            if pending and pending[0] is item:
+                pending.popleft()
+            elif pending and item in pending:
+                pending.remove(item)
+
+            self._forget(item)
+            self._room.notify_all()
+            return True
+
     def block_till_done(self):
         """Block till current work is done."""
         self._work_queue.join()
@@ -389,20 +690,79 @@ class ThreadPool(object):
                 self.remove_worker()
 
             self.running = False
+            self._room.notify_all()
 
             # Wait till all workers have quit
             self.block_till_done()
 
-    def _worker(self):
+    def _scale_up(self, queue_wait):
+        """Add a worker if jobs wait too long in the queue."""
+        if self.max_worker_count is None or \
+           queue_wait < self.scale_latency or \
+           self.worker_count >= self.max_worker_count:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+
+            # Give the last added worker some time to drain the queue
+            if not self.running or \
+               self.worker_count >= self.max_worker_count or \
+               now - self._last_scaled < self.scale_latency:
+                return
+
+            self._last_scaled = now
+            self._start_worker(scaled=True)
+
+    def _scale_down(self):
+        """Return if an idle scaled worker is allowed to stop."""
+        with self._lock:
+            if not self.running or \
+               self.worker_count <= self._min_worker_count:
+                return False
+
+            self.worker_count -= 1
+            self.busy_warning_limit = self.worker_count * 3
+            return True
+
+    def _record(self, priority, queue_wait, run_time):
+        """Record the queue wait and run time of a job."""
+        with self._stats_lock:
+            if priority not in self._stats:
+                self._stats[priority] = (Histogram(), Histogram())
+
+            wait, run = self._stats[priority]
+            wait.add(queue_wait)
+            run.add(run_time)
+
+    def _worker(self, scaled=False):
         """Handle jobs for the thread pool."""
+        timeout = self.idle_timeout if scaled else None
+        _THREAD_STATE.pool = self
+
         while True:
             # Get new item from work_queue
-            job = self._work_queue.get().item
+            try:
+                item = self._work_queue.get(timeout=timeout)
+            except queue.Empty:
+                if self._scale_down():
+                    return
+                continue
+
+            if item.limited and not self._take(item):
+                self._work_queue.task_done()
+                continue
+
+            job = item.item
 
             if job == self._quit_task:
                 self._work_queue.task_done()
                 return
 
+            start = time.monotonic()
+            queue_wait = start - item.queued
+            self._scale_up(queue_wait)
+
             # Add to current running jobs
             job_log = (utcnow(), job)
             self.current_jobs.append(job_log)
@@ -413,19 +773,49 @@ class ThreadPool(object):
             # Remove from current running job
             self.current_jobs.remove(job_log)
 
+            self._record(item.priority, queue_wait, time.monotonic() - start)
+
             # Tell work_queue the task is done
             self._work_queue.task_done()
 
 
+def _job_handler(job):
+    """Return an id of what handles a job, used to coalesce jobs.
+
+    Handlers are not always hashable and bound methods are created on
+    every attribute access, so they are identified by their object and
+    name. The pending job keeps the handler alive, so the id is not reused
+    while it is in the coalesce index.
+    """
+    handler = job[0] if isinstance(job, tuple) else job
+    bound_to = getattr(handler, '__self__', None)
+
+    if bound_to is None:
+        return id(handler)
+
+    return id(bound_to), getattr(handler, '__name__', None)
+
+
 class PriorityQueueItem(object):
-    """Holds a priority and a value. Used within PriorityQueue."""
+    """Holds a priority and a value. Used within PriorityQueue.
+
+    Items with the same priority keep the order in which they were added.
+    """
+
+    _counter = count()
 
     # pylint: disable=too-few-public-methods
     def __init__(self, priority, item):
         """Initialize the queue."""
         self.priority = priority
         self.item = item
+        self.queued = time.monotonic()
+        self.sequence = next(self._counter)
+        self.limited = False
+        self.cancelled = False
 
     def __lt__(self, other):
         """Return the ordering."""
+        if self.priority == other.priority:
+            return self.sequence < other.sequence
         return self.priority < other.priority
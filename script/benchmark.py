@@ -0,0 +1,1011 @@
+#!/usr/bin/env python3
+"""
+Run performance benchmarks against the Home Assistant core.
+
+Usage: script/benchmark.py [<benchmark> ...]
+
+Without arguments the available benchmarks are listed.
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from datetime import timedelta
+from http.client import HTTPConnection
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# pylint: disable=wrong-import-position
+import homeassistant.core as ha  # noqa
+import homeassistant.util as util  # noqa
+import homeassistant.util.dt as dt_util  # noqa
+from homeassistant.components import (  # noqa
+    api, history, http, logbook, recorder)
+from homeassistant.const import (  # noqa
+    ATTR_NOW, EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP,
+    EVENT_STATE_CHANGED, EVENT_TIME_CHANGED, MATCH_ALL)
+from homeassistant.helpers.json import JSONEncoder  # noqa
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register a benchmark."""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+class CountingPool(util.ThreadPool):
+    """ThreadPool that keeps track of the number of jobs it has run."""
+
+    def __init__(self, worker_count=1):
+        """Initialize the pool."""
+        self.jobs_done = 0
+        self._count_lock = threading.Lock()
+        super().__init__(self._count_job, worker_count)
+
+    def _count_job(self, job):
+        """Run job and count it."""
+        with self._count_lock:
+            self.jobs_done += 1
+
+        func, arg = job
+        func(arg)
+
+
+def print_row(*columns):
+    """Print a row of right aligned columns."""
+    print(''.join('{:>14}'.format(column) for column in columns))
+
+
+@benchmark
+def pending_timers():
+    """Pool load of pending one-shot timers for 60 time changed events."""
+    now = dt_util.utcnow()
+    future = now + timedelta(days=1)
+
+    def legacy_listener(event):
+        """Listener as registered by the old track_point_in_utc_time."""
+        return event.data[ATTR_NOW] >= future
+
+    print_row('timers', 'mode', 'jobs', 'seconds')
+
+    for count in (0, 100, 500, 1000, 5000):
+        for mode in ('listeners', 'scheduler'):
+            pool = CountingPool()
+            bus = ha.EventBus(pool)
+
+            if mode == 'scheduler':
+                scheduler = ha.Scheduler(bus, pool)
+
+                for _ in range(count):
+                    scheduler.schedule(future, lambda now: None)
+            else:
+                # Each listener is a separate function object, just like
+                # the wrappers the old implementation created.
+                for _ in range(count):
+                    bus.listen(EVENT_TIME_CHANGED,
+                               lambda event: legacy_listener(event))
+
+            def tick():
+                """Fire a minute worth of time changed events."""
+                for sec in range(60):
+                    bus.fire(EVENT_TIME_CHANGED,
+                             {ATTR_NOW: now + timedelta(seconds=sec)})
+                pool.block_till_done()
+
+            duration = timeit.timeit(tick, number=1)
+            print_row(count, mode, pool.jobs_done, '{:.3f}'.format(duration))
+            pool.stop()
+
+
+@benchmark
+def state_changed_dispatch():
+    """Jobs per state change with 1000 entities and 500 listeners."""
+    entity_ids = ['sensor.bench_{}'.format(idx) for idx in range(1000)]
+
+    print_row('mode', 'changes', 'jobs', 'jobs/change', 'seconds')
+
+    for mode in ('filtered', 'indexed'):
+        pool = CountingPool()
+        bus = ha.EventBus(pool)
+        states = ha.StateMachine(bus)
+
+        for idx in range(500):
+            tracked = (entity_ids[idx],)
+
+            def listener(event, tracked=tracked):
+                """Filter on entity id like track_state_change does."""
+                if event.data['entity_id'] not in tracked:
+                    return
+
+            if mode == 'indexed':
+                bus.listen(EVENT_STATE_CHANGED, listener, tracked)
+            else:
+                bus.listen(EVENT_STATE_CHANGED, listener)
+
+        def change_states():
+            """Change the state of every entity."""
+            for value in range(2):
+                for entity_id in entity_ids:
+                    states.set(entity_id, value)
+            pool.block_till_done()
+
+        duration = timeit.timeit(change_states, number=1)
+        changes = 2 * len(entity_ids)
+        print_row(mode, changes, pool.jobs_done,
+                  '{:.2f}'.format(pool.jobs_done / changes),
+                  '{:.3f}'.format(duration))
+        pool.stop()
+
+
+@benchmark
+def bus_callbacks():
+    """Event throughput for pool listeners versus callback listeners."""
+    events = 20000
+
+    print_row('mode', 'listeners', 'events', 'jobs', 'events/s')
+
+    for mode in ('pool', 'callback'):
+        for listener_count in (1, 5):
+            pool = CountingPool()
+            bus = ha.EventBus(pool)
+            sinks = [queue.Queue() for _ in range(listener_count)]
+
+            for sink in sinks:
+                def listener(event, sink=sink):
+                    """Put the event in a queue, like the recorder does."""
+                    sink.put(event)
+
+                if mode == 'callback':
+                    listener = ha.callback(listener)
+
+                bus.listen(MATCH_ALL, listener)
+
+            def fire_events():
+                """Fire events and wait till they are all handled."""
+                for _ in range(events):
+                    bus.fire('bench_event')
+                pool.block_till_done()
+
+            duration = timeit.timeit(fire_events, number=1)
+            print_row(mode, listener_count, events, pool.jobs_done,
+                      '{:.0f}'.format(events / duration))
+            pool.stop()
+
+
+@benchmark
+def state_memory():
+    """Memory held by 5000 entities with 10 states each in a queue."""
+    entity_ids = ['sensor.bench_{}'.format(idx) for idx in range(5000)]
+    rounds = 10
+
+    def attributes(entity_id):
+        """Return attributes like a typical sensor has."""
+        return {
+            'friendly_name': entity_id.split('.')[1].replace('_', ' '),
+            'unit_of_measurement': 'W',
+            'icon': 'mdi:flash',
+        }
+
+    print_row('mode', 'states', 'MiB', 'bytes/state')
+
+    for mode in ('fresh', 'shared'):
+        pool = CountingPool(0)
+        states = ha.StateMachine(ha.EventBus(pool))
+        # Keep all states alive, like a recorder with a backlog does.
+        held = []
+
+        tracemalloc.start()
+
+        for value in range(rounds):
+            for entity_id in entity_ids:
+                if mode == 'shared':
+                    states.set(entity_id, value, attributes(entity_id))
+                    held.append(states.get(entity_id))
+                else:
+                    # What the state machine used to do: a new State with
+                    # its own attributes and entity id for every change.
+                    held.append(ha.State(
+                        entity_id, value, attributes(entity_id)))
+
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print_row(mode, len(held), '{:.1f}'.format(used / 1024 / 1024),
+                  '{:.0f}'.format(used / len(held)))
+        pool.stop()
+
+
+@benchmark
+def state_reads():
+    """Domain lookups and all() with 10000 entities and active writers."""
+    domains = ['sensor', 'light', 'switch', 'binary_sensor', 'zone']
+    entity_ids = ['{}.bench_{}'.format(domains[idx % len(domains)], idx)
+                  for idx in range(10000)]
+    reads = 200
+
+    pool = CountingPool(0)
+    states = ha.StateMachine(ha.EventBus(pool))
+
+    for entity_id in entity_ids:
+        states.set(entity_id, 0)
+
+    stop = threading.Event()
+
+    def writer():
+        """Keep changing states until told to stop."""
+        value = 0
+        while not stop.is_set():
+            value += 1
+            for entity_id in entity_ids[:100]:
+                states.set(entity_id, value)
+
+    writers = [threading.Thread(target=writer) for _ in range(2)]
+
+    for thread in writers:
+        thread.start()
+
+    print_row('lookup', 'reads', 'ms/read')
+
+    try:
+        for name, func in (
+                ('entity_ids(d)', lambda: states.entity_ids('zone')),
+                ('all(d)', lambda: states.all('zone')),
+                ('all()', states.all)):
+            duration = timeit.timeit(func, number=reads)
+            print_row(name, reads, '{:.3f}'.format(duration / reads * 1000))
+    finally:
+        stop.set()
+
+        for thread in writers:
+            thread.join()
+
+        pool.stop()
+
+
+@benchmark
+def event_encoding():
+    """JSON encoding for 10 stream clients and the recorder per event."""
+    clients = 10
+    events = []
+
+    for idx in range(2000):
+        entity_id = 'sensor.bench_{}'.format(idx % 100)
+        attributes = {'friendly_name': 'Bench {}'.format(idx % 100),
+                      'unit_of_measurement': 'W', 'icon': 'mdi:flash'}
+        old_state = ha.State(entity_id, idx - 1, attributes)
+        new_state = ha.State(entity_id, idx, attributes)
+        events.append((entity_id, old_state, new_state))
+
+    def make_events():
+        """Create fresh events so no cached JSON is reused between runs."""
+        return [ha.Event(EVENT_STATE_CHANGED, {
+            'entity_id': entity_id,
+            'old_state': ha.State(entity_id, old.state, old.attributes,
+                                  old.last_changed, old.last_updated),
+            'new_state': ha.State(entity_id, new.state, new.attributes,
+                                  new.last_changed, new.last_updated),
+        }) for entity_id, old, new in events]
+
+    def per_sink(fired):
+        """Every sink encodes the event itself."""
+        for event in fired:
+            for _ in range(clients):
+                json.dumps(event, cls=JSONEncoder)
+            json.dumps(event.data, cls=JSONEncoder)
+
+    def memoized(fired):
+        """All sinks share the memoized JSON."""
+        for event in fired:
+            for _ in range(clients):
+                event.as_json()
+            event.data_as_json()
+
+    print_row('mode', 'events', 'events/s')
+
+    for mode, encode in (('per_sink', per_sink), ('memoized', memoized)):
+        fired = make_events()
+        duration = timeit.timeit(lambda: encode(fired), number=1)
+        print_row(mode, len(fired), '{:.0f}'.format(len(fired) / duration))
+
+
+@benchmark
+def recorder_writes():
+    """Recorder throughput for 5000 state changes written to disk."""
+    entity_ids = ['sensor.bench_{}'.format(idx) for idx in range(100)]
+
+    def make_events():
+        """Return state changed events like the state machine fires."""
+        fired = []
+        for value in range(50):
+            for entity_id in entity_ids:
+                new_state = ha.State(entity_id, str(value), {'unit': 'W'})
+                fired.append(ha.Event(EVENT_STATE_CHANGED, {
+                    'entity_id': entity_id, 'new_state': new_state}))
+        return fired
+
+    def per_event(rec, fired):
+        """Commit every event and its state on their own."""
+        now = dt_util.utcnow()
+        for event in fired:
+            event_id = rec.query(
+                "INSERT INTO events (event_type, event_data, origin, "
+                "created, time_fired, utc_offset) VALUES (?, ?, ?, ?, ?, ?)",
+                (event.event_type, event.data_as_json(), str(event.origin),
+                 now, event.time_fired, rec.utc_offset),
+                return_value=recorder.RETURN_LASTROWID)
+            state = event.data['new_state']
+            rec.query(
+                "INSERT INTO states (entity_id, domain, state, attributes, "
+                "last_changed, last_updated, created, utc_offset, event_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (state.entity_id, state.domain, state.state,
+                 json.dumps(dict(state.attributes)), state.last_changed,
+                 state.last_updated, now, rec.utc_offset, event_id))
+        rec._next_event_id += len(fired)
+
+    def batched(rec, fired):
+        """Commit the events in batches of max_batch_size."""
+        for start in range(0, len(fired), rec.max_batch_size):
+            rec._write_batch(fired[start:start + rec.max_batch_size])
+
+    print_row('mode', 'events', 'events/s')
+
+    for mode, write in (('per_event', per_event), ('batched', batched)):
+        hass = ha.HomeAssistant()
+
+        with tempfile.TemporaryDirectory() as config_dir:
+            hass.config.config_dir = config_dir
+            rec = recorder.Recorder(hass)
+            # pylint: disable=protected-access
+            rec._setup_connection()
+            fired = make_events()
+
+            duration = timeit.timeit(lambda: write(rec, fired), number=1)
+            print_row(mode, len(fired), '{:.0f}'.format(len(fired) / duration))
+            rec._close_connection()
+
+        hass.pool.stop()
+
+
+@benchmark
+def recorder_read_contention():
+    """Insert latency while 4 threads run history queries."""
+    entity_ids = ['sensor.bench_{}'.format(idx) for idx in range(100)]
+
+    def make_events(count):
+        """Return count state changed events."""
+        return [
+            ha.Event(EVENT_STATE_CHANGED, {
+                'entity_id': entity_ids[idx % 100],
+                'new_state': ha.State(entity_ids[idx % 100], str(idx))})
+            for idx in range(count)]
+
+    print_row('mode', 'batches', 'p50 ms', 'max ms', 'reads')
+
+    for mode, read_connections in (('writer_conn', 0), ('read_pool', 4)):
+        hass = ha.HomeAssistant()
+
+        with tempfile.TemporaryDirectory() as config_dir:
+            hass.config.config_dir = config_dir
+            rec = recorder.Recorder(
+                hass, read_connections=read_connections)
+            # pylint: disable=protected-access
+            rec._setup_connection()
+            rec._write_batch(make_events(20000))
+
+            done = threading.Event()
+            reads = []
+
+            def read_history():
+                """Query the states like /api/history/period does."""
+                while not done.is_set():
+                    rec.read_query(
+                        "SELECT * FROM states WHERE last_updated > ? "
+                        "ORDER BY entity_id, last_updated", (0,))
+                    reads.append(1)
+
+            readers = [threading.Thread(target=read_history)
+                       for _ in range(4)]
+            for reader in readers:
+                reader.start()
+
+            latencies = []
+            for _ in range(50):
+                batch = make_events(50)
+                latencies.append(timeit.timeit(
+                    lambda: rec._write_batch(batch), number=1))
+
+            done.set()
+            for reader in readers:
+                reader.join()
+
+            latencies.sort()
+            print_row(mode, len(latencies),
+                      '{:.1f}'.format(latencies[25] * 1000),
+                      '{:.1f}'.format(latencies[-1] * 1000), len(reads))
+            rec._close_connection()
+
+        hass.pool.stop()
+
+
+@benchmark
+def recorder_purge():
+    """Purge 2 million states and events of which 10 days are kept."""
+    rows = 2000000
+    # One state and one event every 10 seconds
+    interval = 10
+
+    print_row('rows', 'deleted', 'steps', 'seconds', 'max step ms', 'MB')
+
+    hass = ha.HomeAssistant()
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass.config.config_dir = config_dir
+        rec = recorder.Recorder(hass, purge_days=10)
+        # pylint: disable=protected-access
+        rec._setup_connection()
+        now = dt_util.utcnow().timestamp()
+
+        with rec.conn:
+            for sql_query in (
+                    "INSERT INTO states (entity_id, domain, state, "
+                    "attributes_hash, last_changed, last_updated, created) "
+                    "SELECT 'sensor.bench_' || (x % 100), 'sensor', x, "
+                    "x % 100, ? - x * ?, ? - x * ?, ? - x * ? FROM seq",
+                    "INSERT INTO events (event_type, time_fired, created) "
+                    "SELECT 'state_changed', ? - x * ?, ? - x * ? FROM seq"):
+                rec.conn.execute(
+                    "WITH RECURSIVE seq(x) AS (SELECT 0 UNION ALL "
+                    "SELECT x + 1 FROM seq WHERE x < ?) " + sql_query,
+                    [rows - 1] + [now, interval] * sql_query.count('x * ?'))
+
+        steps = []
+        purge = rec._purge(dt_util.utcnow())
+
+        while True:
+            start = timeit.default_timer()
+            try:
+                next(purge)
+            except StopIteration:
+                break
+            steps.append(timeit.default_timer() - start)
+
+        remaining = sum(
+            rec.query("SELECT count(*) FROM {}".format(table))[0][0]
+            for table in ('states', 'events'))
+        print_row(2 * rows, 2 * rows - remaining, len(steps),
+                  '{:.1f}'.format(sum(steps)),
+                  '{:.1f}'.format(max(steps) * 1000),
+                  '{:.0f}'.format(os.path.getsize(rec.db_path) / 1e6))
+        rec._close_connection()
+
+    hass.pool.stop()
+
+
+@benchmark
+def history_statistics():
+    """Chart a month of a power sensor that changes every 30 seconds."""
+    interval = 30
+    end = dt_util.utcnow()
+    start = end - timedelta(days=30)
+
+    def make_events():
+        """Return a month of state changes."""
+        fired = []
+        for idx in range(int((end - start).total_seconds() / interval)):
+            time = start + timedelta(seconds=idx * interval)
+            fired.append(ha.Event(EVENT_STATE_CHANGED, {
+                'entity_id': 'sensor.power',
+                'new_state': ha.State('sensor.power', idx % 1000, {
+                    'unit_of_measurement': 'W'}, time, time)}))
+        return fired
+
+    print_row('mode', 'rows', 'bytes', 'seconds')
+
+    hass = ha.HomeAssistant()
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass.config.config_dir = config_dir
+        # pylint: disable=protected-access
+        rec = recorder._INSTANCE = recorder.Recorder(hass)
+        rec._setup_connection()
+        rec._setup_run()
+        fired = make_events()
+
+        for idx in range(0, len(fired), rec.max_batch_size):
+            rec._write_batch(fired[idx:idx + rec.max_batch_size])
+
+        def raw():
+            """Return the states as the history API does."""
+            return history.get_significant_states(
+                start, end, 'sensor.power').values()
+
+        def hourly():
+            """Return the hourly rollups."""
+            return history.get_statistics(
+                start, end, 'sensor.power', 'hour').values()
+
+        for mode, query in (('states', raw), ('hour', hourly)):
+            timer = timeit.default_timer()
+            result = list(query())
+            encoded = json.dumps(result, cls=JSONEncoder)
+            print_row(mode, sum(len(rows) for rows in result), len(encoded),
+                      '{:.3f}'.format(timeit.default_timer() - timer))
+
+        rec._close_connection()
+        recorder._INSTANCE = None
+
+    hass.pool.stop()
+
+
+@benchmark
+def history_point_in_time():
+    """History requests against a 30 day run of 100 entities."""
+    entities = 100
+    # Every entity changes every 5 minutes
+    interval = 300 / entities
+    rows = int(30 * 86400 / interval)
+    end = dt_util.utcnow()
+    start = end - timedelta(days=30)
+
+    print_row('mode', 'request', 'requests', 'ms/request')
+
+    hass = ha.HomeAssistant()
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass.config.config_dir = config_dir
+        # pylint: disable=protected-access
+        rec = recorder._INSTANCE = recorder.Recorder(hass)
+        rec.recording_start = start - timedelta(seconds=1)
+        rec._setup_connection()
+        rec._setup_run()
+
+        with rec.conn:
+            rec.conn.execute(
+                "INSERT INTO state_attributes (hash, shared_attrs) "
+                "VALUES (0, '{}')")
+            rec.conn.execute(
+                "WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL "
+                "SELECT x + 1 FROM seq WHERE x < ?) "
+                "INSERT INTO states (state_id, entity_id, domain, state, "
+                "attributes_hash, last_changed, last_updated, created) "
+                "SELECT x, 'sensor.bench_' || (x % ?), 'sensor', x, 0, "
+                "? + x * ?, ? + x * ?, ? + x * ? FROM seq",
+                [rows, entities] + [start.timestamp(), interval] * 3)
+
+        def add_checkpoints():
+            """Add the hourly checkpoints the recorder would have made."""
+            with rec.conn:
+                for hour in range(1, 30 * 24):
+                    max_state_id = int(hour * 3600 / interval)
+                    checkpoint_id = rec.conn.execute(
+                        "INSERT INTO checkpoints (created, max_state_id) "
+                        "VALUES (?, ?)", (start + timedelta(hours=hour),
+                                          max_state_id)).lastrowid
+                    rec.conn.executemany(
+                        "INSERT INTO checkpoint_states "
+                        "(checkpoint_id, state_id) VALUES (?, ?)",
+                        ((checkpoint_id, max_state_id - idx)
+                         for idx in range(entities)))
+
+        points = [start + timedelta(days=day, minutes=30)
+                  for day in range(1, 30, 3)]
+        requests = (
+            ('get_states', lambda point: history.get_states(point)),
+            ('get_state', lambda point: history.get_state(
+                point, 'sensor.bench_42')),
+            ('period', lambda point: history.get_significant_states(
+                point, point + timedelta(hours=1), 'sensor.bench_42')),
+        )
+
+        for mode in ('run_scan', 'checkpoint'):
+            if mode == 'checkpoint':
+                add_checkpoints()
+
+            for name, request in requests:
+                duration = timeit.timeit(
+                    lambda: [request(point) for point in points], number=1)
+                print_row(mode, name, len(points),
+                          '{:.1f}'.format(duration * 1000 / len(points)))
+
+        rec._close_connection()
+        recorder._INSTANCE = None
+
+    hass.pool.stop()
+
+
+class SinkRequestHandler(http.RequestHandler):
+    """Request handler that counts the bytes of the response."""
+
+    # pylint: disable=super-init-not-called,missing-docstring
+    def __init__(self):
+        self.headers = {'Accept-Encoding': 'gzip'}
+        self.command = 'GET'
+        self.request_version = 'HTTP/1.1'
+        self.protocol_version = 'HTTP/1.1'
+        self.wfile = self
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def send_response(self, code, message=None):
+        pass
+
+    def send_header(self, keyword, value):
+        pass
+
+    def end_headers(self):
+        pass
+
+    def set_session_cookie_header(self):
+        pass
+
+    def set_cors_headers(self):
+        pass
+
+
+@benchmark
+def history_stream():
+    """Peak memory of a 7 day history response of 300 entities."""
+    entities = 300
+    # Every entity changes every 10 minutes
+    interval = 600 / entities
+    rows = int(7 * 86400 / interval)
+    end = dt_util.utcnow()
+    start = end - timedelta(days=7)
+
+    print_row('mode', 'states', 'MiB peak', 'KiB gzip', 'seconds')
+
+    hass = ha.HomeAssistant()
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass.config.config_dir = config_dir
+        # pylint: disable=protected-access
+        rec = recorder._INSTANCE = recorder.Recorder(hass)
+        rec.recording_start = start - timedelta(seconds=1)
+        rec._setup_connection()
+        rec._setup_run()
+
+        with rec.conn:
+            rec.conn.execute(
+                "INSERT INTO state_attributes (hash, shared_attrs) "
+                "VALUES (0, ?)", (json.dumps({
+                    'unit_of_measurement': 'W',
+                    'friendly_name': 'Bench power'}),))
+            rec.conn.execute(
+                "WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL "
+                "SELECT x + 1 FROM seq WHERE x < ?) "
+                "INSERT INTO states (state_id, entity_id, domain, state, "
+                "attributes_hash, last_changed, last_updated, created) "
+                "SELECT x, 'sensor.bench_' || (x % ?), 'sensor', x, 0, "
+                "? + x * ?, ? + x * ?, ? + x * ? FROM seq",
+                [rows, entities] + [start.timestamp(), interval] * 3)
+
+        def buffered(handler):
+            """Respond like the history API did before streaming."""
+            handler.write_json(
+                history.get_significant_states(start, end).values())
+
+        def streamed(handler):
+            """Respond with the streaming history API."""
+            handler.write_json_stream(
+                history.stream_significant_states(start, end))
+
+        for mode, respond in (('buffered', buffered),
+                              ('streamed', streamed)):
+            handler = SinkRequestHandler()
+
+            tracemalloc.start()
+            duration = timeit.timeit(lambda: respond(handler), number=1)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            print_row(mode, rows, '{:.1f}'.format(peak / 1024 / 1024),
+                      '{:.0f}'.format(handler.written / 1024),
+                      '{:.1f}'.format(duration))
+
+        rec._close_connection()
+        recorder._INSTANCE = None
+
+    hass.pool.stop()
+
+
+@benchmark
+def logbook_day():
+    """Logbook of a day with 50000 sensor updates of 100 entities."""
+    entities = 100
+    events = 50000
+    start = dt_util.start_of_local_day()
+    interval = 86400 / events
+
+    print_row('mode', 'entries', 'ms')
+
+    hass = ha.HomeAssistant()
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass.config.config_dir = config_dir
+        # pylint: disable=protected-access
+        rec = recorder._INSTANCE = recorder.Recorder(hass)
+        rec._setup_connection()
+        rec._setup_run()
+        rec.register_writer(logbook.LogbookWriter())
+
+        batch = []
+        for idx in range(events):
+            time_fired = start + timedelta(seconds=idx * interval)
+            state = ha.State(
+                'sensor.bench_{}'.format(idx % entities), idx,
+                {'unit_of_measurement': 'W'}, time_fired, time_fired)
+            batch.append(ha.Event(EVENT_STATE_CHANGED, {
+                'entity_id': state.entity_id, 'old_state': state,
+                'new_state': state}, time_fired=time_fired))
+
+            if len(batch) == rec.max_batch_size:
+                rec._write_batch(batch)
+                batch = []
+
+        end = start + timedelta(days=1)
+
+        def backfill():
+            """Fill the entries table again from the recorded events."""
+            with rec.conn:
+                rec.conn.execute('DROP TABLE logbook_entries')
+                logbook.LogbookWriter().setup(rec.conn.cursor())
+
+            return rec.query('SELECT count(*) FROM logbook_entries')[0][0]
+
+        for mode, request in (
+                ('entries_table', lambda: len(list(
+                    logbook.get_entries(start, end)))),
+                ('backfill', backfill)):
+            result = []
+            duration = timeit.timeit(
+                lambda: result.append(request()), number=1)
+            print_row(mode, result[0],
+                      '{:.1f}'.format(duration * 1000))
+
+        rec._close_connection()
+        recorder._INSTANCE = None
+
+    hass.pool.stop()
+
+
+@benchmark
+def http_load():
+    """HTTP server under 50 keep-alive clients and 200 open streams."""
+    clients = 50
+    requests_per_client = 100
+    streams = 200
+
+    # Threads used by the server under load and added by the open streams
+    print_row('mode', 'requests/s', 'load threads', 'stream thr.')
+
+    hass = ha.HomeAssistant()
+
+    def respond(handler, path_match, data):
+        """Respond with a small JSON document."""
+        handler.write_json({'state': 'on'})
+
+    open_streams = []
+
+    def stream(handler, path_match, data):
+        """Keep a stream open."""
+        handler.send_response(200)
+        open_streams.append(handler.start_stream())
+        open_streams[-1].write('data: ping\n\n')
+
+    for mode, server_class in (
+            ('threaded', http.HomeAssistantHTTPServer),
+            ('event_loop', http.EventLoopHTTPServer)):
+        server = server_class(('127.0.0.1', 0), http.RequestHandler, hass,
+                              None, False, None, None, [])
+        server.log_message = lambda *args: None
+        server.register_path('GET', '/bench', respond)
+        server.register_path('GET', '/bench_stream', stream)
+        port = server.socket.getsockname()[1]
+        base_threads = threading.active_count() + 1
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        peak_threads = [0]
+        done = threading.Event()
+
+        def monitor():
+            """Sample the number of running threads."""
+            while not done.wait(0.01):
+                peak_threads[0] = max(peak_threads[0],
+                                      threading.active_count())
+
+        def client():
+            """Do requests as fast as possible."""
+            conn = HTTPConnection('127.0.0.1', port)
+            for _ in range(requests_per_client):
+                conn.request('GET', '/bench')
+                conn.getresponse().read()
+            conn.close()
+
+        monitor_thread = threading.Thread(target=monitor)
+        monitor_thread.start()
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.monotonic() - start
+        done.set()
+        monitor_thread.join()
+
+        before = threading.active_count()
+        conns = []
+        for _ in range(streams):
+            conn = HTTPConnection('127.0.0.1', port)
+            conn.request('GET', '/bench_stream')
+            conn.getresponse().read(12)
+            conns.append(conn)
+        stream_threads = threading.active_count() - before
+
+        for conn in conns:
+            conn.close()
+        for open_stream in open_streams:
+            open_stream.close()
+        del open_streams[:]
+
+        print_row(mode,
+                  '{:.0f}'.format(clients * requests_per_client / duration),
+                  peak_threads[0] - base_threads - 1 - clients,
+                  stream_threads)
+
+        server.shutdown()
+
+    hass.pool.stop()
+
+
+@benchmark
+def stream_fanout():
+    """Time to forward 1000 events to 500 event stream clients."""
+    clients = 500
+    events = 1000
+
+    print_row('mode', 'events/s', 'listeners')
+
+    class Handler(object):
+        """Minimal request handler for the event stream."""
+
+        # pylint: disable=too-few-public-methods,missing-docstring
+        client_address = ('127.0.0.1', 0)
+
+        def __init__(self, hass):
+            self.server = hass.http
+
+        def send_response(self, code):
+            pass
+
+        def send_header(self, keyword, value):
+            pass
+
+        def set_session_cookie_header(self):
+            return None
+
+        def start_stream(self, **kwargs):
+            return http.HTTPStream(**kwargs)
+
+    def per_client(hass, handler, data):
+        """Listen to the bus for every client like before the hub."""
+        stream = handler.start_stream()
+
+        @ha.callback
+        def forward_events(event):
+            """Forward events to the open request."""
+            hass.http.sessions.extend_validation(None)
+            stream.write("data: {}\n\n".format(event.as_json()))
+
+        hass.bus.listen(MATCH_ALL, forward_events)
+
+    for mode in ('per_client', 'hub'):
+        hass = ha.HomeAssistant()
+        hass.http = type('Server', (), {'sessions': http.SessionStore()})
+
+        if mode == 'hub':
+            hub = api.StreamHub(hass)
+            for _ in range(clients):
+                hub.handle_get_api_stream(Handler(hass), None, {})
+        else:
+            for _ in range(clients):
+                per_client(hass, Handler(hass), {})
+
+        listeners = sum(hass.bus.listeners.values())
+
+        duration = timeit.timeit(
+            lambda: hass.bus.fire(EVENT_STATE_CHANGED, {
+                'entity_id': 'sensor.bench', 'new_state': None}),
+            number=events)
+
+        print_row(mode, '{:.0f}'.format(events / duration), listeners)
+
+        hass.pool.stop()
+
+
+@benchmark
+def websocket_commands():
+    """Time to read the states 1000 times over REST and over a WebSocket."""
+    # pylint: disable=import-error
+    from tests.common import WebSocketClient
+
+    reads = 1000
+
+    print_row('mode', 'reads/s')
+
+    hass = ha.HomeAssistant()
+    for index in range(20):
+        hass.states.set('sensor.bench_{}'.format(index), index)
+    server = http.EventLoopHTTPServer(
+        ('127.0.0.1', 0), http.RequestHandler, hass, 'bench', False, None,
+        None, [])
+    server.log_message = lambda *args: None
+    hass.http = server
+    api.setup(hass, {})
+    port = server.socket.getsockname()[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def rest():
+        """Read the states with REST requests on a kept alive connection."""
+        conn = HTTPConnection('127.0.0.1', port)
+        for _ in range(reads):
+            conn.request('GET', '/api/states',
+                         headers={'X-HA-access': 'bench'})
+            conn.getresponse().read()
+        conn.close()
+
+    def websocket():
+        """Read the states with WebSocket commands."""
+        client = WebSocketClient(port, '/api/websocket',
+                                 {'X-HA-access': 'bench'})
+        for index in range(reads):
+            client.send_json({'id': index, 'type': 'get_states'})
+            client.receive_json()
+        client.close()
+
+    for mode, run in (('rest', rest), ('websocket', websocket)):
+        duration = timeit.timeit(run, number=1)
+        print_row(mode, '{:.0f}'.format(reads / duration))
+
+    server.shutdown()
+    hass.pool.stop()
+
+
+def main():
+    """Run the requested benchmarks."""
+    parser = argparse.ArgumentParser(
+        description='Run Home Assistant performance benchmarks.')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help='Names of the benchmarks to run.')
+    args = parser.parse_args()
+
+    if not args.benchmarks:
+        for name in sorted(BENCHMARKS):
+            print('{:<30} {}'.format(name, BENCHMARKS[name].__doc__))
+        return 0
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            print('Unknown benchmark: {}'.format(name))
+            return 1
+
+        print('== {}: {}'.format(name, BENCHMARKS[name].__doc__))
+        BENCHMARKS[name]()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
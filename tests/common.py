@@ -1,5 +1,9 @@
 """Test the helper method for writing tests."""
+import base64
+import json
 import os
+import socket
+import struct
 from datetime import timedelta
 from unittest import mock
 
@@ -143,6 +147,72 @@ class MockHTTP(object):
         pass
 
 
+class WebSocketClient(object):
+    """A minimal WebSocket client to test the WebSocket API."""
+
+    def __init__(self, port, path, headers=None):
+        """Connect and do the WebSocket handshake."""
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+        self.rfile = self.sock.makefile('rb')
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        lines = ['GET {} HTTP/1.1'.format(path), 'Host: 127.0.0.1',
+                 'Upgrade: websocket', 'Connection: Upgrade',
+                 'Sec-WebSocket-Key: ' + key, 'Sec-WebSocket-Version: 13']
+        lines.extend('{}: {}'.format(*item) for item in
+                     (headers or {}).items())
+        self.sock.sendall('\r\n'.join(lines + ['', '']).encode('ascii'))
+
+        self.status = int(self.rfile.readline().split()[1])
+        self.headers = {}
+
+        for line in iter(self.rfile.readline, b'\r\n'):
+            name, value = line.decode('ascii').split(':', 1)
+            self.headers[name.strip().lower()] = value.strip()
+
+    def send_frame(self, opcode, payload, fin=True):
+        """Send a masked frame."""
+        mask = os.urandom(4)
+        length = len(payload)
+        header = struct.pack('!B', (0x80 if fin else 0) | opcode)
+
+        if length < 126:
+            header += struct.pack('!B', 0x80 | length)
+        else:
+            header += struct.pack('!BH', 0x80 | 126, length)
+
+        self.sock.sendall(header + mask + bytes(
+            byte ^ mask[index % 4] for index, byte in enumerate(payload)))
+
+    def receive_frame(self):
+        """Return the opcode and payload of the next frame."""
+        opcode, length = struct.unpack('!BB', self.rfile.read(2))
+
+        if length == 126:
+            length = struct.unpack('!H', self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self.rfile.read(8))[0]
+
+        return opcode & 0x0F, self.rfile.read(length)
+
+    def send_json(self, data):
+        """Send a JSON text message."""
+        self.send_frame(0x1, json.dumps(data).encode('UTF-8'))
+
+    def receive_json(self):
+        """Return the next text message, skipping pings."""
+        opcode, payload = self.receive_frame()
+
+        while opcode == 0x9:
+            opcode, payload = self.receive_frame()
+
+        return json.loads(payload.decode('UTF-8'))
+
+    def close(self):
+        """Close the connection."""
+        self.rfile.close()
+        self.sock.close()
+
+
 class MockModule(object):
     """Representation of a fake module."""
 
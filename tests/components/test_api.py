@@ -3,16 +3,19 @@
 from contextlib import closing
 import json
 import tempfile
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import requests
 
 from homeassistant import bootstrap, const
 import homeassistant.core as ha
+import homeassistant.components.api as api
 import homeassistant.components.http as http
 
-from tests.common import get_test_instance_port, get_test_home_assistant
+from tests.common import (
+    get_test_instance_port, get_test_home_assistant, WebSocketClient)
 
 API_PASSWORD = "test1234"
 SERVER_PORT = get_test_instance_port()
@@ -240,6 +243,15 @@ class TestAPI(unittest.TestCase):
                            headers=HA_HEADERS)
         self.assertEqual(hass.config.as_dict(), req.json())
 
+    def test_api_get_pool(self):
+        """Test the return of the worker pool statistics."""
+        req = requests.get(_url(const.URL_API_POOL),
+                           headers=HA_HEADERS)
+        data = req.json()
+
+        self.assertEqual(hass.pool.worker_count, data['worker_count'])
+        self.assertIn('queues', data)
+
     def test_api_get_components(self):
         """Test the return of the components."""
         req = requests.get(_url(const.URL_API_COMPONENTS),
@@ -259,6 +271,27 @@ class TestAPI(unittest.TestCase):
             self.assertEqual(test_content, req.text)
             self.assertIsNone(req.headers.get('expires'))
 
+    def test_api_json_stream(self):
+        """Test streaming a JSON array."""
+        def stream(handler, path_match, data):
+            """Stream nested arrays."""
+            handler.write_json_stream(
+                iter(range(value)) for value in range(4))
+
+        hass.http.register_path('GET', '/api/test_stream', stream)
+
+        for encoding in ('identity', 'gzip'):
+            req = requests.get(_url('/api/test_stream'), headers={
+                const.HTTP_HEADER_HA_AUTH: API_PASSWORD,
+                const.HTTP_HEADER_ACCEPT_ENCODING: encoding})
+
+            self.assertIsNone(req.headers.get(
+                const.HTTP_HEADER_CONTENT_LENGTH))
+            self.assertEqual([[], [0], [0, 1], [0, 1, 2]], req.json())
+
+        self.assertEqual('gzip', req.headers.get(
+            const.HTTP_HEADER_CONTENT_ENCODING))
+
     def test_api_get_event_listeners(self):
         """Test if we can get the list of events being listened for."""
         req = requests.get(_url(const.URL_API_EVENTS),
@@ -435,7 +468,8 @@ class TestAPI(unittest.TestCase):
             data = self._stream_next_event(req)
             self.assertEqual('ping', data)
 
-            self.assertEqual(listen_count + 1, self._listen_count())
+            # The stream hub listens to the bus for all clients
+            self.assertEqual(listen_count, self._listen_count())
 
             hass.bus.fire('test_event')
             hass.pool.block_till_done()
@@ -455,7 +489,7 @@ class TestAPI(unittest.TestCase):
             data = self._stream_next_event(req)
             self.assertEqual('ping', data)
 
-            self.assertEqual(listen_count + 2, self._listen_count())
+            self.assertEqual(listen_count, self._listen_count())
 
             hass.bus.fire('test_event1')
             hass.pool.block_till_done()
@@ -469,6 +503,210 @@ class TestAPI(unittest.TestCase):
             data = self._stream_next_event(req)
             self.assertEqual('test_event3', data['event_type'])
 
+    def test_stream_hub(self):
+        """Test the hub encodes an event once and drops slow clients."""
+        test_hass = get_test_home_assistant()
+        test_hass.http = MagicMock()
+        hub = api.StreamHub(test_hass)
+        streams = []
+
+        for restrict in (None, None, 'test_event1', 'test_event2'):
+            streams.append(http.HTTPStream())
+            handler = MagicMock()
+            handler.start_stream.return_value = streams[-1]
+            hub.handle_get_api_stream(
+                handler, None, {'restrict': restrict} if restrict else {})
+
+        self.assertEqual(4, hub.client_count)
+
+        with patch.object(ha.Event, 'as_json',
+                          return_value='"event"') as mock_json:
+            test_hass.bus.fire('test_event1')
+
+        self.assertEqual(1, mock_json.call_count)
+        self.assertEqual([True, True, True, False],
+                         [b'"event"' in stream._buffer for stream in streams])
+
+        # A client that does not read overflows its buffer
+        streams[0].max_buffer = len(streams[0]._buffer)
+        test_hass.bus.fire('test_event3')
+        self.assertTrue(streams[0].aborted)
+        self.assertEqual(3, hub.client_count)
+
+        test_hass.bus.fire(const.EVENT_HOMEASSISTANT_STOP)
+        for stream in streams[1:]:
+            self.assertTrue(stream.send(MagicMock(send=len)))
+        self.assertEqual(0, hub.client_count)
+
+        test_hass.stop()
+
+    def test_websocket_handshake(self):
+        """Test the WebSocket API needs auth and a valid handshake."""
+        client = WebSocketClient(SERVER_PORT, const.URL_API_WEBSOCKET)
+        self.assertEqual(401, client.status)
+        client.close()
+
+        req = requests.get(_url(const.URL_API_WEBSOCKET), headers=HA_HEADERS)
+        self.assertEqual(400, req.status_code)
+
+        client = WebSocketClient(SERVER_PORT, const.URL_API_WEBSOCKET,
+                                 HA_HEADERS)
+        self.assertEqual(101, client.status)
+        self.assertEqual('websocket', client.headers['upgrade'])
+        client.close()
+
+    def test_websocket_origin(self):
+        """Test the WebSocket API refuses pages from other origins."""
+        for origin, status in (('http://evil.example.com', 403),
+                               ('http://127.0.0.1', 101)):
+            headers = dict(HA_HEADERS)
+            headers[const.HTTP_HEADER_ORIGIN] = origin
+            client = WebSocketClient(SERVER_PORT, const.URL_API_WEBSOCKET,
+                                     headers)
+            self.assertEqual(status, client.status)
+            client.close()
+
+    def test_websocket_commands(self):
+        """Test getting states and calling a service over a WebSocket."""
+        calls = []
+        hass.services.register('test_domain', 'test_service',
+                               lambda call: calls.append(call))
+
+        client = WebSocketClient(SERVER_PORT, const.URL_API_WEBSOCKET,
+                                 HA_HEADERS)
+
+        client.send_json({'id': 1, 'type': 'get_states'})
+        msg = client.receive_json()
+        self.assertEqual(1, msg['id'])
+        self.assertTrue(msg['success'])
+        self.assertEqual(
+            [state.entity_id for state in hass.states.all()],
+            [state['entity_id'] for state in msg['result']])
+
+        client.send_json({'id': 2, 'type': 'call_service',
+                          'domain': 'test_domain', 'service': 'test_service',
+                          'service_data': {'hello': 'world'}})
+        self.assertEqual({'id': 2, 'type': 'result', 'success': True,
+                          'result': None}, client.receive_json())
+        hass.pool.block_till_done()
+        self.assertEqual(1, len(calls))
+        self.assertEqual({'hello': 'world'}, calls[0].data)
+
+        client.send_json({'id': 3, 'type': 'call_service',
+                          'domain': 'test_domain', 'service': 'unknown'})
+        msg = client.receive_json()
+        self.assertFalse(msg['success'])
+        self.assertEqual(api.ERR_NOT_FOUND, msg['error']['code'])
+
+        client.send_json({'id': 4, 'type': 'unknown'})
+        msg = client.receive_json()
+        self.assertEqual(4, msg['id'])
+        self.assertEqual(api.ERR_UNKNOWN_COMMAND, msg['error']['code'])
+
+        client.send_frame(0x1, b'not json')
+        msg = client.receive_json()
+        self.assertIsNone(msg['id'])
+        self.assertEqual(api.ERR_INVALID_FORMAT, msg['error']['code'])
+
+        # Invalid values are refused without closing the connection
+        for command, error in (
+                ({'id': [1], 'type': 'get_states'}, api.ERR_INVALID_FORMAT),
+                ({'id': 6, 'type': ['get_states']}, api.ERR_UNKNOWN_COMMAND),
+                ({'id': 7, 'type': 'subscribe_states', 'entity_id': [1]},
+                 api.ERR_INVALID_FORMAT),
+                ({'id': 8, 'type': 'unsubscribe', 'subscription': {}},
+                 api.ERR_NOT_FOUND)):
+            client.send_json(command)
+            msg = client.receive_json()
+            self.assertEqual(command['id'], msg['id'])
+            self.assertEqual(error, msg['error']['code'])
+
+        with patch('homeassistant.components.api._states_json',
+                   side_effect=ValueError):
+            client.send_json({'id': 9, 'type': 'get_states'})
+            msg = client.receive_json()
+        self.assertEqual(api.ERR_UNKNOWN_ERROR, msg['error']['code'])
+
+        # Fragmented messages and pings
+        client.send_frame(0x1, b'{"id": 5, ', fin=False)
+        client.send_frame(0x9, b'hi')
+        client.send_frame(0x0, b'"type": "get_states"}')
+        self.assertEqual((0xA, b'hi'), client.receive_frame())
+        self.assertEqual(5, client.receive_json()['id'])
+
+        client.send_frame(0x8, b'\x03\xe8')
+        self.assertEqual(0x8, client.receive_frame()[0])
+        client.close()
+
+    def test_websocket_subscriptions(self):
+        """Test event and state diff subscriptions over a WebSocket."""
+        listen_count = self._listen_count()
+        hass.states.set('light.kitchen', 'off', {'brightness': 0})
+        hass.pool.block_till_done()
+
+        client = WebSocketClient(SERVER_PORT, const.URL_API_WEBSOCKET,
+                                 HA_HEADERS)
+
+        client.send_json({'id': 1, 'type': 'subscribe_events',
+                          'event_type': 'test_event_ws'})
+        self.assertTrue(client.receive_json()['success'])
+
+        client.send_json({'id': 2, 'type': 'subscribe_states',
+                          'entity_id': ['light.kitchen']})
+        msg = client.receive_json()
+        self.assertEqual(['light.kitchen'],
+                         [state['entity_id'] for state in msg['result']])
+
+        client.send_json({'id': 2, 'type': 'subscribe_events'})
+        self.assertEqual(api.ERR_ID_REUSE,
+                         client.receive_json()['error']['code'])
+
+        # State changes of other entities do not reach the subscription
+        self.assertIn('light.kitchen',
+                      hass.bus._entity_listeners[const.EVENT_STATE_CHANGED])
+
+        hass.bus.fire('test_event_ws', {'hello': 'world'})
+        hass.bus.fire('test_event_other')
+        hass.pool.block_till_done()
+
+        msg = client.receive_json()
+        self.assertEqual(1, msg['id'])
+        self.assertEqual('event', msg['type'])
+        self.assertEqual('test_event_ws', msg['event']['event_type'])
+        self.assertEqual({'hello': 'world'}, msg['event']['data'])
+
+        hass.states.set('light.other', 'on')
+        hass.states.set('light.kitchen', 'off', {'brightness': 100})
+        hass.pool.block_till_done()
+
+        msg = client.receive_json()
+        self.assertEqual(2, msg['id'])
+        self.assertEqual('state_diff', msg['type'])
+        diff = msg['diff']
+        self.assertEqual('light.kitchen', diff['entity_id'])
+        self.assertEqual({'brightness': 100}, diff['attributes'])
+        self.assertNotIn('state', diff)
+        self.assertNotIn('last_changed', diff)
+
+        hass.states.remove('light.kitchen')
+        hass.pool.block_till_done()
+        self.assertEqual({'entity_id': 'light.kitchen', 'removed': True},
+                         client.receive_json()['diff'])
+
+        client.send_json({'id': 3, 'type': 'unsubscribe', 'subscription': 1})
+        self.assertTrue(client.receive_json()['success'])
+        client.send_json({'id': 4, 'type': 'unsubscribe', 'subscription': 1})
+        self.assertFalse(client.receive_json()['success'])
+
+        client.close()
+
+        for _ in range(50):
+            if self._listen_count() == listen_count:
+                break
+            time.sleep(0.1)
+
+        self.assertEqual(listen_count, self._listen_count())
+
     def _stream_next_event(self, stream):
         """Test the stream for next event."""
         data = b''
@@ -1,11 +1,14 @@
 """The tests the History component."""
 # pylint: disable=protected-access,too-many-public-methods
-from datetime import timedelta
+from datetime import datetime, timedelta
+import json
 import unittest
-from unittest.mock import patch, sentinel
+from unittest.mock import MagicMock, patch, sentinel
 
 import homeassistant.core as ha
 import homeassistant.util.dt as dt_util
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.remote import JSONEncoder
 from homeassistant.components import history, recorder
 
 from tests.common import (
@@ -199,3 +202,279 @@ class TestComponentHistory(unittest.TestCase):
 
         hist = history.get_significant_states(zero, four)
         assert states == hist
+
+    def test_stream_significant_states(self):
+        """Test that streamed states match get_significant_states."""
+        self.init_recorder()
+        self.hass.states.set('sensor.a', 1)
+        self.hass.states.set('sensor.c', 1)
+        self.wait_recording_done()
+        start = dt_util.utcnow()
+
+        for value in range(2, 4):
+            self.hass.states.set('sensor.b', value)
+            self.hass.states.set('sensor.c', value)
+            self.hass.states.set('sensor.d', value)
+            self.wait_recording_done()
+
+        streamed = [list(states) for states
+                    in history.stream_significant_states(start)]
+
+        self.assertEqual(['sensor.a', 'sensor.b', 'sensor.c', 'sensor.d'],
+                         [states[0].entity_id for states in streamed])
+        self.assertEqual(
+            history.get_significant_states(start),
+            {states[0].entity_id: states for states in streamed})
+
+    def test_get_statistics(self):
+        """Test the rollups of numeric states."""
+        self.init_recorder()
+        start = dt_util.as_utc(datetime(2016, 5, 1, 10, 0, 0))
+        values = {0: 10, 4: 20, 8: 30, 61: 40, 62: 'unavailable'}
+
+        for minute, value in sorted(values.items()):
+            time = start + timedelta(minutes=minute)
+            mock_state_change_event(self.hass, ha.State(
+                'sensor.power', value, {'unit_of_measurement': 'W'},
+                time, time))
+        # Not a measurement
+        mock_state_change_event(self.hass, ha.State(
+            'sensor.count', 5, {}, start, start))
+        self.wait_recording_done()
+
+        hourly = history.get_statistics(
+            start, start + timedelta(hours=2), period='hour')
+        self.assertEqual(['sensor.power'], list(hourly))
+        self.assertEqual([
+            {'entity_id': 'sensor.power', 'start': start, 'min': 10,
+             'max': 30, 'mean': 20, 'last': 30, 'count': 3},
+            {'entity_id': 'sensor.power', 'start': start + timedelta(hours=1),
+             'min': 40, 'max': 40, 'mean': 40, 'last': 40, 'count': 1},
+        ], hourly['sensor.power'])
+
+        self.assertEqual([(0, 2), (5, 1), (60, 1)], [
+            ((row['start'] - start).total_seconds() / 60, row['count'])
+            for row in history.get_statistics(
+                start + timedelta(minutes=1), start + timedelta(hours=2),
+                'sensor.power', '5minute')['sensor.power']])
+
+    def test_api_history_period_statistics(self):
+        """Test requesting rollups from the history API."""
+        self.init_recorder()
+        start = dt_util.as_utc(datetime(2016, 5, 1, 10, 0, 0))
+
+        for minute, value in ((0, 10), (30, 20), (90, 30)):
+            time = start + timedelta(minutes=minute)
+            mock_state_change_event(self.hass, ha.State(
+                'sensor.power', value, {'unit_of_measurement': 'W'},
+                time, time))
+        self.wait_recording_done()
+
+        bodies = []
+        handler = MagicMock()
+        handler.write_json.side_effect = lambda data: bodies.append(
+            json.loads(json.dumps(data, cls=JSONEncoder)))
+        path_match = MagicMock()
+        path_match.group.return_value = start.date().isoformat()
+
+        history._api_history_period(
+            handler, path_match, {'statistics': 'hour', 'days': '2',
+                                  'filter_entity_id': 'sensor.power'})
+
+        # One list of rollups per entity
+        self.assertEqual([[[
+            {'entity_id': 'sensor.power',
+             'start': (start + timedelta(hours=hours)).isoformat(),
+             'min': low, 'max': high, 'mean': mean, 'last': high,
+             'count': count}
+            for hours, low, high, mean, count in ((0, 10, 20, 15, 2),
+                                                  (1, 30, 30, 30, 1))
+        ]]], bodies)
+
+        for data in ({'statistics': 'week'}, {'days': '0'}):
+            history._api_history_period(handler, path_match, data)
+            self.assertEqual(400, handler.write_json_message.call_args[0][1])
+
+    def test_downsample(self):
+        """Test reducing the states of an entity for a graph."""
+        start = dt_util.utcnow()
+
+        def states(entity_id, values, attributes=None):
+            """Return a state per value, a second apart."""
+            return [ha.State(entity_id, value, attributes,
+                             start + timedelta(seconds=idx),
+                             start + timedelta(seconds=idx))
+                    for idx, value in enumerate(values)]
+
+        power = states('sensor.power', [10] * 50 + [90] + [10] * 49,
+                       {'unit_of_measurement': 'W'})
+        reduced = history.downsample(power, 10)
+        self.assertEqual(10, len(reduced))
+        self.assertEqual(power[0], reduced[0])
+        self.assertEqual(power[-1], reduced[-1])
+        self.assertIn(power[50], reduced)
+        self.assertEqual(power, history.downsample(power, 100))
+
+        # Runs of measurements are reduced around other states
+        mixed = history.downsample(states(
+            'sensor.power', list(range(20)) + ['unavailable'] * 5 +
+            list(range(20)), {'unit_of_measurement': 'W'}), 10)
+        self.assertEqual(
+            ['0', '19', 'unavailable', '0', '19'],
+            [state.state for state in mixed if state.state in
+             ('0', '19', 'unavailable')])
+        self.assertEqual(11, len(mixed))
+
+        self.assertEqual(
+            ['on', 'off', 'on'], [state.state for state in history.downsample(
+                states('switch.ac', ['on'] * 5 + ['off'] * 5 + ['on']), 3)])
+
+        therm = states('thermostat.test', [20] * 10)
+        self.assertEqual(therm, history.downsample(therm, 3))
+
+    def test_api_history_period_downsample(self):
+        """Test requesting downsampled history from the history API."""
+        self.init_recorder()
+        handler = MagicMock()
+        path_match = MagicMock()
+        path_match.group.return_value = None
+
+        with patch('homeassistant.components.history.downsample',
+                   side_effect=lambda states, max_points: max_points), \
+            patch('homeassistant.components.history.'
+                  'stream_significant_states', return_value=[[]]):
+            for data, max_points in (({'max_points': '100'}, 100),
+                                     ({'resolution': '3600'}, 25),
+                                     ({'max_points': '10',
+                                       'resolution': '60'}, 10)):
+                history._api_history_period(handler, path_match, data)
+                self.assertEqual(
+                    [max_points],
+                    list(handler.write_json_stream.call_args[0][0]))
+
+        for data in ({'max_points': '1'}, {'resolution': '0'},
+                     {'max_points': 'a lot'}):
+            history._api_history_period(handler, path_match, data)
+            self.assertEqual(400, handler.write_json_message.call_args[0][1])
+
+    def test_get_states_from_checkpoint(self):
+        """Test getting states at a point in time from a checkpoint."""
+        self.init_recorder()
+        now = dt_util.utcnow()
+
+        def at_second(second, func, *args):
+            """Run func with the recorder at now + second."""
+            with patch('homeassistant.components.recorder.dt_util.utcnow',
+                       return_value=now + timedelta(seconds=second)):
+                func(*args)
+                self.wait_recording_done()
+
+        def set_state(entity_id, state):
+            """Set the state of an entity."""
+            self.hass.states.set(entity_id, state)
+
+        at_second(0, set_state, 'test.a', 1)
+        at_second(0, set_state, 'test.b', 1)
+        at_second(1, recorder._INSTANCE._write_checkpoint)
+        at_second(2, set_state, 'test.a', 2)
+        at_second(3, recorder._INSTANCE._write_checkpoint)
+        at_second(4, set_state, 'test.a', 3)
+
+        self.assertEqual([(1, 2), (2, 2)], [
+            tuple(row) for row in recorder.query(
+                'SELECT checkpoint_id, count(*) FROM checkpoint_states '
+                'GROUP BY checkpoint_id')])
+
+        def states_at(second, entity_ids=None):
+            """Return the states at now + second."""
+            return sorted(
+                (state.entity_id, state.state) for state in history.get_states(
+                    now + timedelta(seconds=second), entity_ids))
+
+        self.assertEqual([('test.a', '1'), ('test.b', '1')], states_at(1.5))
+        self.assertEqual([('test.a', '2'), ('test.b', '1')], states_at(2.5))
+        self.assertEqual([('test.a', '2'), ('test.b', '1')], states_at(3.5))
+        self.assertEqual([('test.a', '3'), ('test.b', '1')], states_at(5))
+        self.assertEqual([('test.b', '1')], states_at(5, ['test.b']))
+
+    def test_recent_states_match_database(self):
+        """Test that recent history from memory matches the database."""
+        self.init_recorder()
+        mock_http_component(self.hass)
+        history.setup(self.hass, {})
+
+        points = []
+        for value in range(6):
+            points.append(dt_util.utcnow())
+            self.hass.states.set('media_player.test', value)
+            self.hass.states.set('thermostat.test', 20, {'current': value})
+            self.hass.states.set('zone.home', value)
+            self.wait_recording_done()
+        end = dt_util.utcnow()
+
+        for start in points[1:]:
+            recent = history._RECENT
+            self.assertTrue(recent.covers(start))
+            from_memory = history.get_significant_states(start, end)
+
+            history._RECENT = None
+            from_db = history.get_significant_states(start, end)
+            history._RECENT = recent
+
+            self.assertEqual(from_db, from_memory)
+
+        recent = history._RECENT
+        from_memory = recent.last_5_states('media_player.test')
+        history._RECENT = None
+        self.assertEqual(
+            history.last_5_states('media_player.test'), from_memory)
+        self.assertIsNone(recent.last_5_states('sensor.unknown'))
+
+    def test_recent_states_budget(self):
+        """Test that states over the budget are pushed out."""
+        start = dt_util.utcnow()
+
+        with patch('homeassistant.components.recorder.records_state_changes',
+                   return_value=True):
+            recent = history.RecentStates(timedelta(days=1), 3, [
+                ha.State('sensor.a', 'initial', last_updated=start)])
+
+            for second in range(1, 5):
+                time = start + timedelta(seconds=second)
+                recent.state_changed(ha.Event(EVENT_STATE_CHANGED, {
+                    'entity_id': 'sensor.a',
+                    'new_state': ha.State('sensor.a', second, {}, time, time),
+                }))
+
+        one = start + timedelta(seconds=1)
+        self.assertFalse(recent.covers(start))
+        self.assertTrue(recent.covers(one))
+        self.assertEqual(
+            ['1', '2', '3', '4'],
+            [state.state for state in
+             recent.significant_states(one)['sensor.a']])
+
+        # The state pushed out over the window is the one before it
+        time = start + timedelta(days=2)
+        with patch('homeassistant.components.recorder.records_state_changes',
+                   return_value=True):
+            recent.state_changed(ha.Event(EVENT_STATE_CHANGED, {
+                'entity_id': 'sensor.a',
+                'new_state': ha.State('sensor.a', 5, {}, time, time),
+            }))
+        self.assertEqual(start + timedelta(seconds=4), recent.since)
+        self.assertEqual(['5'], [state.state for state in
+                                 recent.significant_states(time)['sensor.a']])
+
+    def test_recent_states_excluded(self):
+        """Test that current states of excluded entities are not kept."""
+        start = dt_util.utcnow()
+
+        with patch('homeassistant.components.recorder.records_state_changes',
+                   side_effect=lambda entity_id: entity_id != 'sensor.b'):
+            recent = history.RecentStates(timedelta(days=1), 3, [
+                ha.State('sensor.a', 'on', last_updated=start),
+                ha.State('sensor.b', 'on', last_updated=start)])
+
+        self.assertEqual(['sensor.a'],
+                         list(recent.significant_states(start)))
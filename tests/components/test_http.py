@@ -0,0 +1,309 @@
+"""The tests for the event loop mode of the HTTP component."""
+# pylint: disable=protected-access,too-many-public-methods
+from contextlib import closing
+from http.client import HTTPConnection
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+import requests
+
+from homeassistant import bootstrap, const
+import homeassistant.components.http as http
+
+from tests.common import (
+    get_test_instance_port, get_test_home_assistant, WebSocketClient)
+
+API_PASSWORD = "test1234"
+SERVER_PORT = get_test_instance_port()
+HTTP_BASE_URL = "http://127.0.0.1:{}".format(SERVER_PORT)
+HA_HEADERS = {const.HTTP_HEADER_HA_AUTH: API_PASSWORD}
+
+hass = None
+
+
+def _url(path=""):
+    """Helper method to generate URLs."""
+    return HTTP_BASE_URL + path
+
+
+def setUpModule():   # pylint: disable=invalid-name
+    """Initialize a Home Assistant server in event loop mode."""
+    global hass
+
+    hass = get_test_home_assistant()
+
+    bootstrap.setup_component(
+        hass, http.DOMAIN,
+        {http.DOMAIN: {http.CONF_API_PASSWORD: API_PASSWORD,
+         http.CONF_SERVER_PORT: SERVER_PORT,
+         http.CONF_SERVER_MODE: http.SERVER_MODE_EVENT_LOOP}})
+
+    bootstrap.setup_component(hass, 'api')
+
+    hass.start()
+
+
+def tearDownModule():   # pylint: disable=invalid-name
+    """Stop the Home Assistant server."""
+    hass.stop()
+
+
+def _wait_for(condition, timeout=5):
+    """Wait till condition returns True."""
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.05)
+    return condition()
+
+
+class TestEventLoopHTTPServer(unittest.TestCase):
+    """Test the event loop HTTP server."""
+
+    def tearDown(self):
+        """Stop everything that was started."""
+        hass.pool.block_till_done()
+
+    def test_keep_alive(self):
+        """Test that requests reuse the connection."""
+        conn = HTTPConnection('127.0.0.1', SERVER_PORT)
+
+        for _ in range(3):
+            conn.request('GET', const.URL_API, headers=HA_HEADERS)
+            sock = conn.sock
+            resp = conn.getresponse()
+            self.assertEqual(200, resp.status)
+            self.assertIn(b'API running', resp.read())
+            self.assertFalse(resp.will_close)
+
+        self.assertIs(sock, conn.sock)
+        conn.close()
+
+    def test_response_without_length_closes(self):
+        """Test the connection is closed after a response without length."""
+        conn = HTTPConnection('127.0.0.1', SERVER_PORT)
+        conn.request('GET', '/not_existing', headers=HA_HEADERS)
+        resp = conn.getresponse()
+        self.assertEqual(404, resp.status)
+        resp.read()
+        self.assertTrue(resp.will_close)
+        conn.close()
+
+    def test_handler_exception(self):
+        """Test a failing request gets an error and its connection closed."""
+        def fail(handler, path_match, data):
+            """Raise like a broken request handler."""
+            raise ValueError('broken')
+
+        hass.http.register_path('GET', '/api/test_fail', fail)
+
+        conn = HTTPConnection('127.0.0.1', SERVER_PORT, timeout=5)
+        conn.request('GET', '/api/test_fail', headers=HA_HEADERS)
+        resp = conn.getresponse()
+        self.assertEqual(500, resp.status)
+        resp.read()
+        self.assertTrue(resp.will_close)
+        conn.close()
+
+        self.assertTrue(_wait_for(lambda: not any(
+            conn.handler and conn.handler.path == '/api/test_fail'
+            for conn in hass.http.connections)))
+
+    def test_api_json_stream_chunked(self):
+        """Test a JSON stream is chunked on a kept alive connection."""
+        def stream(handler, path_match, data):
+            """Stream nested arrays."""
+            handler.write_json_stream(
+                iter(range(value)) for value in range(4))
+
+        hass.http.register_path('GET', '/api/test_chunked', stream)
+
+        with requests.Session() as session:
+            for encoding in ('identity', 'gzip'):
+                req = session.get(_url('/api/test_chunked'), headers={
+                    const.HTTP_HEADER_HA_AUTH: API_PASSWORD,
+                    const.HTTP_HEADER_ACCEPT_ENCODING: encoding})
+
+                self.assertEqual('chunked', req.headers.get(
+                    const.HTTP_HEADER_TRANSFER_ENCODING))
+                self.assertEqual([[], [0], [0, 1], [0, 1, 2]], req.json())
+
+        conn = HTTPConnection('127.0.0.1', SERVER_PORT)
+        conn.request('GET', '/api/test_chunked', headers=HA_HEADERS)
+        resp = conn.getresponse()
+        resp.read()
+        self.assertFalse(resp.will_close)
+        conn.close()
+
+    def test_many_concurrent_clients(self):
+        """Test many clients doing requests over kept alive connections."""
+        results = []
+
+        def client():
+            """Do requests over a single connection."""
+            conn = HTTPConnection('127.0.0.1', SERVER_PORT, timeout=10)
+            for _ in range(20):
+                conn.request('GET', const.URL_API_STATES, headers=HA_HEADERS)
+                resp = conn.getresponse()
+                resp.read()
+                results.append((resp.status, resp.will_close))
+            conn.close()
+
+        threads = [threading.Thread(target=client) for _ in range(25)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([(200, False)] * 500, results)
+
+    def test_streams_do_not_hold_threads(self):
+        """Test many event streams are served without a thread each."""
+        hub = next(callback.__self__ for _, url, callback, _ in hass.http.paths
+                   if url == const.URL_API_STREAM)
+        listen_count = sum(hass.bus.listeners.values())
+        thread_count = threading.active_count()
+
+        streams = []
+        for _ in range(30):
+            req = requests.get(_url(const.URL_API_STREAM), stream=True,
+                               headers=HA_HEADERS)
+            streams.append(req)
+            self.assertEqual(b'data: ping\n\n', _read_message(req))
+
+        self.assertLess(threading.active_count() - thread_count, 5)
+        self.assertEqual(30, hub.client_count)
+        self.assertEqual(listen_count, sum(hass.bus.listeners.values()))
+
+        hass.bus.fire('test_event')
+        hass.pool.block_till_done()
+
+        for req in streams:
+            self.assertIn(b'test_event', _read_message(req))
+
+        for req in streams:
+            req.close()
+
+        self.assertTrue(_wait_for(lambda: hub.client_count == 0))
+
+    def test_idle_streams_pinged(self):
+        """Test the keep-alive is sent on an idle stream."""
+        with closing(requests.get(_url(const.URL_API_STREAM), stream=True,
+                                  headers=HA_HEADERS)) as req:
+            self.assertEqual(b'data: ping\n\n', _read_message(req))
+
+            conn = next(conn for conn in hass.http.connections
+                        if conn.handler and conn.handler.stream)
+            conn.handler.stream._last_write -= 60
+
+            self.assertEqual(b'data: ping\n\n', _read_message(req))
+
+    def test_websockets(self):
+        """Test WebSocket clients are served from the event loop."""
+        listen_count = sum(hass.bus.listeners.values())
+        thread_count = threading.active_count()
+        clients = []
+
+        for index in range(20):
+            client = WebSocketClient(SERVER_PORT, const.URL_API_WEBSOCKET,
+                                     HA_HEADERS)
+            client.send_json({'id': index, 'type': 'subscribe_events',
+                              'event_type': 'test_event_ws'})
+            self.assertTrue(client.receive_json()['success'])
+            clients.append(client)
+
+        self.assertLess(threading.active_count() - thread_count, 5)
+
+        hass.bus.fire('test_event_ws')
+        hass.pool.block_till_done()
+
+        for index, client in enumerate(clients):
+            msg = client.receive_json()
+            self.assertEqual(index, msg['id'])
+            self.assertEqual('test_event_ws', msg['event']['event_type'])
+
+            client.send_frame(0x1, b'{"id": 100, "type": "get_states"}')
+            self.assertEqual(100, client.receive_json()['id'])
+            client.close()
+
+        self.assertTrue(_wait_for(
+            lambda: sum(hass.bus.listeners.values()) == listen_count))
+
+
+class TestHTTPStream(unittest.TestCase):
+    """Test the HTTP stream."""
+
+    def test_slow_client_disconnected(self):
+        """Test a stream is aborted when its buffer overflows."""
+        stream = http.HTTPStream(max_buffer=10)
+        listener = MagicMock()
+        stream.add_close_listener(listener)
+
+        self.assertTrue(stream.write(b'12345678'))
+        self.assertFalse(stream.write(b'12345678'))
+        self.assertTrue(stream.closed)
+        self.assertTrue(stream.aborted)
+        self.assertEqual(1, listener.call_count)
+        self.assertFalse(stream.write(b'1'))
+
+    def test_close_sends_pending_data(self):
+        """Test a closed stream first sends the buffered data."""
+        stream = http.HTTPStream()
+        listener = MagicMock()
+        stream.add_close_listener(listener)
+        stream.write('hello')
+        stream.close()
+
+        self.assertFalse(stream.closed)
+        self.assertFalse(stream.write('world'))
+
+        sent = []
+        sock = MagicMock()
+        sock.send.side_effect = lambda data: sent.append(bytes(data)) or 5
+        self.assertTrue(stream.send(sock))
+        self.assertEqual([b'hello'], sent)
+        self.assertTrue(stream.closed)
+        self.assertFalse(stream.aborted)
+        self.assertEqual(1, listener.call_count)
+
+        # Listeners added to a closed stream are called right away
+        stream.add_close_listener(listener)
+        self.assertEqual(2, listener.call_count)
+
+
+class TestWebSocket(unittest.TestCase):
+    """Test the WebSocket protocol."""
+
+    def test_partial_frames(self):
+        """Test frames are parsed when received in pieces."""
+        websocket = http.WebSocket(http.HTTPStream())
+        messages = []
+        websocket.on_message = messages.append
+
+        data = (bytes([0x81, 0x85]) + bytes([1, 2, 3, 4]) +
+                bytes(byte ^ [1, 2, 3, 4][index % 4]
+                      for index, byte in enumerate(b'hello')))
+
+        for index in range(len(data)):
+            websocket.stream.receive(data[index:index + 1])
+
+        self.assertEqual(['hello'], messages)
+
+    def test_unmasked_frame_closes(self):
+        """Test the connection is closed on an unmasked client frame."""
+        websocket = http.WebSocket(http.HTTPStream())
+        websocket.stream.receive(bytes([0x81, 0x01]) + b'a')
+
+        self.assertEqual(
+            http.websocket_frame(http.WS_OPCODE_CLOSE, b'\x03\xea'),
+            bytes(websocket.stream._buffer))
+        self.assertFalse(websocket.send('hello'))
+
+
+def _read_message(req):
+    """Read the next server-sent event from a stream."""
+    data = b''
+    while not data.endswith(b'\n\n'):
+        data += req.raw.read(1)
+    return data
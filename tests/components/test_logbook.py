@@ -1,13 +1,14 @@
 """The tests for the logbook component."""
 # pylint: disable=protected-access,too-many-public-methods
 import unittest
-from datetime import timedelta
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
 
 import homeassistant.core as ha
 from homeassistant.const import (
     EVENT_STATE_CHANGED, EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP)
 import homeassistant.util.dt as dt_util
-from homeassistant.components import logbook
+from homeassistant.components import logbook, recorder
 
 from tests.common import mock_http_component, get_test_home_assistant
 
@@ -19,7 +20,12 @@ class TestComponentHistory(unittest.TestCase):
         """Setup things to be run when tests are started."""
         self.hass = get_test_home_assistant()
         mock_http_component(self.hass)
+        with patch('homeassistant.core.Config.path', return_value=':memory:'):
+            recorder.setup(self.hass, {})
         self.assertTrue(logbook.setup(self.hass, {}))
+        self.hass.start()
+        self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
 
     def tearDown(self):
         """Stop everything that was started."""
@@ -64,11 +70,11 @@ class TestComponentHistory(unittest.TestCase):
 
         self.assertEqual(0, len(calls))
 
-    def test_humanify_filter_sensor(self):
-        """Test humanify filter too frequent sensor values."""
+    def test_filter_sensor(self):
+        """Test too frequent sensor values are filtered."""
         entity_id = 'sensor.bla'
 
-        pointA = dt_util.utcnow().replace(minute=2)
+        pointA = dt_util.as_utc(datetime(2016, 5, 1, 10, 2, 0))
         pointB = pointA.replace(minute=5)
         pointC = pointA + timedelta(minutes=logbook.GROUP_BY_MINUTES)
 
@@ -76,7 +82,7 @@ class TestComponentHistory(unittest.TestCase):
         eventB = self.create_state_changed_event(pointB, entity_id, 20)
         eventC = self.create_state_changed_event(pointC, entity_id, 30)
 
-        entries = list(logbook.humanify((eventA, eventB, eventC)))
+        entries = self.write_entries(eventA, eventB, eventC)
 
         self.assertEqual(2, len(entries))
         self.assert_entry(
@@ -85,6 +91,134 @@ class TestComponentHistory(unittest.TestCase):
         self.assert_entry(
             entries[1], pointC, 'bla', domain='sensor', entity_id=entity_id)
 
+    def test_get_entries(self):
+        """Test getting filtered entries from the database."""
+        self.hass.states.set('light.kitchen', 'off')
+        self.hass.states.set('switch.ac', 'off')
+        self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
+        start = dt_util.utcnow()
+
+        self.hass.states.set('light.kitchen', 'on')
+        self.hass.states.set('light.kitchen', 'on', {'brightness': 100})
+        self.hass.states.set('switch.ac', 'on')
+        logbook.log_entry(self.hass, 'Alarm', 'is triggered',
+                          entity_id='switch.alarm')
+        self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
+        end = dt_util.utcnow()
+
+        def entries(**kwargs):
+            """Return name and message of the entries."""
+            return [(entry.name, entry.message) for entry
+                    in logbook.get_entries(start, end, **kwargs)]
+
+        self.assertEqual([('kitchen', 'turned on'), ('ac', 'turned on'),
+                          ('Alarm', 'is triggered')], entries())
+        self.assertEqual([('kitchen', 'turned on')],
+                         entries(entity_id='light.kitchen'))
+        self.assertEqual([('ac', 'turned on'), ('Alarm', 'is triggered')],
+                         entries(domain='switch'))
+        self.assertEqual([], entries(domain='homeassistant'))
+
+    def test_entry_with_non_string_values(self):
+        """Test that fired entries with other values are written."""
+        start = dt_util.utcnow()
+        self.hass.bus.fire(logbook.EVENT_LOGBOOK_ENTRY, {
+            logbook.ATTR_NAME: {'name': 'Alarm'},
+            logbook.ATTR_MESSAGE: 5,
+            logbook.ATTR_ENTITY_ID: 'switch.alarm'})
+        self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
+
+        self.assertEqual(
+            [{'name': "{'name': 'Alarm'}", 'message': '5',
+              'domain': 'switch', 'entity_id': 'switch.alarm'}],
+            [{key: value for key, value in entry.as_dict().items()
+              if key != 'when'} for entry in logbook.get_entries(
+                  start, dt_util.utcnow())])
+
+    def test_entries_written_incrementally(self):
+        """Test that entries are grouped as they are written."""
+        start = dt_util.as_utc(datetime(2016, 5, 1, 10, 0, 0))
+
+        def at_minute(minute, event_type, data=None):
+            """Return an event fired minute minutes after start."""
+            return ha.Event(event_type, data,
+                            time_fired=start + timedelta(minutes=minute))
+
+        writer = logbook.LogbookWriter()
+        conn = recorder._INSTANCE.conn
+
+        state_changes = [
+            self.create_state_changed_event(
+                start + timedelta(minutes=minute), 'sensor.temp', value)
+            for minute, value in ((2, 10), (5, 20), (16, 30))]
+        other_events = [
+            at_minute(60.1, EVENT_HOMEASSISTANT_STOP),
+            at_minute(60.5, EVENT_HOMEASSISTANT_START),
+            at_minute(120, EVENT_HOMEASSISTANT_START),
+            at_minute(121, logbook.EVENT_LOGBOOK_ENTRY, {
+                logbook.ATTR_NAME: 'Alarm',
+                logbook.ATTR_MESSAGE: 'is triggered'})]
+
+        for events in (state_changes, other_events):
+            with conn:
+                writer.write(conn.cursor(), events)
+
+        self.assertEqual(
+            [(5, '20'), (16, '30'), (60, 'restarted'), (120, 'started'),
+             (121, 'triggered')],
+            [((entry.when - start).total_seconds() // 60,
+              entry.message.split(' ')[-1]) for entry in logbook.get_entries(
+                  start, start + timedelta(hours=3))])
+
+    def test_entries_backfill(self):
+        """Test filling the entries table from recorded events."""
+        start = dt_util.utcnow()
+        self.hass.states.set('light.kitchen', 'off')
+        self.hass.states.set('light.kitchen', 'on')
+        logbook.log_entry(self.hass, 'Alarm', 'is triggered')
+        self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
+        end = dt_util.utcnow()
+
+        entries = [entry.as_dict() for entry
+                   in logbook.get_entries(start, end)]
+        self.assertEqual(3, len(entries))
+
+        conn = recorder._INSTANCE.conn
+        conn.execute('DROP TABLE logbook_entries')
+
+        with conn:
+            logbook.LogbookWriter().setup(conn.cursor())
+
+        self.assertEqual(entries, [entry.as_dict() for entry
+                                   in logbook.get_entries(start, end)])
+
+    def test_api_logbook_period(self):
+        """Test requesting a period of the logbook."""
+        handler = MagicMock()
+        path_match = MagicMock()
+        path_match.group.return_value = None
+
+        with patch('homeassistant.components.logbook.get_entries',
+                   return_value=[]) as get_entries:
+            logbook._handle_get_logbook(handler, path_match, {
+                'start_time': '2016-05-01T10:00:00+00:00',
+                'end_time': '2016-05-01T11:00:00+00:00',
+                'entity_id': 'switch.ac'})
+
+        start, end, entity_id, domain = get_entries.call_args[0]
+        self.assertEqual(10, start.hour)
+        self.assertEqual(timedelta(hours=1), end - start)
+        self.assertEqual('switch.ac', entity_id)
+        self.assertIsNone(domain)
+
+        logbook._handle_get_logbook(handler, path_match,
+                                    {'end_time': 'yesterday'})
+        self.assertEqual(400, handler.write_json_message.call_args[0][1])
+
     def test_entry_to_dict(self):
         """Test conversion of entry to dict."""
         entry = logbook.Entry(
@@ -101,10 +235,11 @@ class TestComponentHistory(unittest.TestCase):
 
         Events that are occuring in the same minute.
         """
-        entries = list(logbook.humanify((
-            ha.Event(EVENT_HOMEASSISTANT_STOP),
-            ha.Event(EVENT_HOMEASSISTANT_START),
-            )))
+        stopped = dt_util.as_utc(datetime(2016, 5, 1, 10, 0, 10))
+        entries = self.write_entries(
+            ha.Event(EVENT_HOMEASSISTANT_STOP, time_fired=stopped),
+            ha.Event(EVENT_HOMEASSISTANT_START,
+                     time_fired=stopped + timedelta(seconds=20)))
 
         self.assertEqual(1, len(entries))
         self.assert_entry(
@@ -117,19 +252,29 @@ class TestComponentHistory(unittest.TestCase):
         message = 'has a custom entry'
         entity_id = 'sun.sun'
 
-        entries = list(logbook.humanify((
+        entries = self.write_entries(
             ha.Event(logbook.EVENT_LOGBOOK_ENTRY, {
                 logbook.ATTR_NAME: name,
                 logbook.ATTR_MESSAGE: message,
                 logbook.ATTR_ENTITY_ID: entity_id,
-                }),
-            )))
+            }, time_fired=dt_util.as_utc(datetime(2016, 5, 1, 10, 0, 0))))
 
         self.assertEqual(1, len(entries))
         self.assert_entry(
             entries[0], name=name, message=message,
             domain='sun', entity_id=entity_id)
 
+    def write_entries(self, *events):
+        """Write the entries of events and read them back."""
+        conn = recorder._INSTANCE.conn
+
+        with conn:
+            logbook.LogbookWriter().write(conn.cursor(), events)
+
+        second = timedelta(seconds=1)
+        return list(logbook.get_entries(
+            events[0].time_fired - second, events[-1].time_fired + second))
+
     def assert_entry(self, entry, when=None, name=None, message=None,
                      domain=None, entity_id=None):
         """Assert an entry is what is expected."""
@@ -0,0 +1,65 @@
+"""The tests for the profiler component."""
+# pylint: disable=protected-access,too-many-public-methods
+import unittest
+from unittest.mock import MagicMock
+
+from homeassistant.bootstrap import _setup_component
+import homeassistant.components.profiler as profiler
+
+from tests.common import get_test_home_assistant, mock_http_component
+
+
+class TestProfiler(unittest.TestCase):
+    """Test the profiler component."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Setup things to be run when tests are started."""
+        self.hass = get_test_home_assistant()
+        mock_http_component(self.hass)
+        self.hass.http = MagicMock()
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """Stop everything that was started."""
+        self.hass.stop()
+
+    def get_handler(self, method):
+        """Return the handler registered for method on /api/profile."""
+        for call in self.hass.http.register_path.mock_calls:
+            if call[1][:2] == (method, profiler.URL_API_PROFILE):
+                return call[1][2]
+
+    def test_setup_enables_profiler(self):
+        """Test that setting up the component enables the profiler."""
+        self.assertFalse(self.hass.profiler.enabled)
+        self.assertTrue(_setup_component(self.hass, profiler.DOMAIN, {
+            profiler.DOMAIN: None}))
+        self.assertTrue(self.hass.profiler.enabled)
+
+    def test_invalid_config(self):
+        """Test setup with an invalid top count."""
+        self.assertFalse(_setup_component(self.hass, profiler.DOMAIN, {
+            profiler.DOMAIN: {profiler.CONF_TOP: 0}}))
+        self.assertFalse(self.hass.profiler.enabled)
+
+    def test_profile_services(self):
+        """Test the time spent in services is reported."""
+        _setup_component(self.hass, profiler.DOMAIN, {profiler.DOMAIN: {}})
+
+        self.hass.services.register('test_domain', 'test_service',
+                                    lambda call: None)
+        self.hass.services.call('test_domain', 'test_service', blocking=True)
+        self.hass.pool.block_till_done()
+
+        handler = MagicMock()
+        self.get_handler('GET')(handler, None, {'top': '5'})
+        profile = handler.write_json.call_args[0][0]
+
+        self.assertTrue(profile['enabled'])
+        self.assertIn('pool', profile)
+        self.assertEqual(1, len(profile['services']))
+        self.assertEqual('test_domain.test_service',
+                         profile['services'][0]['name'])
+        self.assertEqual(1, profile['services'][0]['count'])
+
+        self.get_handler('DELETE')(MagicMock(), None, {})
+        self.assertEqual([], self.hass.profiler.as_dict()['services'])
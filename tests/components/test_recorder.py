@@ -1,9 +1,19 @@
 """The tests for the Recorder component."""
 # pylint: disable=too-many-public-methods,protected-access
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import patch
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
 
-from homeassistant.const import MATCH_ALL
+import homeassistant.util.dt as dt_util
+import homeassistant.core as ha
+from homeassistant.const import (
+    EVENT_CALL_SERVICE, EVENT_STATE_CHANGED, EVENT_TIME_CHANGED, MATCH_ALL)
 from homeassistant.components import recorder
 
 from tests.common import get_test_home_assistant
@@ -41,6 +51,21 @@ class TestRecorder(unittest.TestCase):
         self.assertEqual(1, len(states))
         self.assertEqual(self.hass.states.get(entity_id), states[0])
 
+    def test_failing_writer(self):
+        """Test that a failing writer does not lose the batch."""
+        writer = MagicMock()
+        writer.write.side_effect = ValueError
+        recorder.register_writer(writer)
+
+        self.hass.states.set('test.writer', 'on')
+        self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
+
+        self.assertTrue(writer.write.called)
+        self.assertEqual(['test.writer'], [
+            state.entity_id for state in
+            recorder.query_states('SELECT * FROM states')])
+
     def test_saving_event(self):
         """Test saving and restoring an event."""
         event_type = 'EVENT_TEST'
@@ -76,3 +101,380 @@ class TestRecorder(unittest.TestCase):
         # Recorder uses SQLite and stores datetimes as integer unix timestamps
         assert event.time_fired.replace(microsecond=0) == \
             db_event.time_fired.replace(microsecond=0)
+
+    def test_saving_in_batches(self):
+        """Test that events arriving together are committed at once."""
+        recorder._INSTANCE.commit_interval = 10
+        recorder._INSTANCE.block_till_done()
+        commits = recorder.stats()['commit_latency']['count']
+        written = recorder.stats()['events_written']
+
+        for value in range(5):
+            self.hass.states.set('test.batch', value)
+
+        recorder._INSTANCE.block_till_done()
+
+        stats = recorder.stats()
+        self.assertEqual(commits + 1, stats['commit_latency']['count'])
+        self.assertEqual(written + 5, stats['events_written'])
+        self.assertEqual(0, stats['queue_depth'])
+
+        states = recorder.query_states(
+            'SELECT * FROM states WHERE entity_id = ? ORDER BY state_id',
+            ('test.batch',))
+        self.assertEqual(['0', '1', '2', '3', '4'],
+                         [state.state for state in states])
+
+        # Every state is linked to the event that carried it
+        rows = recorder.query(
+            'SELECT events.event_data FROM states JOIN events '
+            'ON states.event_id = events.event_id '
+            'WHERE states.entity_id = ?', ('test.batch',))
+        self.assertEqual(5, len(rows))
+        self.assertTrue(all('test.batch' in row[0] for row in rows))
+
+    def test_attributes_stored_once(self):
+        """Test that states with the same attributes share them."""
+        attributes = {'friendly_name': 'Power', 'unit_of_measurement': 'W'}
+
+        for value in range(3):
+            self.hass.states.set('test.power', value, attributes)
+            self.hass.states.set('test.other_power', value, attributes)
+        self.hass.states.set('test.power', 3, {'friendly_name': 'Power'})
+
+        self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
+
+        self.assertEqual(2, len(recorder.query(
+            'SELECT * FROM state_attributes')))
+        self.assertEqual([], recorder.query(
+            'SELECT * FROM states WHERE attributes IS NOT NULL'))
+
+        states = recorder.query_states(
+            recorder.QUERY_STATES + 'WHERE entity_id = ? ORDER BY state_id',
+            ('test.power',))
+        self.assertEqual(4, len(states))
+        self.assertEqual(attributes, states[0].attributes)
+        self.assertEqual({'friendly_name': 'Power'}, states[3].attributes)
+
+    def test_missing_attributes(self):
+        """Test that states whose attributes are missing are returned."""
+        self.hass.states.set('test.orphan', 'on', {'hello': 'world'})
+        self.hass.states.set('test.valid', 'on', {'hello': 'there'})
+        self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
+
+        with recorder._INSTANCE.conn:
+            recorder._INSTANCE.conn.execute(
+                "DELETE FROM state_attributes WHERE shared_attrs LIKE ?",
+                ('%world%',))
+
+        for query in (recorder.QUERY_STATES, 'SELECT * FROM states '):
+            states = recorder.query_states(query + 'ORDER BY entity_id')
+            self.assertEqual(
+                [('test.orphan', {}), ('test.valid', {'hello': 'there'})],
+                [(state.entity_id, state.attributes) for state in states])
+
+    def test_state_written_during_attributes_purge(self):
+        """Test states written between purge chunks keep attributes."""
+        rec = recorder._INSTANCE
+        attributes = {'hello': 'world'}
+        self.hass.states.set('test.purge', 'on', attributes)
+        self.hass.pool.block_till_done()
+        rec.block_till_done()
+
+        # Nothing refers to the attributes anymore
+        rec.query("DELETE FROM states")
+        steps = rec._purge_attributes()
+        next(steps)
+
+        self.hass.states.set('test.purge', 'off', attributes)
+        self.hass.pool.block_till_done()
+        rec.block_till_done()
+
+        for _ in steps:
+            pass
+
+        self.assertEqual([attributes], [
+            state.attributes for state in
+            recorder.query_states(recorder.QUERY_STATES)])
+
+    @patch('homeassistant.components.recorder.PURGE_CHUNK_SIZE', 3)
+    def test_purge(self):
+        """Test that expired states and events are deleted in chunks."""
+        rec = recorder._INSTANCE
+        rec.purge_days = 10
+        rec.purge_domains = {'sensor': 20}
+        rec.purge_event_types = {'keep_event': 20}
+
+        for value in range(5):
+            self.hass.states.set('test.old', value, {'old': True})
+            self.hass.states.set('sensor.old', value)
+            self.hass.bus.fire('old_event')
+            self.hass.bus.fire('keep_event')
+        self.hass.states.set('test.new', 'on')
+
+        self.hass.pool.block_till_done()
+        rec.block_till_done()
+
+        old = dt_util.utcnow() - timedelta(days=15)
+        rec.query("UPDATE states SET last_updated=? WHERE entity_id!=?",
+                  (old, 'test.new'))
+        rec.query("UPDATE events SET time_fired=? WHERE event_type IN (?, ?)",
+                  (old, 'old_event', 'keep_event'))
+
+        steps = list(rec._purge(dt_util.utcnow()))
+
+        # Chunks of 3 rows, so deleting 5 rows takes 2 steps
+        self.assertLess(4, len(steps))
+        self.assertEqual(['sensor.old', 'test.new'], sorted(set(
+            row[0] for row in recorder.query('SELECT entity_id FROM states'))))
+        self.assertEqual(['keep_event'], [
+            row[0] for row in recorder.query(
+                'SELECT DISTINCT event_type FROM events '
+                'WHERE event_type LIKE "%_event"')])
+        self.assertEqual([], recorder.query(
+            'SELECT * FROM state_attributes WHERE shared_attrs LIKE "%old%"'))
+
+    def test_purge_scheduled(self):
+        """Test that the purge runs on the recorder thread when due."""
+        rec = recorder._INSTANCE
+
+        with patch.object(rec, '_purge', return_value=iter([None])) as purge:
+            rec.purge_interval = 3600
+            rec._next_purge = 0
+            self.hass.bus.fire('wake_up')
+            self.hass.pool.block_till_done()
+            rec.block_till_done()
+
+            self.assertEqual(1, purge.call_count)
+            self.assertIsNone(rec._purge_steps)
+            self.assertLess(time.monotonic() + 3000, rec._next_purge)
+
+    def test_statistics_survive_restart(self):
+        """Test that a rollup continues where it was before a restart."""
+        rec = recorder._INSTANCE
+        time = dt_util.as_utc(datetime(2016, 5, 1, 10, 0, 0))
+
+        def write(value):
+            """Write a state change of the power sensor."""
+            rec._write_batch([ha.Event(EVENT_STATE_CHANGED, {
+                'entity_id': 'sensor.power',
+                'new_state': ha.State('sensor.power', value,
+                                      {'unit_of_measurement': 'W'},
+                                      time, time)})])
+
+        write(1)
+        write(5)
+        rec._statistics.clear()
+        write(3)
+
+        self.assertEqual([(1, 5, 3, 3, 3)], [tuple(row) for row in rec.query(
+            'SELECT min, max, mean, last, count FROM statistics_hour')])
+
+    def test_checkpoint_scheduled(self):
+        """Test that checkpoints hold the last state of every entity."""
+        rec = recorder._INSTANCE
+        self.hass.states.set('test.a', 1)
+        self.hass.states.set('test.a', 2)
+        self.hass.states.set('test.b', 1)
+        rec._next_checkpoint = 0
+        self.hass.pool.block_till_done()
+        rec.block_till_done()
+
+        self.assertEqual(['2', '1'], [row[0] for row in recorder.query(
+            'SELECT states.state FROM checkpoint_states INNER JOIN states '
+            'ON checkpoint_states.state_id = states.state_id '
+            'ORDER BY states.entity_id')])
+        self.assertLess(time.monotonic() + 3000, rec._next_checkpoint)
+
+    def test_migrate_attributes(self):
+        """Test that attributes of existing states are moved."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, recorder.DB_FILE)
+            conn = sqlite3.connect(db_path)
+            conn.executescript("""
+                CREATE TABLE schema_version (
+                    migration_id integer primary key, performed integer);
+                INSERT INTO schema_version VALUES (5, 0);
+                CREATE TABLE events (
+                    event_id integer primary key, event_type text,
+                    time_fired integer);
+                CREATE INDEX events__event_type ON events(event_type);
+                CREATE TABLE states (
+                    state_id integer primary key, entity_id text,
+                    state text, attributes text, last_changed integer,
+                    last_updated integer, created integer,
+                    utc_offset integer, event_id integer, domain text);
+                INSERT INTO states (entity_id, attributes)
+                VALUES ('test.old', '{"unit": "W"}');
+                INSERT INTO states (entity_id, attributes)
+                VALUES ('test.old_2', '{"unit": "W"}');
+            """)
+            conn.close()
+
+            rec = recorder.Recorder(MagicMock())
+            rec.db_path = db_path
+            rec._setup_connection()
+
+            self.assertEqual(['{"unit": "W"}'], [
+                row[0] for row in rec.query(
+                    'SELECT shared_attrs FROM state_attributes')])
+            self.assertEqual(
+                [('test.old', {'unit': 'W'}), ('test.old_2', {'unit': 'W'})],
+                [(row[1], json.loads(recorder._row_attributes(row)))
+                 for row in rec.query(recorder.QUERY_STATES)])
+            rec._close_connection()
+
+
+class TestRecorderFilter(unittest.TestCase):
+    """Test the include and exclude filters of the recorder."""
+
+    def recorded(self, config, events):
+        """Return the events of events a recorder with config queues."""
+        conf = recorder.CONFIG_SCHEMA({recorder.DOMAIN: config})
+        rec = recorder.Recorder(
+            MagicMock(), include=conf[recorder.DOMAIN][recorder.CONF_INCLUDE],
+            exclude=conf[recorder.DOMAIN][recorder.CONF_EXCLUDE])
+
+        for event in events:
+            rec.event_listener(event)
+
+        result = []
+        while not rec.queue.empty():
+            event = rec.queue.get()
+            result.append(event.data.get('entity_id', event.event_type))
+        return result
+
+    def state_changes(self, *entity_ids):
+        """Return state changed events for entity_ids."""
+        return [ha.Event(EVENT_STATE_CHANGED, {'entity_id': entity_id})
+                for entity_id in entity_ids]
+
+    def test_no_filter(self):
+        """Test that everything but time changes is recorded."""
+        self.assertEqual(['sensor.cpu_speed', 'call_service'], self.recorded(
+            {}, self.state_changes('sensor.cpu_speed') + [
+                ha.Event(EVENT_TIME_CHANGED), ha.Event(EVENT_CALL_SERVICE)]))
+
+    def test_exclude(self):
+        """Test excluding domains, entities and event types."""
+        self.assertEqual(['light.kitchen'], self.recorded({
+            recorder.CONF_EXCLUDE: {
+                recorder.CONF_DOMAINS: 'sensor',
+                recorder.CONF_ENTITIES: 'light.hallway',
+                recorder.CONF_EVENT_TYPES: [EVENT_CALL_SERVICE],
+            }}, self.state_changes(
+                'sensor.cpu_speed', 'light.hallway', 'light.kitchen') + [
+                    ha.Event(EVENT_CALL_SERVICE)]))
+
+    def test_include(self):
+        """Test including domains and entities."""
+        self.assertEqual(
+            ['light.kitchen', 'sensor.power'],
+            self.recorded({
+                recorder.CONF_INCLUDE: {
+                    recorder.CONF_DOMAINS: 'light',
+                    recorder.CONF_ENTITIES: 'sensor.power',
+                    recorder.CONF_EVENT_TYPES: EVENT_STATE_CHANGED,
+                },
+                recorder.CONF_EXCLUDE: {
+                    recorder.CONF_ENTITIES: 'light.hallway',
+                }}, self.state_changes(
+                    'light.kitchen', 'light.hallway', 'sensor.power',
+                    'sensor.cpu_speed') + [ha.Event(EVENT_CALL_SERVICE)]))
+
+
+class TestRecorderReadPool(unittest.TestCase):
+    """Test reading from a database file while the recorder writes."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Setup things to be run when tests are started."""
+        self.hass = get_test_home_assistant()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp_dir.name, recorder.DB_FILE)
+        with patch('homeassistant.core.Config.path', return_value=db_path):
+            recorder.setup(self.hass, {})
+        self.hass.start()
+        recorder._INSTANCE.block_till_done()
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """Stop everything that was started."""
+        self.hass.stop()
+        recorder._INSTANCE.block_till_done()
+        self.tmp_dir.cleanup()
+
+    def test_reads_do_not_wait_for_writer(self):
+        """Test that reads are served while the writer holds its lock."""
+        self.assertEqual('wal', recorder.query('PRAGMA journal_mode')[0][0])
+
+        self.hass.states.set('test.wal', 'on')
+        self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
+
+        result = []
+        reader = threading.Thread(target=lambda: result.extend(
+            recorder.query_states('SELECT * FROM states')))
+
+        with recorder._INSTANCE.lock:
+            reader.start()
+            reader.join(5)
+            self.assertFalse(reader.is_alive())
+
+        self.assertEqual(['test.wal'], [state.entity_id for state in result])
+        self.assertEqual(1, len(recorder._INSTANCE._read_opened))
+
+        # Read connections can not write
+        self.assertEqual([], recorder.query('DELETE FROM states'))
+        self.assertEqual(1, len(recorder.query('SELECT * FROM states')))
+
+    def test_query_iter(self):
+        """Test that rows are fetched in batches from a read connection."""
+        for value in range(5):
+            self.hass.states.set('test.iter', value)
+            self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
+
+        pool = recorder._INSTANCE._read_pool
+
+        with patch('homeassistant.components.recorder.QUERY_FETCH_SIZE', 2):
+            states = recorder.iter_states(
+                'SELECT * FROM states ORDER BY state_id')
+            self.assertEqual('0', next(states).state)
+            # The connection is held while the rows are consumed
+            idle = pool.qsize()
+            self.assertEqual(['1', '2', '3', '4'],
+                             [state.state for state in states])
+
+        self.assertEqual(idle + 1, pool.qsize())
+
+        rows = recorder.query_iter('SELECT * FROM states')
+        next(rows)
+        self.assertEqual(idle, pool.qsize())
+        rows.close()
+        self.assertEqual(idle + 1, pool.qsize())
+
+    def test_read_connections_busy(self):
+        """Test that a read opens an extra connection if all are busy."""
+        self.hass.states.set('test.busy', 'on')
+        self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
+
+        streams = []
+        for _ in range(recorder._INSTANCE.read_connections):
+            rows = recorder.query_iter('SELECT * FROM states')
+            next(rows)
+            streams.append(rows)
+
+        with patch('homeassistant.components.recorder.'
+                   'READ_CONNECTION_TIMEOUT', 0.01):
+            self.assertEqual(1, len(recorder.query('SELECT * FROM states')))
+
+        # The extra connection is closed instead of added to the pool
+        self.assertEqual(0, recorder._INSTANCE._read_pool.qsize())
+
+        for rows in streams:
+            rows.close()
+
+        self.assertEqual(recorder._INSTANCE.read_connections,
+                         recorder._INSTANCE._read_pool.qsize())
@@ -65,6 +65,14 @@ class TestEventHelpers(unittest.TestCase):
         self.hass.pool.block_till_done()
         self.assertEqual(2, len(runs))
 
+        scheduled = track_point_in_utc_time(
+            self.hass, lambda x: runs.append(1), birthday_paulus)
+        self.hass.scheduler.cancel(scheduled)
+
+        self._send_time_changed(after_birthday)
+        self.hass.pool.block_till_done()
+        self.assertEqual(2, len(runs))
+
     def test_track_time_change(self):
         """Test tracking time change."""
         wildcard_runs = []
@@ -8,6 +8,7 @@ import threading
 import voluptuous as vol
 
 from homeassistant import bootstrap, loader
+import homeassistant.config as config_util
 from homeassistant.const import (__version__, CONF_LATITUDE, CONF_LONGITUDE,
                                  CONF_NAME, CONF_CUSTOMIZE)
 import homeassistant.util.dt as dt_util
@@ -114,6 +115,23 @@ class TestBootstrap:
 
         assert state.attributes['hidden']
 
+    def test_job_queue_limits(self):
+        """Test limiting the job queues through configuration."""
+        config = config_util.CORE_CONFIG_SCHEMA({
+            CONF_LATITUDE: 50,
+            CONF_LONGITUDE: 50,
+            CONF_NAME: 'Test',
+            'job_queue_limits': {
+                'event_time': {'max': 100, 'overflow': 'coalesce'},
+                'not_a_priority': {'max': 10},
+            }})
+
+        bootstrap.process_ha_core_config(self.hass, config)
+
+        assert {'event_time': 'coalesce'} == {
+            name.lower(): queue['overflow'] for name, queue
+            in self.hass.pool.stats['queues'].items()}
+
     def test_handle_setup_circular_dependency(self):
         """Test the setup of circular dependencies."""
         loader.set_component('comp_b', MockModule('comp_b', ['comp_a']))
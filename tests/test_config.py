@@ -151,6 +151,9 @@ class TestConfig(unittest.TestCase):
             {'customize': 'bla'},
             {'customize': {'invalid_entity_id': {}}},
             {'customize': {'light.sensor': 100}},
+            {'job_queue_limits': {'event_time': {'max': 0}}},
+            {'job_queue_limits': {'event_time': {'max': 10,
+                                                 'overflow': 'explode'}}},
         ):
             with pytest.raises(MultipleInvalid):
                 config_util.CORE_CONFIG_SCHEMA(value)
@@ -160,6 +163,10 @@ class TestConfig(unittest.TestCase):
             'latitude': '-23.45',
             'longitude': '123.45',
             'temperature_unit': 'c',
+            'job_queue_limits': {
+                'event_time': {'max': 100, 'overflow': 'coalesce'},
+                'event_default': {'max': 1000},
+            },
             'customize': {
                 'sensor.temperature': {
                     'hidden': True,
@@ -1,6 +1,7 @@
 """Test to verify that Home Assistant core works."""
 # pylint: disable=protected-access,too-many-public-methods
 # pylint: disable=too-few-public-methods
+import json
 import os
 import signal
 import unittest
@@ -17,8 +18,9 @@ from homeassistant.exceptions import (
 import homeassistant.util.dt as dt_util
 from homeassistant.const import (
     __version__, EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP,
-    EVENT_STATE_CHANGED, ATTR_FRIENDLY_NAME, TEMP_CELSIUS,
-    TEMP_FAHRENHEIT)
+    EVENT_STATE_CHANGED, EVENT_STATE_CHANGED_BATCH, EVENT_TIME_CHANGED,
+    ATTR_FRIENDLY_NAME, ATTR_NOW, TEMP_CELSIUS, TEMP_FAHRENHEIT)
+from homeassistant.helpers.json import JSONEncoder
 
 from tests.common import get_test_home_assistant
 
@@ -132,6 +134,28 @@ class TestEvent(unittest.TestCase):
         }
         self.assertEqual(expected, event.as_dict())
 
+    def test_as_json(self):
+        """Test the JSON representation matches the JSON encoder."""
+        state = ha.State('light.bowl', 'on', {'brightness': 100})
+        event = ha.Event(EVENT_STATE_CHANGED, {
+            'entity_id': 'light.bowl',
+            'old_state': None,
+            'new_state': state,
+        })
+
+        self.assertEqual(json.dumps(event, cls=JSONEncoder), event.as_json())
+        self.assertEqual(json.dumps(event.data, cls=JSONEncoder),
+                         event.data_as_json())
+        self.assertIs(event.as_json(), event.as_json())
+        self.assertIn(state.as_json(), event.data_as_json())
+
+    def test_as_json_non_string_keys(self):
+        """Test encoding data with keys that are not strings."""
+        event = ha.Event('some_type', {1: 'one', 'two': [2]})
+
+        self.assertEqual({'1': 'one', 'two': [2]},
+                         json.loads(event.data_as_json()))
+
 
 class TestEventBus(unittest.TestCase):
     """Test EventBus methods."""
@@ -166,6 +190,82 @@ class TestEventBus(unittest.TestCase):
         # Try deleting listener while category doesn't exist either
         self.bus.remove_listener('test', listener)
 
+    def test_listen_entity_ids(self):
+        """Test listening for events of specific entities."""
+        self.bus._pool.add_worker()
+        runs = []
+        old_count = self.bus.listeners.get(EVENT_STATE_CHANGED, 0)
+
+        def listener(event):
+            runs.append(event.data['entity_id'])
+
+        self.bus.listen(EVENT_STATE_CHANGED, listener,
+                        ['light.kitchen', 'light.bowl'])
+        self.assertEqual(old_count + 1,
+                         self.bus.listeners[EVENT_STATE_CHANGED])
+
+        self.bus.fire(EVENT_STATE_CHANGED, {'entity_id': 'light.bowl'})
+        self.bus.fire(EVENT_STATE_CHANGED, {'entity_id': 'light.ceiling'})
+        self.bus.fire(EVENT_STATE_CHANGED, {'entity_id': ['light.bowl']})
+        self.bus.fire(EVENT_STATE_CHANGED)
+        self.bus.fire('other_event', {'entity_id': 'light.bowl'})
+        self.bus._pool.block_till_done()
+        self.assertEqual(['light.bowl'], runs)
+
+        self.bus.remove_listener(EVENT_STATE_CHANGED, listener)
+        self.assertEqual(old_count,
+                         self.bus.listeners.get(EVENT_STATE_CHANGED, 0))
+
+        self.bus.fire(EVENT_STATE_CHANGED, {'entity_id': 'light.kitchen'})
+        self.bus._pool.block_till_done()
+        self.assertEqual(['light.bowl'], runs)
+
+    def test_listen_entity_ids_no_jobs_for_other_entities(self):
+        """Test that no jobs are queued for entities nobody listens to."""
+        self.bus.listen(EVENT_STATE_CHANGED, lambda event: None,
+                        ['light.kitchen'])
+
+        with patch.object(self.bus._pool, 'add_job') as mock_add_job:
+            self.bus.fire(EVENT_STATE_CHANGED, {'entity_id': 'light.bowl'})
+            self.assertEqual(0, mock_add_job.call_count)
+
+            self.bus.fire(EVENT_STATE_CHANGED,
+                          {'entity_id': 'light.kitchen'})
+            self.assertEqual(1, mock_add_job.call_count)
+
+    def test_listen_callback(self):
+        """Test that callbacks are called from within fire."""
+        runs = []
+
+        @ha.callback
+        def listener(event):
+            runs.append(event)
+
+        self.bus.listen('test_callback', listener)
+
+        # The pool has no workers, so only callbacks can be run.
+        self.bus.fire('test_callback')
+        self.assertEqual(1, len(runs))
+
+        self.bus.remove_listener('test_callback', listener)
+        self.bus.fire('test_callback')
+        self.assertEqual(1, len(runs))
+
+    def test_listen_callback_exception(self):
+        """Test that an exception in a callback does not break fire."""
+        runs = []
+
+        @ha.callback
+        def bad_listener(event):
+            raise Exception("Test breaking callback")
+
+        self.bus.listen('test_callback', bad_listener)
+        self.bus.listen('test_callback',
+                        ha.callback(lambda event: runs.append(event)))
+
+        self.bus.fire('test_callback')
+        self.assertEqual(1, len(runs))
+
     def test_listen_once_event(self):
         """Test listen_once_event method."""
         runs = []
@@ -181,6 +281,83 @@ class TestEventBus(unittest.TestCase):
         self.assertEqual(1, len(runs))
 
 
+class TestScheduler(unittest.TestCase):
+    """Test Scheduler methods."""
+
+    def setUp(self):     # pylint: disable=invalid-name
+        """Setup things to be run when tests are started."""
+        self.pool = ha.create_worker_pool(1)
+        self.bus = ha.EventBus(self.pool)
+        self.scheduler = ha.Scheduler(self.bus, self.pool)
+        self.now = datetime(2016, 5, 15, 12, 0, 0, tzinfo=dt_util.UTC)
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """Stop down stuff we started."""
+        self.pool.stop()
+
+    def _send_time_changed(self, now):
+        """Send a time changed event."""
+        self.bus.fire(EVENT_TIME_CHANGED, {ATTR_NOW: now})
+        self.pool.block_till_done()
+
+    def test_schedule(self):
+        """Test that actions run once in order of their deadline."""
+        runs = []
+
+        self.scheduler.schedule(self.now + timedelta(seconds=2),
+                                lambda now: runs.append(2))
+        self.scheduler.schedule(self.now + timedelta(seconds=1),
+                                lambda now: runs.append(1))
+        self.assertEqual(2, self.scheduler.pending)
+
+        self._send_time_changed(self.now)
+        self.assertEqual([], runs)
+
+        self._send_time_changed(self.now + timedelta(seconds=1))
+        self.assertEqual([1], runs)
+        self.assertEqual(1, self.scheduler.pending)
+
+        self._send_time_changed(self.now + timedelta(seconds=5))
+        self._send_time_changed(self.now + timedelta(seconds=6))
+        self.assertEqual([1, 2], runs)
+        self.assertEqual(0, self.scheduler.pending)
+
+    def test_schedule_passes_time(self):
+        """Test that the action receives the time of the event."""
+        runs = []
+
+        self.scheduler.schedule(self.now, runs.append)
+        self._send_time_changed(self.now + timedelta(seconds=3))
+
+        self.assertEqual([self.now + timedelta(seconds=3)], runs)
+
+    def test_cancel(self):
+        """Test cancelling scheduled actions."""
+        runs = []
+
+        scheduled = [
+            self.scheduler.schedule(self.now + timedelta(seconds=sec),
+                                    lambda now, sec=sec: runs.append(sec))
+            for sec in range(5)]
+
+        self.scheduler.cancel(scheduled[1])
+        # Cancelling twice is a no-op
+        self.scheduler.cancel(scheduled[1])
+        self.assertEqual(4, self.scheduler.pending)
+
+        for item in scheduled[2:]:
+            self.scheduler.cancel(item)
+        self.assertEqual(1, self.scheduler.pending)
+
+        self._send_time_changed(self.now + timedelta(seconds=10))
+        self.assertEqual([0], runs)
+        self.assertEqual(0, self.scheduler.pending)
+
+        # Cancelling an action that already ran is a no-op
+        self.scheduler.cancel(scheduled[0])
+        self.assertEqual(0, self.scheduler.pending)
+
+
 class TestState(unittest.TestCase):
     """Test State methods."""
 
@@ -217,6 +394,13 @@ class TestState(unittest.TestCase):
         state = ha.State('domain.hello', 'world', {'some': 'attr'})
         self.assertEqual(state, ha.State.from_dict(state.as_dict()))
 
+    def test_as_json(self):
+        """Test the JSON representation is created once."""
+        state = ha.State('domain.hello', 'world', {'some': 'attr'})
+
+        self.assertEqual(json.dumps(state, cls=JSONEncoder), state.as_json())
+        self.assertIs(state.as_json(), state.as_json())
+
     def test_dict_conversion_with_wrong_data(self):
         """Test conversion with wrong data."""
         self.assertIsNone(ha.State.from_dict(None))
@@ -286,6 +470,47 @@ class TestStateMachine(unittest.TestCase):
         states = sorted(state.entity_id for state in self.states.all())
         self.assertEqual(['light.bowl', 'switch.ac'], states)
 
+        states = [state.entity_id for state in self.states.all('Light')]
+        self.assertEqual(['light.bowl'], states)
+        self.assertEqual([], self.states.all('sensor'))
+
+    def test_snapshot_follows_writes(self):
+        """Test that all and the domain index reflect every write."""
+        before = self.states.all()
+
+        self.states.set('light.kitchen', 'on')
+        self.assertEqual(2, len(before))
+        self.assertEqual(3, len(self.states.all()))
+        self.assertEqual(['light.bowl', 'light.kitchen'],
+                         sorted(self.states.entity_ids('light')))
+
+        self.states.set('light.kitchen', 'off')
+        self.assertIn(self.states.get('light.kitchen'),
+                      self.states.all('light'))
+        self.assertIn(self.states.get('light.kitchen'), self.states.all())
+
+        self.states.remove('light.kitchen')
+        self.states.remove('switch.ac')
+        self.assertEqual(['light.bowl'], self.states.entity_ids())
+        self.assertEqual([], self.states.entity_ids('switch'))
+        self.assertEqual(1, len(self.states.all()))
+
+    def test_snapshot_read_during_write(self):
+        """Test a snapshot taken while a state is written is not kept."""
+        states = self.states
+
+        class ReadingDict(dict):
+            """Dict that lets a reader run right before it is changed."""
+
+            def __setitem__(self, key, value):
+                states.all()
+                super().__setitem__(key, value)
+
+        self.states._states = ReadingDict(self.states._states)
+        self.states.set('light.kitchen', 'on')
+
+        self.assertIn(self.states.get('light.kitchen'), self.states.all())
+
     def test_remove(self):
         """Test remove method."""
         self.pool.add_worker()
@@ -334,6 +559,77 @@ class TestStateMachine(unittest.TestCase):
         self.assertEqual(state.last_changed,
                          self.states.get('light.Bowl').last_changed)
 
+    def test_unchanged_parts_are_shared(self):
+        """Test that consecutive states share what did not change."""
+        self.states.set('light.Bowl', 'on', {'brightness': 100})
+        first = self.states.get('light.Bowl')
+
+        self.states.set('light.Bowl', 'off', {'brightness': 100})
+        second = self.states.get('light.Bowl')
+
+        self.assertIsNot(first, second)
+        self.assertIs(first.attributes, second.attributes)
+        self.assertIs(first.entity_id, second.entity_id)
+
+        self.states.set('light.Bowl', 'off', {'brightness': 50})
+        third = self.states.get('light.Bowl')
+
+        self.assertIs(second.state, third.state)
+        self.assertEqual({'brightness': 50}, third.attributes)
+        self.assertEqual({'brightness': 100}, second.attributes)
+
+    def test_empty_attributes_are_read_only(self):
+        """Test that states without attributes can not be altered."""
+        state = self.states.get('switch.AC')
+
+        self.assertEqual({}, state.attributes)
+        with self.assertRaises(TypeError):
+            state.attributes['hello'] = 'world'
+
+    def test_set_many(self):
+        """Test setting multiple states at once."""
+        self.pool.add_worker()
+        events = []
+        self.bus.listen(EVENT_STATE_CHANGED,
+                        lambda event: events.append(event))
+
+        self.states.set_many([
+            ('light.Bowl', 'on'),
+            ('switch.AC', 'on', {'power': 100}),
+            ('sensor.new', 5),
+        ])
+        self.pool.block_till_done()
+
+        self.assertEqual(['switch.ac', 'sensor.new'],
+                         [event.data['entity_id'] for event in events])
+        self.assertTrue(
+            self.states.is_state_attr('switch.AC', 'power', 100))
+        self.assertTrue(self.states.is_state('sensor.new', '5'))
+
+    def test_set_many_batch_event(self):
+        """Test the batch event is only fired when listened for."""
+        self.pool.add_worker()
+        batches = []
+
+        with patch.object(self.bus, 'fire') as mock_fire:
+            self.states.set_many([('light.Bowl', 'off')])
+
+        self.assertEqual([EVENT_STATE_CHANGED],
+                         [call[1][0] for call in mock_fire.mock_calls])
+
+        self.bus.listen(EVENT_STATE_CHANGED_BATCH,
+                        lambda event: batches.append(event))
+
+        self.states.set_many([('light.Bowl', 'off'), ('switch.AC', 'on'),
+                              ('light.kitchen', 'on')])
+        self.states.set_many([('light.Bowl', 'off')])
+        self.pool.block_till_done()
+
+        self.assertEqual(1, len(batches))
+        self.assertEqual(
+            ['switch.ac', 'light.kitchen'],
+            [change['entity_id'] for change in batches[0].data['changes']])
+
 
 class TestServiceCall(unittest.TestCase):
     """Test ServiceCall class."""
@@ -416,6 +712,71 @@ class TestServiceRegistry(unittest.TestCase):
         ha.SERVICE_CALL_LIMIT = orig_limit
 
 
+class TestJobProfiler(unittest.TestCase):
+    """Test JobProfiler methods."""
+
+    def test_disabled_by_default(self):
+        """Test that jobs are not profiled until enabled."""
+        profiler = ha.JobProfiler()
+        pool = ha.create_worker_pool(1, profiler=profiler)
+
+        pool.add_job(ha.JobPriority.EVENT_DEFAULT, (lambda _: None, None))
+        pool.block_till_done()
+        pool.stop()
+
+        self.assertEqual([], profiler.top())
+
+    def test_record_jobs(self):
+        """Test that jobs are accounted per callable."""
+        profiler = ha.JobProfiler()
+        profiler.enabled = True
+        pool = ha.create_worker_pool(1, profiler=profiler)
+
+        def fast_job(_):
+            """Return immediately."""
+            pass
+
+        def slow_job(_):
+            """Take a while."""
+            time.sleep(0.01)
+
+        for job in (fast_job, fast_job, slow_job):
+            pool.add_job(ha.JobPriority.EVENT_DEFAULT, (job, None))
+
+        pool.block_till_done()
+        pool.stop()
+
+        top = profiler.top()
+        self.assertEqual(2, len(top))
+        self.assertTrue(top[0]['name'].endswith('slow_job'))
+        self.assertEqual(1, top[0]['count'])
+        self.assertGreaterEqual(top[0]['max'], 0.01)
+        self.assertEqual(2, top[1]['count'])
+        self.assertEqual(1, len(profiler.top(1)))
+
+        profiler.reset()
+        self.assertEqual([], profiler.top())
+
+    def test_record_service(self):
+        """Test that service calls are accounted to the service."""
+        profiler = ha.JobProfiler()
+
+        def service_func(call):
+            """Handle the service call."""
+            pass
+
+        service = ha.Service(service_func, None, None, None)
+        call = ha.ServiceCall('test_domain', 'test_service')
+        profiler.record(lambda _: None, (service, call), 0.5)
+
+        profile = profiler.as_dict()
+        self.assertEqual('test_domain.test_service',
+                         profile['services'][0]['name'])
+        self.assertEqual(0.5, profile['services'][0]['total'])
+        self.assertTrue(
+            profile['callables'][0]['name'].endswith('service_func'))
+
+
 class TestConfig(unittest.TestCase):
     """Test configuration methods."""
 
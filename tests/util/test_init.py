@@ -1,5 +1,7 @@
 """Test Home Assistant util methods."""
 # pylint: disable=too-many-public-methods
+import threading
+import time
 import unittest
 from unittest.mock import patch
 from datetime import datetime, timedelta
@@ -259,3 +261,228 @@ class TestUtil(unittest.TestCase):
 
         self.assertTrue(tester.hello())
         self.assertTrue(tester.goodbye())
+
+
+class TestThreadPool(unittest.TestCase):
+    """Test the ThreadPool."""
+
+    def test_stats(self):
+        """Test that queue wait and run time are recorded per priority."""
+        pool = util.ThreadPool(lambda job: job(), 1)
+
+        pool.add_job(1, lambda: None)
+        pool.add_job(1, lambda: None)
+        pool.add_job(2, lambda: None)
+        pool.block_till_done()
+
+        stats = pool.stats
+        pool.stop()
+
+        self.assertEqual(1, stats['worker_count'])
+        self.assertEqual(0, stats['pending_jobs'])
+        self.assertEqual(2, stats['jobs']['1']['queue_wait']['count'])
+        self.assertEqual(2, stats['jobs']['1']['run_time']['count'])
+        self.assertEqual(1, stats['jobs']['2']['run_time']['count'])
+        self.assertEqual(
+            2, sum(stats['jobs']['1']['run_time']['buckets'].values()))
+
+    def test_autoscale(self):
+        """Test that the pool grows when jobs wait and shrinks when idle."""
+        release = threading.Event()
+        pool = util.ThreadPool(lambda job: job(), 1, max_worker_count=3,
+                               scale_latency=0, idle_timeout=0.1)
+
+        for _ in range(5):
+            pool.add_job(1, lambda: release.wait(5))
+
+        for _ in range(50):
+            if pool.worker_count == 3:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(3, pool.worker_count)
+
+        release.set()
+        pool.block_till_done()
+
+        for _ in range(50):
+            if pool.worker_count == 1:
+                break
+            time.sleep(0.05)
+
+        self.assertEqual(1, pool.worker_count)
+        pool.stop()
+
+    def test_no_autoscale_by_default(self):
+        """Test that the pool does not grow without max_worker_count."""
+        release = threading.Event()
+        pool = util.ThreadPool(lambda job: job(), 1, scale_latency=0)
+
+        for _ in range(3):
+            pool.add_job(1, lambda: release.wait(5))
+
+        time.sleep(0.1)
+        self.assertEqual(1, pool.worker_count)
+
+        release.set()
+        pool.stop()
+
+    def test_limit_drop_oldest(self):
+        """Test that the oldest job is dropped when a priority is full."""
+        runs = []
+        overflows = []
+        pool = util.ThreadPool(
+            lambda job: job[0](job[1]), 0,
+            overflow_callback=lambda *args: overflows.append(args))
+        pool.set_limit(1, 2, util.OVERFLOW_DROP_OLDEST)
+
+        for idx in range(4):
+            pool.add_job(1, (runs.append, idx))
+        pool.add_job(2, (runs.append, 'other'))
+
+        pool.add_worker()
+        pool.block_till_done()
+        stats = pool.stats
+        pool.stop()
+
+        self.assertEqual([2, 3, 'other'], runs)
+        self.assertEqual({'max_size': 2, 'overflow': 'drop_oldest',
+                          'pending': 0, 'dropped': 2, 'coalesced': 0},
+                         stats['queues']['1'])
+        self.assertEqual([(1, 'dropped', 1), (1, 'dropped', 2)], overflows)
+
+    def test_limit_coalesce(self):
+        """Test that pending jobs of the same handler are coalesced."""
+        runs = []
+        other_runs = []
+        pool = util.ThreadPool(lambda job: job[0](job[1]), 0)
+        pool.set_limit(1, 2, util.OVERFLOW_COALESCE)
+
+        for idx in range(5):
+            pool.add_job(1, (runs.append, idx))
+            pool.add_job(1, (other_runs.append, idx))
+
+        pool.add_worker()
+        pool.block_till_done()
+        stats = pool.stats
+        pool.stop()
+
+        # Both jobs keep their place and run with the newest argument
+        self.assertEqual([4], runs)
+        self.assertEqual([4], other_runs)
+        self.assertEqual(8, stats['queues']['1']['coalesced'])
+        self.assertEqual(0, stats['queues']['1']['dropped'])
+
+    def test_limit_block(self):
+        """Test that producers wait till there is room in the queue."""
+        release = threading.Event()
+        runs = []
+        pool = util.ThreadPool(lambda job: job[0](job[1]), 1)
+        pool.set_limit(1, 1, util.OVERFLOW_BLOCK)
+
+        pool.add_job(1, (lambda _: release.wait(5), None))
+        pool.add_job(1, (runs.append, 1))
+
+        producer = threading.Thread(
+            target=pool.add_job, args=(1, (runs.append, 2)))
+        producer.start()
+        producer.join(0.1)
+        self.assertTrue(producer.is_alive())
+
+        release.set()
+        producer.join(5)
+        pool.block_till_done()
+        stats = pool.stats
+        pool.stop()
+
+        self.assertEqual([1, 2], runs)
+        self.assertEqual(0, stats['queues']['1']['dropped'])
+
+    def test_limit_block_timeout(self):
+        """Test that the oldest job is dropped if blocking takes too long."""
+        runs = []
+        pool = util.ThreadPool(lambda job: job[0](job[1]), 0)
+        pool.block_timeout = 0.01
+        pool.set_limit(1, 1, util.OVERFLOW_BLOCK)
+
+        pool.add_job(1, (runs.append, 1))
+        pool.add_job(1, (runs.append, 2))
+
+        pool.add_worker()
+        pool.block_till_done()
+        stats = pool.stats
+        pool.stop()
+
+        self.assertEqual([2], runs)
+        self.assertEqual(1, stats['queues']['1']['dropped'])
+
+    def test_limit_deferred_block(self):
+        """Test that waiting for room is postponed till the block ends."""
+        runs = []
+        pool = util.ThreadPool(lambda job: job[0](job[1]), 0)
+        pool.block_timeout = 0.01
+        pool.set_limit(1, 1, util.OVERFLOW_BLOCK)
+
+        with util.defer_pool_waits():
+            pool.add_job(1, (runs.append, 1))
+            pool.add_job(1, (runs.append, 2))
+            self.assertEqual(2, pool.stats['queues']['1']['pending'])
+
+        self.assertEqual(1, pool.stats['queues']['1']['dropped'])
+
+        pool.add_worker()
+        pool.block_till_done()
+        pool.stop()
+
+        self.assertEqual([2], runs)
+
+    def test_limit_block_not_in_worker(self):
+        """Test that workers do not wait for room in their own pool."""
+        runs = []
+        pool = util.ThreadPool(lambda job: job[0](job[1]), 1)
+        pool.set_limit(1, 1, util.OVERFLOW_BLOCK)
+
+        def add_jobs(_):
+            """Add more jobs than the limit from the worker."""
+            for idx in range(3):
+                pool.add_job(1, (runs.append, idx))
+
+        start = time.monotonic()
+        pool.add_job(1, (add_jobs, None))
+        pool.block_till_done()
+        stats = pool.stats
+        pool.stop()
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual([0, 1, 2], runs)
+        self.assertEqual(0, stats['queues']['1']['dropped'])
+
+    def test_unlimited_job(self):
+        """Test that jobs added as not limited are never dropped."""
+        runs = []
+        pool = util.ThreadPool(lambda job: job[0](job[1]), 0)
+        pool.set_limit(1, 1, util.OVERFLOW_COALESCE)
+
+        for idx in range(3):
+            pool.add_job(1, (runs.append, idx), limited=False)
+
+        pool.add_worker()
+        pool.block_till_done()
+        stats = pool.stats
+        pool.stop()
+
+        self.assertEqual([0, 1, 2], runs)
+        self.assertEqual({'max_size': 1, 'overflow': 'coalesce', 'pending': 0,
+                          'dropped': 0, 'coalesced': 0}, stats['queues']['1'])
+
+    def test_invalid_limit(self):
+        """Test that invalid limits are refused."""
+        pool = util.ThreadPool(lambda job: None, 0)
+
+        with self.assertRaises(ValueError):
+            pool.set_limit(1, 1, 'invalid')
+
+        with self.assertRaises(ValueError):
+            pool.set_limit(1, 0)
+
+        pool.stop()